@@ -0,0 +1,62 @@
+import sys
+import json
+import argparse
+
+# Metrics compared between reports, and whether a higher value is better
+METRICS = (
+    ('latency.p50_ms', False),
+    ('latency.p95_ms', False),
+    ('latency.p99_ms', False),
+    ('throughput_per_s', True),
+)
+
+def metric_value(result, path):
+    value = result
+    for key in path.split('.'):
+        value = value.get(key) if isinstance(value, dict) else None
+    return value
+
+def compare_reports(baseline, candidate, tolerance):
+    """
+    Compares two benchmark reports suite by suite.
+
+    Args:
+        baseline (dict): The reference report from benchmarks.run.
+        candidate (dict): The report to check.
+        tolerance (float): Allowed relative change before a metric counts as a regression.
+
+    Returns:
+        list: (suite, metric, baseline value, candidate value, relative change, regressed) rows.
+    """
+    rows = []
+    for suite, base_result in baseline['results'].items():
+        new_result = candidate['results'].get(suite)
+        if new_result is None or 'skipped' in base_result or 'skipped' in new_result:
+            continue
+        for path, higher_is_better in METRICS:
+            before, after = metric_value(base_result, path), metric_value(new_result, path)
+            if not before or after is None:
+                continue
+            change = (after - before) / before
+            regressed = change < -tolerance if higher_is_better else change > tolerance
+            rows.append((suite, path, before, after, change, regressed))
+    return rows
+
+def main():
+    parser = argparse.ArgumentParser(description="Compare two benchmark reports and flag regressions.")
+    parser.add_argument('baseline', help="Reference JSON report")
+    parser.add_argument('candidate', help="JSON report to check")
+    parser.add_argument('--tolerance', type=float, default=0.10, help="Allowed relative change, e.g. 0.10 for 10%%")
+    args = parser.parse_args()
+
+    with open(args.baseline) as baseline, open(args.candidate) as candidate:
+        rows = compare_reports(json.load(baseline), json.load(candidate), args.tolerance)
+
+    for suite, path, before, after, change, regressed in rows:
+        flag = "REGRESSION" if regressed else "ok"
+        print(f"{suite:<8} {path:<18} {before:>10} -> {after:<10} {change:+7.1%}  {flag}")
+
+    sys.exit(1 if any(row[5] for row in rows) else 0)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,113 @@
+import io
+import os
+import random
+import shutil
+import tempfile
+import subprocess
+from PIL import Image, ImageDraw
+from benchmarks.stub_server import FLAGGED_WORDS, BORDERLINE_WORDS
+
+# Vocabulary of the synthetic text corpus
+SUBJECTS = ('The team', 'My neighbour', 'This product', 'Our teacher', 'The new phone', 'A local band', 'The city council')
+VERBS = ('announced', 'reviewed', 'shipped', 'discussed', 'celebrated', 'postponed', 'recommended')
+OBJECTS = ('the summer festival', 'a faster update', 'the quarterly report', 'their latest album', 'a community garden')
+ENDINGS = ('yesterday.', 'after a long week.', 'to everyone\'s surprise.', 'with great results.', 'online.')
+
+def text_corpus(count, seed=0, flagged_ratio=0.05, borderline_ratio=0.1):
+    """
+    Generates distinct synthetic sentences with a controlled share of problem texts.
+
+    Args:
+        count (int): Number of sentences.
+        seed (int): Random seed.
+        flagged_ratio (float): Share of sentences containing a clearly disallowed word.
+        borderline_ratio (float): Share of sentences the stub scores as ambiguous.
+
+    Returns:
+        list: The sentences.
+    """
+    rng = random.Random(seed)
+    sentences = []
+    for index in range(count):
+        sentence = f"{rng.choice(SUBJECTS)} {rng.choice(VERBS)} {rng.choice(OBJECTS)} {rng.choice(ENDINGS)}"
+        roll = rng.random()
+        if roll < flagged_ratio:
+            sentence += f" I {rng.choice(FLAGGED_WORDS)} it."
+        elif roll < flagged_ratio + borderline_ratio:
+            sentence += f" What a {rng.choice(BORDERLINE_WORDS)}."
+        # The index keeps every sentence distinct so the verdict cache cannot hide work
+        sentences.append(f"{sentence} (#{index})")
+    return sentences
+
+def generate_image(seed=0, size=(1280, 720), text=None):
+    """
+    Draws a synthetic PNG of random shapes, optionally with a caption.
+
+    Args:
+        seed (int): Random seed.
+        size (tuple): Width and height in pixels.
+        text (str): Caption drawn across the image, for the OCR path.
+
+    Returns:
+        bytes: The PNG payload.
+    """
+    rng = random.Random(seed)
+    image = Image.new('RGB', size, tuple(rng.randrange(256) for _ in range(3)))
+    draw = ImageDraw.Draw(image)
+    for _ in range(20):
+        x0, y0 = rng.randrange(size[0]), rng.randrange(size[1])
+        box = [x0, y0, x0 + rng.randrange(20, 300), y0 + rng.randrange(20, 300)]
+        color = tuple(rng.randrange(256) for _ in range(3))
+        (draw.ellipse if rng.random() < 0.5 else draw.rectangle)(box, fill=color)
+    if text:
+        draw.rectangle([0, size[1] // 3, size[0], size[1] // 3 + 80], fill=(255, 255, 255))
+        draw.text((40, size[1] // 3 + 20), text, fill=(0, 0, 0), font_size=40)
+
+    buffered = io.BytesIO()
+    image.save(buffered, format='PNG', compress_level=1)
+    return buffered.getvalue()
+
+def ffmpeg_available():
+    return shutil.which('ffmpeg') is not None
+
+def generate_video(seconds=10, size=(640, 360), rate=25, with_audio=True):
+    """
+    Renders a synthetic MP4 from ffmpeg's test sources.
+
+    Args:
+        seconds (int): Duration.
+        size (tuple): Width and height in pixels.
+        rate (int): Frames per second.
+        with_audio (bool): Add a sine wave audio track.
+
+    Returns:
+        bytes: The MP4 payload, or None if ffmpeg is not installed.
+    """
+    if not ffmpeg_available():
+        return None
+    command = ["ffmpeg", "-v", "error", "-f", "lavfi", "-i", f"testsrc2=duration={seconds}:size={size[0]}x{size[1]}:rate={rate}"]
+    if with_audio:
+        command += ["-f", "lavfi", "-i", f"sine=frequency=440:duration={seconds}", "-c:a", "aac", "-shortest"]
+    command += ["-c:v", "libx264", "-pix_fmt", "yuv420p", "-movflags", "+faststart"]
+    return _render(command, '.mp4')
+
+def generate_audio(seconds=30):
+    """
+    Renders a synthetic MP3 sine wave.
+
+    Args:
+        seconds (int): Duration.
+
+    Returns:
+        bytes: The MP3 payload, or None if ffmpeg is not installed.
+    """
+    if not ffmpeg_available():
+        return None
+    return _render(["ffmpeg", "-v", "error", "-f", "lavfi", "-i", f"sine=frequency=440:duration={seconds}", "-q:a", "4"], '.mp3')
+
+def _render(command, suffix):
+    with tempfile.TemporaryDirectory() as directory:
+        path = os.path.join(directory, 'fixture' + suffix)
+        subprocess.run(command + ["-y", path], check=True)
+        with open(path, 'rb') as rendered:
+            return rendered.read()
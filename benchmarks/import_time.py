@@ -0,0 +1,98 @@
+import os
+import sys
+import argparse
+import subprocess
+
+# Entry modules checked by default, and the cumulative import time each may take, in ms
+IMPORT_BUDGETS_MS = {
+    'main': 150,
+    'bulk': 50,
+}
+
+# Heavy dependencies that must only be imported once content that needs them shows up
+LAZY_MODULES = ('openai', 'PIL', 'numpy', 'pytesseract', 'requests', 'langdetect', 'transformers', 'torch')
+
+# The repository root, which the measured interpreter runs from
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+def measure_import(module, runs=5):
+    """
+    Imports a module in fresh interpreters under `python -X importtime`.
+
+    Args:
+        module (str): The module to import, e.g. 'main'.
+        runs (int): Number of interpreters started; the fastest run is kept, since
+            the first one may also compile bytecode.
+
+    Returns:
+        tuple: The cumulative import time in ms, the set of imported top-level
+        packages, and the (self time in ms, module) pairs of the fastest run.
+    """
+    best = None
+    for _ in range(runs):
+        result = subprocess.run(
+            [sys.executable, "-X", "importtime", "-c", f"import {module}"],
+            cwd=REPO_ROOT, capture_output=True, text=True, check=True
+        )
+        entries = parse_importtime(result.stderr)
+        total_ms = next(cumulative for _, cumulative, name in reversed(entries) if name == module)
+        if best is None or total_ms < best[0]:
+            best = (total_ms, entries)
+
+    total_ms, entries = best
+    packages = {name.split('.')[0] for _, _, name in entries}
+    return total_ms, packages, sorted(((self_ms, name) for self_ms, _, name in entries), reverse=True)
+
+def parse_importtime(output):
+    """
+    Parses the report printed by `python -X importtime`.
+
+    Args:
+        output (str): The interpreter's stderr.
+
+    Returns:
+        list: (self ms, cumulative ms, module) tuples in the order they were reported.
+    """
+    entries = []
+    for line in output.splitlines():
+        if not line.startswith('import time:') or 'self [us]' in line:
+            continue
+        self_us, cumulative_us, name = line[len('import time:'):].split('|')
+        entries.append((int(self_us) / 1000, int(cumulative_us) / 1000, name.strip()))
+    return entries
+
+def check_module(module, budget_ms, runs):
+    """
+    Returns:
+        list: Descriptions of the budget and lazy import violations; empty if there are none.
+    """
+    total_ms, packages, slowest = measure_import(module, runs)
+    print(f"{module}: {total_ms:.1f} ms (budget {budget_ms} ms)")
+    for self_ms, name in slowest[:10]:
+        print(f"    {self_ms:7.1f} ms  {name}")
+
+    violations = []
+    if total_ms > budget_ms:
+        violations.append(f"importing {module} took {total_ms:.1f} ms, over the {budget_ms} ms budget")
+    for package in sorted(packages.intersection(LAZY_MODULES)):
+        violations.append(f"importing {module} loads {package}, which must be imported lazily")
+    return violations
+
+def main():
+    parser = argparse.ArgumentParser(description="Check the import time of the entry modules against their budget.")
+    parser.add_argument('modules', nargs='*', help=f"Modules to check (default: {', '.join(IMPORT_BUDGETS_MS)})")
+    parser.add_argument('--budget-ms', type=float, help="Budget for every checked module, overriding the defaults")
+    parser.add_argument('--runs', type=int, default=5, help="Interpreters started per module; the fastest counts")
+    args = parser.parse_args()
+
+    violations = []
+    for module in args.modules or list(IMPORT_BUDGETS_MS):
+        budget_ms = args.budget_ms or IMPORT_BUDGETS_MS.get(module, IMPORT_BUDGETS_MS['main'])
+        violations += check_module(module, budget_ms, args.runs)
+
+    for violation in violations:
+        print(f"FAIL: {violation}")
+    sys.exit(1 if violations else 0)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,214 @@
+import io
+import os
+import sys
+import json
+import time
+import types
+import argparse
+import datetime
+import platform
+import subprocess
+from concurrent.futures import ThreadPoolExecutor
+from utils.latency import latency_summary
+from benchmarks.stub_server import StubServer, ENDPOINTS
+from benchmarks import fixtures
+
+# Benchmark suites, in the order they run
+SUITES = ('text', 'mixed', 'video', 'ocr')
+
+# Default response delay per stub endpoint, roughly matching the real API
+DEFAULT_LATENCY = {
+    'moderations': 'lognormal:0.08:0.3',
+    'chat': 'lognormal:0.6:0.4',
+    'transcriptions': 'lognormal:1.0:0.3',
+    'image_edits': 'lognormal:1.5:0.3',
+}
+
+def point_clients_at(stub):
+    """
+    Routes every OpenAI client created afterwards, and media downloads, to the stub server.
+
+    Must run before the first moderation call, since the shared clients read the base
+    URL when they are created.
+
+    Args:
+        stub (StubServer): The running stub server.
+    """
+    os.environ['OPENAI_BASE_URL'] = f"{stub.url}/v1"
+    try:
+        import utils.config
+    except ImportError:
+        # utils/config.py holds the real API key and is not committed; the stub accepts any key
+        config = types.ModuleType('utils.config')
+        config.OPENAI_API_KEY = 'benchmark'
+        sys.modules['utils.config'] = config
+
+    # Media is served by the stub on the loopback interface, which downloads refuse by default
+    from utils import fetcher
+    fetcher.ALLOW_PRIVATE_HOSTS = True
+
+    # The stub has no account limits, so the client-side limiter would only skew results
+    from moderation import provider
+    provider.rate_limiter = provider.RateLimiter(10 ** 9, 10 ** 12)
+
+def measure(calls, clients=1):
+    """
+    Runs calls, `clients` at a time, timing each one.
+
+    Args:
+        calls (list): Zero-argument callables returning a result with a 'Status' or a verdict tuple.
+        clients (int): Number of calls in flight at the same time.
+
+    Returns:
+        dict: Run count, wall time, throughput, latency summary and verdict counts.
+    """
+    def timed(call):
+        started = time.perf_counter()
+        result = call()
+        return time.perf_counter() - started, result
+
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=clients) as executor:
+        outcomes = list(executor.map(timed, calls))
+    wall = time.perf_counter() - started
+
+    verdicts = {}
+    for _, result in outcomes:
+        status = result['Status'] if isinstance(result, dict) else result[0]
+        verdicts[status] = verdicts.get(status, 0) + 1
+    return {
+        'runs': len(outcomes),
+        'wall_seconds': round(wall, 3),
+        'throughput_per_s': round(len(outcomes) / wall, 2) if wall else 0.0,
+        'latency': latency_summary([seconds for seconds, _ in outcomes]),
+        'verdicts': verdicts,
+    }
+
+def bench_text(stub, args):
+    from main import moderate_content
+
+    corpus = fixtures.text_corpus(args.requests * args.items, seed=args.seed)
+    policies = {'backend': args.backend}
+    requests = [
+        [{'type': 'text', 'text': text} for text in corpus[index:index + args.items]]
+        for index in range(0, len(corpus), args.items)
+    ]
+    return measure([lambda items=items: moderate_content(items, policies, concurrent=True) for items in requests], args.clients)
+
+def bench_mixed(stub, args):
+    from main import moderate_content
+
+    corpus = fixtures.text_corpus(args.requests * 3, seed=args.seed)
+    policies = {'backend': args.backend}
+    requests = []
+    for index in range(args.requests):
+        image_url = stub.add_media(f"image-{index}.png", fixtures.generate_image(seed=args.seed + index), 'image/png')
+        items = [{'type': 'text', 'text': text} for text in corpus[index * 3:index * 3 + 3]]
+        items.append({'type': 'image_url', 'image_url': {'url': image_url}})
+        requests.append(items)
+    return measure([lambda items=items: moderate_content(items, policies, concurrent=True) for items in requests], args.clients)
+
+def bench_video(stub, args):
+    from moderation.video_moderation import moderate_video
+    from utils.cache import verdict_cache
+
+    video = fixtures.generate_video(seconds=args.video_seconds)
+    if video is None:
+        return {'skipped': 'ffmpeg is not installed'}
+    video_url = stub.add_media('video.mp4', video, 'video/mp4')
+    policies = {'backend': args.backend}
+
+    def run():
+        # Every run must moderate the video from scratch
+        verdict_cache.clear()
+        return moderate_video({'type': 'video_url', 'video_url': {'url': video_url}}, policies)
+
+    return measure([run] * args.video_runs)
+
+def bench_ocr(stub, args):
+    from PIL import Image
+    from moderation.ocr import ocr_image, is_tesseract_installed
+
+    if not is_tesseract_installed():
+        return {'skipped': 'Tesseract is not installed'}
+    corpus = fixtures.text_corpus(args.requests, seed=args.seed, flagged_ratio=0, borderline_ratio=0)
+    images = [
+        Image.open(io.BytesIO(fixtures.generate_image(seed=args.seed + index, text=text)))
+        for index, text in enumerate(corpus)
+    ]
+
+    def run(image):
+        text = ocr_image(image)
+        return ("Approved" if text else "Empty", text, [])
+
+    return measure([lambda image=image: run(image) for image in images], args.clients)
+
+def git_commit():
+    try:
+        return subprocess.run(["git", "rev-parse", "HEAD"], capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+def main():
+    parser = argparse.ArgumentParser(description="Run the offline moderation benchmarks against a local OpenAI stand-in.")
+    parser.add_argument('--suites', default=','.join(SUITES), help=f"Comma-separated suites to run ({', '.join(SUITES)})")
+    parser.add_argument('--requests', type=int, default=50, help="Requests per text, mixed and OCR suite")
+    parser.add_argument('--items', type=int, default=10, help="Text items per request in the text suite")
+    parser.add_argument('--clients', type=int, default=1, help="Requests in flight at the same time")
+    parser.add_argument('--video-runs', type=int, default=3, help="Number of times the video is moderated")
+    parser.add_argument('--video-seconds', type=int, default=20, help="Length of the synthetic video")
+    parser.add_argument('--backend', default='openai', help="Moderation backend selected through the policies")
+    parser.add_argument('--latency', action='append', default=[], metavar='ENDPOINT=SPEC',
+                        help=f"Stub latency per endpoint ({', '.join(ENDPOINTS.values())}), e.g. chat=uniform:0.2:0.5")
+    parser.add_argument('--recordings', help="JSON file of recorded responses per endpoint to replay instead of synthetic ones")
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--output', help="Path of the JSON report; printed to stdout when omitted")
+    args = parser.parse_args()
+
+    latency = dict(DEFAULT_LATENCY)
+    for setting in args.latency:
+        endpoint, _, spec = setting.partition('=')
+        latency[endpoint] = spec
+    recordings = None
+    if args.recordings:
+        with open(args.recordings) as recorded:
+            recordings = json.load(recorded)
+
+    stub = StubServer(latency=latency, recordings=recordings, seed=args.seed).start()
+    point_clients_at(stub)
+    from utils.cache import verdict_cache
+
+    results = {}
+    try:
+        for suite in args.suites.split(','):
+            verdict_cache.clear()
+            calls_before = stub.calls()
+            result = globals()[f"bench_{suite}"](stub, args)
+            calls_after = stub.calls()
+            result['api_calls'] = {
+                endpoint: calls_after[endpoint] - calls_before.get(endpoint, 0)
+                for endpoint in calls_after if calls_after[endpoint] != calls_before.get(endpoint, 0)
+            }
+            results[suite] = result
+    finally:
+        stub.stop()
+
+    report = {
+        'meta': {
+            'timestamp': datetime.datetime.now().isoformat(),
+            'commit': git_commit(),
+            'python': platform.python_version(),
+            'platform': platform.platform(),
+            'cpu_count': os.cpu_count(),
+        },
+        'config': dict(vars(args), latency=latency),
+        'results': results,
+    }
+    if args.output:
+        with open(args.output, 'w') as output:
+            json.dump(report, output, indent=4)
+    else:
+        print(json.dumps(report, indent=4))
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,236 @@
+import json
+import time
+import random
+import threading
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from urllib.parse import urlparse
+
+# Words that make synthetic moderation scores clearly disallowed or ambiguous
+FLAGGED_WORDS = ('kill', 'hate', 'nude')
+BORDERLINE_WORDS = ('fight', 'damn', 'weapon')
+
+# Every category reported by the moderation endpoint
+MODERATION_CATEGORIES = (
+    'harassment', 'harassment/threatening', 'hate', 'hate/threatening', 'illicit', 'illicit/violent',
+    'self-harm', 'self-harm/instructions', 'self-harm/intent', 'sexual', 'sexual/minors',
+    'violence', 'violence/graphic',
+)
+
+# Endpoint names used for latency settings, recordings and call counters
+ENDPOINTS = {
+    '/v1/moderations': 'moderations',
+    '/v1/chat/completions': 'chat',
+    '/v1/audio/transcriptions': 'transcriptions',
+    '/v1/images/edits': 'image_edits',
+}
+
+# Seconds of audio covered by each synthetic transcription segment
+TRANSCRIPT_SEGMENT_SECONDS = 5
+
+class LatencyModel:
+    """
+    Random response delay parsed from a spec string.
+
+    Supported specs are 'constant:SECONDS', 'uniform:LOW:HIGH' and
+    'lognormal:MEDIAN:SIGMA'.
+    """
+
+    def __init__(self, spec, rng):
+        self.spec = spec
+        kind, *params = spec.split(':')
+        self.kind = kind
+        self.params = [float(param) for param in params]
+        self._rng = rng
+        expected = {'constant': 1, 'uniform': 2, 'lognormal': 2}
+        if kind not in expected or len(self.params) != expected[kind]:
+            raise ValueError(f"Invalid latency spec: {spec}")
+
+    def sample(self):
+        if self.kind == 'constant':
+            return self.params[0]
+        if self.kind == 'uniform':
+            return self._rng.uniform(*self.params)
+        median, sigma = self.params
+        return median * self._rng.lognormvariate(0, sigma)
+
+class StubServer:
+    """
+    Local HTTP server standing in for the OpenAI API and for media hosting.
+
+    OpenAI endpoints answer with synthetic responses, or replay recorded responses
+    round-robin, after a delay drawn from the endpoint's latency model. Media
+    registered with add_media is served under /media/.
+    """
+
+    def __init__(self, latency=None, recordings=None, seed=0):
+        """
+        Args:
+            latency (dict): Latency spec per endpoint name (see ENDPOINTS); unlisted
+                endpoints answer immediately.
+            recordings (dict): Lists of recorded JSON responses per endpoint name.
+            seed (int): Seed for the latency models.
+        """
+        rng = random.Random(seed)
+        self.latency = {name: LatencyModel(spec, rng) for name, spec in (latency or {}).items()}
+        self.recordings = recordings or {}
+        self.media = {}
+        self._lock = threading.Lock()
+        self._calls = {}
+        self._replayed = {}
+        self._server = ThreadingHTTPServer(('127.0.0.1', 0), self._handler_class())
+        self._server.daemon_threads = True
+        self._thread = None
+
+    @property
+    def url(self):
+        host, port = self._server.server_address
+        return f"http://{host}:{port}"
+
+    def start(self):
+        self._thread = threading.Thread(target=self._server.serve_forever, daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._server.shutdown()
+        self._server.server_close()
+
+    def add_media(self, name, data, content_type):
+        """
+        Serves a payload at /media/<name>.
+
+        Returns:
+            str: The payload's URL.
+        """
+        self.media[name] = (data, content_type)
+        return f"{self.url}/media/{name}"
+
+    def calls(self):
+        """
+        Returns:
+            dict: Number of requests served per endpoint name.
+        """
+        with self._lock:
+            return dict(self._calls)
+
+    def _count(self, name):
+        with self._lock:
+            self._calls[name] = self._calls.get(name, 0) + 1
+
+    def _replay(self, name):
+        responses = self.recordings.get(name)
+        if not responses:
+            return None
+        with self._lock:
+            index = self._replayed.get(name, 0)
+            self._replayed[name] = index + 1
+        return responses[index % len(responses)]
+
+    def _handler_class(self):
+        stub = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = 'HTTP/1.1'
+
+            def do_GET(self):
+                name = urlparse(self.path).path[len('/media/'):]
+                if not self.path.startswith('/media/') or name not in stub.media:
+                    self._send(404, b'not found', 'text/plain')
+                    return
+                stub._count('media')
+                data, content_type = stub.media[name]
+                self._send(200, data, content_type)
+
+            def do_POST(self):
+                body = self.rfile.read(int(self.headers.get('Content-Length', 0)))
+                name = ENDPOINTS.get(urlparse(self.path).path)
+                if name is None:
+                    self._send(404, b'{"error": {"message": "not found"}}', 'application/json')
+                    return
+
+                stub._count(name)
+                if name in stub.latency:
+                    time.sleep(max(0.0, stub.latency[name].sample()))
+
+                response = stub._replay(name)
+                if response is None:
+                    response = synthetic_response(name, body)
+                self._send(200, json.dumps(response).encode('utf-8'), 'application/json')
+
+            def _send(self, status, data, content_type):
+                self.send_response(status)
+                self.send_header('Content-Type', content_type)
+                self.send_header('Content-Length', str(len(data)))
+                self.end_headers()
+                self.wfile.write(data)
+
+            def log_message(self, format, *args):
+                pass
+
+        return Handler
+
+def synthetic_response(name, body):
+    """
+    Builds a plausible response for an OpenAI endpoint.
+
+    Args:
+        name (str): The endpoint name.
+        body (bytes): The raw request body.
+
+    Returns:
+        dict: The JSON response.
+    """
+    if name == 'moderations':
+        inputs = json.loads(body)['input']
+        inputs = inputs if isinstance(inputs, list) else [inputs]
+        return {'id': 'modr-stub', 'model': 'omni-moderation-latest', 'results': [moderation_result(text) for text in inputs]}
+
+    if name == 'chat':
+        # The texts are in the last message; the system message holds the policy's prompt
+        prompt = json.loads(body)['messages'][-1]['content']
+        if prompt.startswith('Texts:\n'):
+            entries = json.loads(prompt.split('Texts:\n', 1)[1].rsplit('\n\nResponse:', 1)[0])
+            content = {'results': [dict(chat_verdict(entry['text']), index=entry['index']) for entry in entries]}
+        else:
+            text = prompt.rsplit('Text:\n', 1)[-1].rsplit('\n\nResponse:', 1)[0]
+            content = chat_verdict(text)
+        return {
+            'id': 'chatcmpl-stub', 'object': 'chat.completion', 'created': int(time.time()), 'model': 'stub',
+            'choices': [{'index': 0, 'finish_reason': 'stop', 'message': {'role': 'assistant', 'content': json.dumps(content)}}],
+        }
+
+    if name == 'transcriptions':
+        # Synthetic speech length grows with the upload size, roughly 16 kB per second of mp3
+        duration = max(1.0, len(body) / 16000)
+        segments = []
+        start = 0.0
+        while start < duration:
+            end = min(duration, start + TRANSCRIPT_SEGMENT_SECONDS)
+            segments.append({'id': len(segments), 'start': start, 'end': end, 'text': ' The weather is calm today.'})
+            start = end
+        return {
+            'text': ''.join(segment['text'] for segment in segments).strip(),
+            'language': 'english', 'duration': duration, 'segments': segments,
+        }
+
+    return {'created': int(time.time()), 'data': [{'url': 'https://example.invalid/edited.png'}]}
+
+def moderation_result(text):
+    lowered = text.lower()
+    score = 0.01
+    if any(word in lowered for word in FLAGGED_WORDS):
+        score = 0.97
+    elif any(word in lowered for word in BORDERLINE_WORDS):
+        score = 0.4
+    scores = {category: 0.001 for category in MODERATION_CATEGORIES}
+    scores['harassment'] = score
+    return {
+        'flagged': score >= 0.5,
+        'categories': {category: value >= 0.5 for category, value in scores.items()},
+        'category_scores': scores,
+    }
+
+def chat_verdict(text):
+    if any(word in text.lower() for word in FLAGGED_WORDS):
+        return {'decision': 'Rejected', 'reason': 'Synthetic rejection', 'tags': ['harassment']}
+    return {'decision': 'Approved', 'reason': 'Synthetic approval', 'tags': []}
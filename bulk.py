@@ -0,0 +1,228 @@
+import os
+import json
+import time
+from concurrent.futures import ThreadPoolExecutor, FIRST_COMPLETED, wait
+from utils.logger import logger
+from utils.latency import latency_summary
+from utils.cache import ERROR_REASON_PREFIX
+
+# Number of requests moderated at the same time
+DEFAULT_WORKERS = 8
+
+# Results written between fsyncs of the output file
+CHECKPOINT_INTERVAL = 50
+
+# Results between progress log lines
+PROGRESS_INTERVAL = 100
+
+def run_bulk(input_path, output_path, moderate, workers=DEFAULT_WORKERS, ordered=True, sensitivity='medium'):
+    """
+    Streams a JSONL file of moderation requests through a moderation function.
+
+    Each input line is either a JSON object with an 'input' list of content items and
+    optional 'id', 'policies' and 'sensitivity' keys, or a bare list of content items.
+    Requests without an id are identified by their line number. Each result is written
+    to output_path as one JSON line with the request's 'id' and either its 'result' or
+    an 'error'.
+
+    The output file doubles as the checkpoint: on start, requests that already have a
+    content verdict in it are skipped and new results are appended, so a crashed run
+    resumes where it stopped. Requests recorded with an error, or with an error verdict
+    such as a failed API call, are moderated again, and the later record supersedes the
+    earlier one. In ordered mode results are written in input order; otherwise they are
+    written as soon as they complete.
+
+    Args:
+        input_path (str): Path of the JSONL file of requests.
+        output_path (str): Path of the JSONL results file.
+        moderate (callable): The moderation function, called as
+            moderate(input_data, policies=..., sensitivity=...).
+        workers (int): Number of requests moderated at the same time.
+        ordered (bool): Write results in input order.
+        sensitivity (str): Sensitivity level for requests that do not set one.
+
+    Returns:
+        dict: Throughput, latency percentiles and error counts of the run.
+    """
+    completed = load_completed_ids(output_path)
+    if completed:
+        logger.info(f"Resuming: {len(completed)} requests already decided in {output_path}")
+
+    stats = {'processed': 0, 'items': 0, 'approved': 0, 'rejected': 0, 'errors': 0, 'skipped': 0}
+    latencies = []
+    started = time.perf_counter()
+
+    with open(input_path, encoding='utf-8') as source, open(output_path, 'a', encoding='utf-8') as sink:
+        executor = ThreadPoolExecutor(max_workers=workers)
+        # Maps each future to its position among the submitted requests
+        in_flight = {}
+        # Finished records waiting for their turn in ordered mode
+        finished = {}
+        next_position = 0
+
+        def write(record):
+            sink.write(json.dumps(record, ensure_ascii=False) + '\n')
+            sink.flush()
+            stats['processed'] += 1
+            if stats['processed'] % CHECKPOINT_INTERVAL == 0:
+                os.fsync(sink.fileno())
+            if stats['processed'] % PROGRESS_INTERVAL == 0:
+                logger.info(f"Moderated {stats['processed']} requests")
+
+        def collect(done):
+            nonlocal next_position
+            for future in done:
+                position = in_flight.pop(future)
+                record, seconds, item_count = future.result()
+                if seconds is not None:
+                    latencies.append(seconds)
+                stats['items'] += item_count
+                if not is_decided(record):
+                    stats['errors'] += 1
+                elif record['result']['Status'] == 'Rejected':
+                    stats['rejected'] += 1
+                else:
+                    stats['approved'] += 1
+
+                if not ordered:
+                    write(record)
+                    continue
+                finished[position] = record
+                while next_position in finished:
+                    write(finished.pop(next_position))
+                    next_position += 1
+
+        try:
+            position = 0
+            for line_number, line in enumerate(source, 1):
+                if not line.strip():
+                    continue
+                request_id, request, error = parse_request(line, line_number)
+                if request_id in completed:
+                    stats['skipped'] += 1
+                    continue
+
+                future = executor.submit(run_request, request_id, request, error, moderate, sensitivity)
+                in_flight[future] = position
+                position += 1
+
+                # Bound the requests held in memory; ordered mode also buffers finished results
+                while len(in_flight) + len(finished) >= workers * 2:
+                    collect(wait(in_flight, return_when=FIRST_COMPLETED)[0])
+
+            while in_flight:
+                collect(wait(in_flight, return_when=FIRST_COMPLETED)[0])
+
+        finally:
+            executor.shutdown(wait=False, cancel_futures=True)
+            sink.flush()
+            os.fsync(sink.fileno())
+
+    elapsed = time.perf_counter() - started
+    return dict(
+        stats,
+        elapsed_seconds=round(elapsed, 2),
+        requests_per_second=round(stats['processed'] / elapsed, 2) if elapsed else 0.0,
+        items_per_second=round(stats['items'] / elapsed, 2) if elapsed else 0.0,
+        error_rate=round(stats['errors'] / stats['processed'], 4) if stats['processed'] else 0.0,
+        latency=latency_summary(latencies),
+    )
+
+def parse_request(line, line_number):
+    """
+    Parses one input line.
+
+    Args:
+        line (str): The JSON line.
+        line_number (int): The 1-based line number, used as the default id.
+
+    Returns:
+        tuple: The request id, the request dict (or None) and an error message (or None).
+    """
+    try:
+        request = json.loads(line)
+    except json.JSONDecodeError as e:
+        return line_number, None, f"Invalid JSON: {e}"
+
+    if isinstance(request, list):
+        request = {'input': request}
+    if not isinstance(request, dict) or not isinstance(request.get('input'), list):
+        return line_number, None, "Request must be a list of content items or an object with an 'input' list"
+    if not isinstance(request.get('id', line_number), (str, int)):
+        return line_number, None, "Request id must be a string or an integer"
+    return request.get('id', line_number), request, None
+
+def run_request(request_id, request, error, moderate, sensitivity):
+    """
+    Moderates one request and builds its output record.
+
+    Returns:
+        tuple: The output record, the time taken in seconds (None if the request was
+        invalid) and the number of content items.
+    """
+    if error is not None:
+        return {'id': request_id, 'error': error}, None, 0
+
+    started = time.perf_counter()
+    try:
+        result = moderate(
+            request['input'],
+            policies=request.get('policies'),
+            sensitivity=request.get('sensitivity', sensitivity)
+        )
+        record = {'id': request_id, 'result': result}
+    except Exception as e:
+        logger.error(f"Error moderating request {request_id}: {e}")
+        record = {'id': request_id, 'error': str(e)}
+    return record, time.perf_counter() - started, len(request['input'])
+
+def load_completed_ids(output_path):
+    """
+    Reads the ids of the requests that already have a content verdict in a results file.
+
+    Records with an error or an error verdict do not count, so that those requests are
+    retried. A trailing partial line left by a crash is cut off so that appending resumes
+    cleanly; complete lines that cannot be parsed are skipped.
+
+    Args:
+        output_path (str): Path of the JSONL results file.
+
+    Returns:
+        set: The ids of the decided requests.
+    """
+    if not os.path.exists(output_path):
+        return set()
+
+    completed = set()
+    valid_bytes = 0
+    malformed = 0
+    with open(output_path, 'rb') as results:
+        for line in results:
+            if not line.endswith(b'\n'):
+                break
+            valid_bytes += len(line)
+            try:
+                record = json.loads(line)
+                if is_decided(record):
+                    completed.add(record['id'])
+            except (ValueError, KeyError, TypeError, AttributeError):
+                malformed += 1
+
+    if malformed:
+        logger.warning(f"Skipped {malformed} malformed records in {output_path}")
+
+    if valid_bytes < os.path.getsize(output_path):
+        logger.warning(f"Discarding an incomplete record at the end of {output_path}")
+        with open(output_path, 'r+b') as results:
+            results.truncate(valid_bytes)
+    return completed
+
+def is_decided(record):
+    """
+    Checks whether an output record holds a content verdict.
+
+    Returns:
+        bool: False for error records and for results whose reason is an error, which
+        moderate_content uses to report API and media failures.
+    """
+    return 'result' in record and not record['result']['Reason'].startswith(ERROR_REASON_PREFIX)
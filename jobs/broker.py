@@ -0,0 +1,349 @@
+import os
+import json
+import time
+import uuid
+import sqlite3
+import threading
+from collections import namedtuple
+from contextlib import contextmanager
+from moderation.policy import compile_policy
+
+# Broker used when none is given: a SQLite file path, or a URL such as 'sqlite:///jobs.db'
+# (relative) or 'sqlite:////var/lib/moderation/jobs.db' (absolute)
+DEFAULT_BROKER_URL = os.environ.get('MODERATION_BROKER_URL', 'sqlite:///jobs.db')
+
+# Queue a request goes to, by the heaviest content type it contains; each queue has its
+# own workers, so long videos cannot hold up text
+QUEUE_BY_TYPE = {
+    'video_url': 'video',
+    'audio_url': 'audio',
+    'image_url': 'image',
+    'text': 'text',
+}
+QUEUES = ('video', 'audio', 'image', 'text')
+
+# Seconds a claimed job stays invisible to other workers; workers extend it while running
+VISIBILITY_TIMEOUT = int(os.environ.get('MODERATION_JOB_VISIBILITY_TIMEOUT', 300))
+
+# Attempts per job before it is marked failed, and the delay before each retry, in seconds
+MAX_ATTEMPTS = 3
+RETRY_DELAY_SECONDS = 5
+
+# Seconds between polls while waiting for a job to finish
+RESULT_POLL_INTERVAL = 0.2
+
+# Claimed job handed to a worker
+Job = namedtuple('Job', ['id', 'queue', 'input', 'policies', 'sensitivity', 'attempts'])
+
+class JobNotFound(KeyError):
+    """
+    Raised when a job id is unknown to the broker.
+    """
+
+class Broker:
+    """
+    Durable queue of moderation requests shared by producers and worker processes.
+
+    Jobs move from 'queued' to 'running' when a worker claims them and to 'done' or
+    'failed' when it reports back. A claim is a lease: a job whose worker neither
+    finishes nor extends it within the visibility timeout is handed to another worker,
+    up to its maximum number of attempts.
+    """
+
+    def enqueue(self, input_data, policies=None, sensitivity='medium', queue=None, max_attempts=MAX_ATTEMPTS):
+        """
+        Adds a moderation request to its queue.
+
+        Args:
+            input_data (list): The content items to moderate.
+            policies (dict or Policy): Custom moderation policies, or a compiled Policy.
+            sensitivity (str): Sensitivity level.
+            queue (str): The queue to use; defaults to the one for the heaviest content type.
+            max_attempts (int): Attempts before the job is marked failed.
+
+        Returns:
+            str: The job id.
+
+        Raises:
+            ValueError: If the policies or the sensitivity level are invalid.
+        """
+        # Invalid requests are refused here rather than retried by every worker
+        policy = compile_policy(policies, sensitivity)
+        payload = json.dumps({'input': input_data, 'policies': policy.policies, 'sensitivity': policy.sensitivity})
+        job_id = uuid.uuid4().hex
+        self._insert(job_id, queue or queue_for(input_data), payload, max_attempts)
+        return job_id
+
+    def claim(self, queues, worker_id, visibility_timeout=VISIBILITY_TIMEOUT):
+        """
+        Leases the oldest available job from the given queues.
+
+        Args:
+            queues (list): The queues the worker serves.
+            worker_id (str): Identifies the worker in the job's record.
+            visibility_timeout (int): Seconds before the job is handed to another worker.
+
+        Returns:
+            Job: The claimed job, or None if no job is available.
+        """
+        raise NotImplementedError
+
+    def extend(self, job_id, worker_id, visibility_timeout=VISIBILITY_TIMEOUT):
+        """
+        Extends the lease of a running job.
+
+        Returns:
+            bool: False if the worker no longer holds the lease.
+        """
+        raise NotImplementedError
+
+    def complete(self, job_id, worker_id, result):
+        """
+        Stores the result of a job.
+
+        Returns:
+            bool: False if the worker no longer holds the lease; the result is then dropped.
+        """
+        raise NotImplementedError
+
+    def fail(self, job_id, worker_id, error, retry=True):
+        """
+        Records a failed attempt; the job is queued again after a delay while it has attempts left.
+
+        Args:
+            job_id (str): The job id.
+            worker_id (str): The worker holding the lease.
+            error (str): Description of the failure.
+            retry (bool): False for failures another attempt cannot fix.
+
+        Returns:
+            bool: False if the worker no longer holds the lease.
+        """
+        raise NotImplementedError
+
+    def get(self, job_id):
+        """
+        Reads the state of a job.
+
+        Returns:
+            dict: The job's 'id', 'queue', 'status', 'attempts', 'result' and 'error'.
+
+        Raises:
+            JobNotFound: If the job id is unknown.
+        """
+        raise NotImplementedError
+
+    def stats(self):
+        """
+        Returns:
+            dict: Job counts per queue and status.
+        """
+        raise NotImplementedError
+
+    def wait(self, job_id, timeout=None, poll_interval=RESULT_POLL_INTERVAL):
+        """
+        Polls a job until it is done or failed.
+
+        Args:
+            job_id (str): The job id.
+            timeout (float): Seconds to wait at most, or None to wait indefinitely.
+            poll_interval (float): Seconds between polls.
+
+        Returns:
+            dict: The job's state as returned by get, which may still be pending on timeout.
+        """
+        deadline = None if timeout is None else time.monotonic() + timeout
+        while True:
+            job = self.get(job_id)
+            if job['status'] in ('done', 'failed'):
+                return job
+            if deadline is not None and time.monotonic() >= deadline:
+                return job
+            time.sleep(poll_interval)
+
+    def close(self):
+        """
+        Releases the broker's connections.
+        """
+
+    def _insert(self, job_id, queue, payload, max_attempts):
+        raise NotImplementedError
+
+class SQLiteBroker(Broker):
+    """
+    Broker backed by one SQLite file, shared by every process on a machine. WAL mode does
+    not work over network filesystems, so the file must be local to all its workers.
+
+    The database runs in WAL mode so that polling producers do not block workers, and
+    claims take the write lock for the few statements that lease a job, so each job is
+    handed to exactly one worker.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self._lock = threading.Lock()
+        # Autocommit mode: transactions are opened explicitly where they are needed
+        self._db = sqlite3.connect(path, timeout=30, isolation_level=None, check_same_thread=False)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute("PRAGMA synchronous=NORMAL")
+        self._db.execute(
+            "CREATE TABLE IF NOT EXISTS jobs ("
+            "id TEXT PRIMARY KEY, queue TEXT NOT NULL, payload TEXT NOT NULL, status TEXT NOT NULL, "
+            "attempts INTEGER NOT NULL DEFAULT 0, max_attempts INTEGER NOT NULL, "
+            "available_at REAL NOT NULL, worker TEXT, result TEXT, error TEXT, "
+            "created_at REAL NOT NULL, updated_at REAL NOT NULL)"
+        )
+        self._db.execute("CREATE INDEX IF NOT EXISTS jobs_available ON jobs (queue, status, available_at)")
+
+    def _insert(self, job_id, queue, payload, max_attempts):
+        now = time.time()
+        with self._lock:
+            self._db.execute(
+                "INSERT INTO jobs (id, queue, payload, status, max_attempts, available_at, created_at, updated_at) "
+                "VALUES (?, ?, ?, 'queued', ?, ?, ?, ?)",
+                (job_id, queue, payload, max_attempts, now, now, now)
+            )
+
+    def claim(self, queues, worker_id, visibility_timeout=VISIBILITY_TIMEOUT):
+        now = time.time()
+        placeholders = ', '.join('?' * len(queues))
+        with self._lock, self._transaction():
+            # Leases that ran out on their last attempt belong to workers that kept crashing
+            self._db.execute(
+                f"UPDATE jobs SET status = 'failed', error = 'Worker lease expired on the last attempt', "
+                f"updated_at = ? WHERE queue IN ({placeholders}) AND status = 'running' "
+                f"AND available_at <= ? AND attempts >= max_attempts",
+                (now, *queues, now)
+            )
+            row = self._db.execute(
+                f"SELECT id, queue, payload, attempts FROM jobs WHERE queue IN ({placeholders}) "
+                f"AND status IN ('queued', 'running') AND available_at <= ? ORDER BY available_at LIMIT 1",
+                (*queues, now)
+            ).fetchone()
+            if row is None:
+                return None
+            job_id, queue, payload, attempts = row
+            self._db.execute(
+                "UPDATE jobs SET status = 'running', attempts = attempts + 1, worker = ?, "
+                "available_at = ?, updated_at = ? WHERE id = ?",
+                (worker_id, now + visibility_timeout, now, job_id)
+            )
+
+        request = json.loads(payload)
+        return Job(job_id, queue, request['input'], request['policies'], request['sensitivity'], attempts + 1)
+
+    def extend(self, job_id, worker_id, visibility_timeout=VISIBILITY_TIMEOUT):
+        now = time.time()
+        return self._update_leased(
+            job_id, worker_id, "available_at = ?, updated_at = ?", (now + visibility_timeout, now)
+        )
+
+    def complete(self, job_id, worker_id, result):
+        return self._update_leased(
+            job_id, worker_id, "status = 'done', result = ?, error = NULL, updated_at = ?",
+            (json.dumps(result), time.time())
+        )
+
+    def fail(self, job_id, worker_id, error, retry=True):
+        now = time.time()
+        if not retry:
+            return self._update_leased(
+                job_id, worker_id, "status = 'failed', error = ?, updated_at = ?", (error, now)
+            )
+        # Retries back off linearly with the number of attempts made
+        return self._update_leased(
+            job_id, worker_id,
+            "status = CASE WHEN attempts < max_attempts THEN 'queued' ELSE 'failed' END, "
+            "available_at = ? + attempts * ?, error = ?, updated_at = ?",
+            (now, RETRY_DELAY_SECONDS, error, now)
+        )
+
+    def get(self, job_id):
+        with self._lock:
+            row = self._db.execute(
+                "SELECT id, queue, status, attempts, result, error FROM jobs WHERE id = ?", (job_id,)
+            ).fetchone()
+        if row is None:
+            raise JobNotFound(job_id)
+        return {
+            'id': row[0],
+            'queue': row[1],
+            'status': row[2],
+            'attempts': row[3],
+            'result': json.loads(row[4]) if row[4] is not None else None,
+            'error': row[5],
+        }
+
+    def stats(self):
+        with self._lock:
+            rows = self._db.execute("SELECT queue, status, COUNT(*) FROM jobs GROUP BY queue, status").fetchall()
+        stats = {}
+        for queue, status, job_count in rows:
+            stats.setdefault(queue, {})[status] = job_count
+        return stats
+
+    def close(self):
+        with self._lock:
+            self._db.close()
+
+    def _update_leased(self, job_id, worker_id, assignments, values):
+        # Only the worker holding the lease may change a running job
+        with self._lock:
+            cursor = self._db.execute(
+                f"UPDATE jobs SET {assignments} WHERE id = ? AND worker = ? AND status = 'running'",
+                (*values, job_id, worker_id)
+            )
+        return cursor.rowcount == 1
+
+    @contextmanager
+    def _transaction(self):
+        # Takes the write lock up front, so two workers never read the same available job
+        self._db.execute("BEGIN IMMEDIATE")
+        try:
+            yield
+        except BaseException:
+            self._db.execute("ROLLBACK")
+            raise
+        self._db.execute("COMMIT")
+
+# Broker class per URL scheme
+BROKERS = {
+    'sqlite': SQLiteBroker,
+}
+
+def get_broker(url=None):
+    """
+    Opens the broker a URL points to.
+
+    Args:
+        url (str): 'scheme://location', e.g. 'sqlite:////var/lib/moderation/jobs.db', or a
+            plain path for SQLite; defaults to DEFAULT_BROKER_URL.
+
+    Returns:
+        Broker: A new broker connection; every process opens its own.
+
+    Raises:
+        ValueError: If the URL scheme has no broker.
+    """
+    url = url or DEFAULT_BROKER_URL
+    scheme, separator, location = url.partition('://')
+    if not separator:
+        scheme, location = 'sqlite', url
+    elif scheme == 'sqlite':
+        location = location[1:]
+    if scheme not in BROKERS:
+        raise ValueError(f"Unknown broker: {scheme}")
+    return BROKERS[scheme](location)
+
+def queue_for(input_data):
+    """
+    Picks the queue for a request from the heaviest content type it contains.
+
+    Args:
+        input_data (list): The content items.
+
+    Returns:
+        str: The queue name.
+    """
+    queues = set(QUEUE_BY_TYPE.get(item.get('type'), 'text') for item in input_data if isinstance(item, dict))
+    return next((queue for queue in QUEUES if queue in queues), 'text')
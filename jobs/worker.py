@@ -0,0 +1,180 @@
+import os
+import time
+import socket
+import signal
+import argparse
+import threading
+import multiprocessing
+from contextlib import contextmanager
+from utils.logger import logger
+from utils.cache import ERROR_REASON_PREFIX
+from jobs.broker import get_broker, QUEUES, VISIBILITY_TIMEOUT, DEFAULT_BROKER_URL
+
+# Worker processes started per group of queues when none are given: 'queue+queue=count'
+# entries, where each worker serves its queues oldest job first
+DEFAULT_WORKER_SPEC = os.environ.get('MODERATION_WORKERS', 'text=2,image=2,audio+video=2')
+
+# Seconds an idle worker waits before polling its queues again
+POLL_INTERVAL = 0.5
+
+def run_worker(broker_url, queues, poll_interval=POLL_INTERVAL, visibility_timeout=VISIBILITY_TIMEOUT,
+               stop_event=None, max_jobs=None):
+    """
+    Claims and moderates jobs from the given queues until stopped.
+
+    While a job runs, a background thread keeps extending its lease, so a job outlives
+    the visibility timeout only as long as its worker is alive. A job whose moderation
+    raises or ends in an error verdict (a failed API call, an undecodable download, ...)
+    is queued again with a delay; invalid policies fail it right away.
+
+    Args:
+        broker_url (str): URL of the broker, opened by this process.
+        queues (list): The queues served, e.g. ['text'].
+        poll_interval (float): Seconds to wait when no job is available.
+        visibility_timeout (int): Lease length in seconds.
+        stop_event (multiprocessing.Event): Stops the worker after its current job when set.
+        max_jobs (int): Stop after this many jobs; None to run until stopped.
+
+    Returns:
+        int: The number of jobs processed.
+    """
+    # Imported here so that producers can use the broker without loading the moderators
+    from main import moderate_content
+
+    broker = get_broker(broker_url)
+    worker_id = f"{socket.gethostname()}:{os.getpid()}"
+    logger.info(f"Worker {worker_id} serving {', '.join(queues)}")
+    processed = 0
+    while (stop_event is None or not stop_event.is_set()) and (max_jobs is None or processed < max_jobs):
+        job = broker.claim(queues, worker_id, visibility_timeout)
+        if job is None:
+            if stop_event is not None:
+                stop_event.wait(poll_interval)
+            else:
+                time.sleep(poll_interval)
+            continue
+
+        started = time.perf_counter()
+        with lease_heartbeat(broker, job.id, worker_id, visibility_timeout):
+            try:
+                result = moderate_content(job.input, job.policies, job.sensitivity)
+            except ValueError as e:
+                broker.fail(job.id, worker_id, str(e), retry=False)
+            except Exception as e:
+                logger.error(f"Error moderating job {job.id} (attempt {job.attempts}): {e}")
+                broker.fail(job.id, worker_id, str(e))
+            else:
+                # moderate_content reports API and media failures as error verdicts, not exceptions
+                if result['Status'] == 'Rejected' and result['Reason'].startswith(ERROR_REASON_PREFIX):
+                    logger.error(f"Job {job.id} (attempt {job.attempts}) ended in an error: {result['Reason']}")
+                    broker.fail(job.id, worker_id, result['Reason'])
+                elif not broker.complete(job.id, worker_id, result):
+                    logger.warning(f"Lease on job {job.id} was lost, its result is dropped")
+        processed += 1
+        logger.info(f"Job {job.id} ({job.queue}) finished in {time.perf_counter() - started:.2f}s")
+
+    broker.close()
+    return processed
+
+@contextmanager
+def lease_heartbeat(broker, job_id, worker_id, visibility_timeout):
+    """
+    Extends a job's lease every third of the visibility timeout while the block runs.
+    """
+    done = threading.Event()
+
+    def extend():
+        while not done.wait(visibility_timeout / 3):
+            if not broker.extend(job_id, worker_id, visibility_timeout):
+                return
+
+    heartbeat = threading.Thread(target=extend, daemon=True)
+    heartbeat.start()
+    try:
+        yield
+    finally:
+        done.set()
+        heartbeat.join()
+
+def parse_worker_spec(spec):
+    """
+    Parses a worker spec such as 'text=4,image=2,audio+video=1'.
+
+    Args:
+        spec (str): Comma-separated 'queue+queue=count' entries; a missing count means 1.
+
+    Returns:
+        list: The queue list of every worker process to start.
+
+    Raises:
+        ValueError: If the spec names an unknown queue or an invalid count.
+    """
+    workers = []
+    for entry in spec.split(','):
+        if not entry.strip():
+            continue
+        names, _, worker_count = entry.partition('=')
+        queues = [name.strip() for name in names.split('+')]
+        unknown = [queue for queue in queues if queue not in QUEUES]
+        if unknown:
+            raise ValueError(f"Unknown queue: {', '.join(unknown)}")
+        try:
+            worker_count = int(worker_count or 1)
+        except ValueError:
+            raise ValueError(f"Invalid worker count in {entry!r}")
+        workers += [queues] * worker_count
+    return workers
+
+def run_workers(broker_url=None, spec=DEFAULT_WORKER_SPEC, poll_interval=POLL_INTERVAL,
+                visibility_timeout=VISIBILITY_TIMEOUT):
+    """
+    Starts a worker process per entry of the spec and waits until they are stopped.
+
+    SIGINT or SIGTERM stops the workers once their current jobs are done. The SQLite
+    broker relies on WAL mode, which needs a local filesystem, so its workers must run on
+    the machine that holds the database.
+
+    Args:
+        broker_url (str): URL of the broker.
+        spec (str): Worker spec, see parse_worker_spec.
+        poll_interval (float): Seconds an idle worker waits before polling again.
+        visibility_timeout (int): Lease length in seconds.
+    """
+    broker_url = broker_url or DEFAULT_BROKER_URL
+    # Workers open their own connections; nothing is shared across a fork
+    context = multiprocessing.get_context('spawn')
+    stop_event = context.Event()
+    processes = [
+        context.Process(
+            target=_worker_main, args=(broker_url, queues, poll_interval, visibility_timeout, stop_event),
+            name=f"moderation-worker-{index}-{'+'.join(queues)}"
+        )
+        for index, queues in enumerate(parse_worker_spec(spec))
+    ]
+
+    def stop(signum, frame):
+        logger.info("Stopping workers after their current jobs")
+        stop_event.set()
+
+    signal.signal(signal.SIGINT, stop)
+    signal.signal(signal.SIGTERM, stop)
+    for process in processes:
+        process.start()
+    logger.info(f"Started {len(processes)} workers on {broker_url}")
+    for process in processes:
+        process.join()
+
+def _worker_main(*args):
+    # Ctrl-C reaches the whole process group; the parent turns it into stop_event
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    run_worker(*args)
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Run moderation worker processes.")
+    parser.add_argument('--broker', default=DEFAULT_BROKER_URL, help="Broker URL or SQLite path")
+    parser.add_argument('--workers', default=DEFAULT_WORKER_SPEC,
+                        help="Worker processes per queue group, e.g. 'text=4,image=2,audio+video=1'")
+    parser.add_argument('--visibility-timeout', type=int, default=VISIBILITY_TIMEOUT,
+                        help="Seconds before the job of an unresponsive worker is handed to another")
+    args = parser.parse_args()
+    run_workers(args.broker, args.workers, visibility_timeout=args.visibility_timeout)
@@ -1,54 +1,364 @@
 import json
+import asyncio
+import argparse
 import datetime
-from moderation.text_moderation import moderate_text
-from moderation.image_moderation import moderate_image
-from moderation.audio_moderation import moderate_audio
-from moderation.video_moderation import moderate_video
+import functools
+import importlib
+import contextlib
+from concurrent.futures import ThreadPoolExecutor, FIRST_COMPLETED, wait
+from moderation.text_moderation import moderate_text_items, moderate_text_items_async, collect_tier_stats
 from utils.logger import logger
+from utils.concurrency import submit_in_context
+from moderation.policy import compile_policy
+from utils.metrics import METRICS_ENABLED, collect_metrics, span
+from bulk import run_bulk, DEFAULT_WORKERS
 
-def moderate_content(input_data, policies=None, sensitivity='medium'):
+# Upper bound on items moderated at the same time when moderate_content runs concurrently
+MAX_CONCURRENT_ITEMS = 8
+
+# Module and moderator function per content type; a module is only imported once an
+# item of its type shows up, so text-only callers never load PIL, numpy or Tesseract
+MODERATORS = {
+    'text': ('moderation.text_moderation', 'moderate_text'),
+    'image_url': ('moderation.image_moderation', 'moderate_image'),
+    'audio_url': ('moderation.audio_moderation', 'moderate_audio'),
+    'video_url': ('moderation.video_moderation', 'moderate_video'),
+}
+
+@functools.lru_cache(maxsize=None)
+def get_moderator(item_type, asynchronous=False):
+    """
+    Returns the moderator function for a content type, importing its module on first use.
+
+    Args:
+        item_type (str): The item's 'type', e.g. 'image_url'.
+        asynchronous (bool): Return the async variant.
+
+    Returns:
+        callable: The moderator, or None if the type is not supported.
+    """
+    if item_type not in MODERATORS:
+        return None
+    module_name, function_name = MODERATORS[item_type]
+    module = importlib.import_module(module_name)
+    return getattr(module, f"{function_name}_async" if asynchronous else function_name)
+
+def moderate_item(item, policies=None, sensitivity='medium'):
+    """
+    Moderates a single content item by dispatching it to the matching moderator.
+
+    Moderators are looked up in MODERATORS and imported on first use.
+
+    Args:
+        item (dict): The content item to moderate.
+        policies (dict or Policy): Custom moderation policies, or a compiled Policy.
+        sensitivity (str): Sensitivity level ('low', 'medium', 'high').
+
+    Returns:
+        tuple: A tuple containing the status ('Approved' or 'Rejected'), reason, and tags.
+    """
+    item_type = item.get('type')
+    try:
+        moderator = get_moderator(item_type)
+        if moderator is None:
+            return "Rejected", "Unsupported content type", []
+        with span(f"item.{item_type}"):
+            return moderator(item, policies, sensitivity)
+
+    except Exception as e:
+        logger.error(f"Error moderating {item_type}: {e}")
+        return "Rejected", f"Error processing {item_type}", []
+
+async def moderate_item_async(item, policies=None, sensitivity='medium'):
+    """
+    Async variant of moderate_item.
+    """
+    item_type = item.get('type')
+    try:
+        moderator = get_moderator(item_type, asynchronous=True)
+        if moderator is None:
+            return "Rejected", "Unsupported content type", []
+        with span(f"item.{item_type}"):
+            return await moderator(item, policies, sensitivity)
+
+    except Exception as e:
+        logger.error(f"Error moderating {item_type}: {e}")
+        return "Rejected", f"Error processing {item_type}", []
+
+def moderate_text_group(items, policies=None, sensitivity='medium'):
+    """
+    Moderates all text items of a request together with batched API calls.
+
+    Args:
+        items (list): The text items to moderate.
+        policies (dict or Policy): Custom moderation policies, or a compiled Policy.
+        sensitivity (str): Sensitivity level ('low', 'medium', 'high').
+
+    Returns:
+        list: A (status, reason, tags) tuple per item, in the same order.
+    """
+    try:
+        with span('item.text'):
+            return moderate_text_items(items, policies, sensitivity)
+
+    except Exception as e:
+        logger.error(f"Error moderating text: {e}")
+        return [("Rejected", "Error processing text", [])] * len(items)
+
+async def moderate_text_group_async(items, policies=None, sensitivity='medium'):
+    """
+    Async variant of moderate_text_group.
+    """
+    try:
+        with span('item.text'):
+            return await moderate_text_items_async(items, policies, sensitivity)
+
+    except Exception as e:
+        logger.error(f"Error moderating text: {e}")
+        return [("Rejected", "Error processing text", [])] * len(items)
+
+def moderate_items_sequentially(input_data, policies=None, sensitivity='medium'):
+    """
+    Moderates content items one after another, stopping at the first rejection.
+
+    All text items are moderated up front in one batch; the remaining items are then
+    moderated in input order, but only up to the earliest rejected text item.
+
+    Args:
+        input_data (list): A list of content items to moderate.
+        policies (dict or Policy): Custom moderation policies, or a compiled Policy.
+        sensitivity (str): Sensitivity level ('low', 'medium', 'high').
+
+    Returns:
+        list: The (status, reason, tags) results in input order, truncated after the
+        first rejected item.
+    """
+    results = [None] * len(input_data)
+    first_rejected = len(input_data)
+
+    text_indices = [index for index, item in enumerate(input_data) if item.get('type') == 'text']
+    if text_indices:
+        verdicts = moderate_text_group([input_data[index] for index in text_indices], policies, sensitivity)
+        for index, verdict in zip(text_indices, verdicts):
+            results[index] = verdict
+            if verdict[0] == 'Rejected' and index < first_rejected:
+                first_rejected = index
+
+    for index in range(first_rejected):
+        if results[index] is None:
+            results[index] = moderate_item(input_data[index], policies, sensitivity)
+            if results[index][0] == 'Rejected':
+                first_rejected = index
+                break
+
+    return results[:first_rejected + 1]
+
+def moderate_items_concurrently(input_data, policies=None, sensitivity='medium', max_workers=None):
+    """
+    Moderates all content items at once on a bounded thread pool.
+
+    The verdict matches the sequential walk: the first rejected item in input order
+    wins, and only tags from items up to and including it are kept. Text items are
+    moderated together as one batched task. As soon as a rejection lands, tasks
+    covering only later items are cancelled since they can no longer change the
+    outcome; tasks that are already running are abandoned rather than awaited.
+
+    Args:
+        input_data (list): A list of content items to moderate.
+        policies (dict or Policy): Custom moderation policies, or a compiled Policy.
+        sensitivity (str): Sensitivity level ('low', 'medium', 'high').
+        max_workers (int): Maximum number of items moderated at the same time.
+
+    Returns:
+        list: The (status, reason, tags) results in input order, truncated after the
+        first rejected item.
+    """
+    if not input_data:
+        return []
+
+    executor = ThreadPoolExecutor(max_workers=max_workers or min(len(input_data), MAX_CONCURRENT_ITEMS))
+    try:
+        # Each task covers a list of item indices and returns one verdict per index
+        tasks = {}
+        text_indices = [index for index, item in enumerate(input_data) if item.get('type') == 'text']
+        if text_indices:
+            text_items = [input_data[index] for index in text_indices]
+            tasks[submit_in_context(executor, moderate_text_group, text_items, policies, sensitivity)] = text_indices
+        for index, item in enumerate(input_data):
+            if item.get('type') != 'text':
+                tasks[submit_in_context(executor, lambda item=item: [moderate_item(item, policies, sensitivity)])] = [index]
+
+        results = [None] * len(input_data)
+        first_rejected = len(input_data)
+        pending = set(tasks)
+
+        # Keep going until every item before the earliest rejection has a verdict
+        while any(results[i] is None for i in range(first_rejected)):
+            done, pending = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                for index, verdict in zip(tasks[future], future.result()):
+                    results[index] = verdict
+                    if verdict[0] == 'Rejected' and index < first_rejected:
+                        first_rejected = index
+
+            for future in pending:
+                if min(tasks[future]) > first_rejected:
+                    future.cancel()
+
+        return results[:first_rejected + 1]
+
+    finally:
+        executor.shutdown(wait=False, cancel_futures=True)
+
+async def moderate_items_async(input_data, policies=None, sensitivity='medium', max_concurrency=None):
+    """
+    Moderates all content items at once as tasks on the running event loop.
+
+    Follows the same rules as moderate_items_concurrently: the first rejected item in
+    input order wins, text items form one batched task, and tasks covering only later
+    items are cancelled once a rejection lands.
+
+    Args:
+        input_data (list): A list of content items to moderate.
+        policies (dict or Policy): Custom moderation policies, or a compiled Policy.
+        sensitivity (str): Sensitivity level ('low', 'medium', 'high').
+        max_concurrency (int): Maximum number of items moderated at the same time.
+
+    Returns:
+        list: The (status, reason, tags) results in input order, truncated after the
+        first rejected item.
+    """
+    if not input_data:
+        return []
+
+    semaphore = asyncio.Semaphore(max_concurrency or MAX_CONCURRENT_ITEMS)
+
+    async def run(coroutine):
+        async with semaphore:
+            return await coroutine
+
+    async def run_item(item):
+        return [await run(moderate_item_async(item, policies, sensitivity))]
+
+    # Each task covers a list of item indices and returns one verdict per index
+    tasks = {}
+    text_indices = [index for index, item in enumerate(input_data) if item.get('type') == 'text']
+    if text_indices:
+        text_items = [input_data[index] for index in text_indices]
+        tasks[asyncio.ensure_future(run(moderate_text_group_async(text_items, policies, sensitivity)))] = text_indices
+    for index, item in enumerate(input_data):
+        if item.get('type') != 'text':
+            tasks[asyncio.ensure_future(run_item(item))] = [index]
+
+    try:
+        results = [None] * len(input_data)
+        first_rejected = len(input_data)
+        pending = set(tasks)
+
+        # Keep going until every item before the earliest rejection has a verdict
+        while any(results[i] is None for i in range(first_rejected)):
+            done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+            for task in done:
+                for index, verdict in zip(tasks[task], task.result()):
+                    results[index] = verdict
+                    if verdict[0] == 'Rejected' and index < first_rejected:
+                        first_rejected = index
+
+            for task in pending:
+                if min(tasks[task]) > first_rejected:
+                    task.cancel()
+
+        return results[:first_rejected + 1]
+
+    finally:
+        for task in tasks:
+            task.cancel()
+
+def moderate_content(input_data, policies=None, sensitivity='medium', concurrent=False, max_workers=None, metrics=None):
     """
     Moderates a list of content items with multi-language support and customizable policies.
 
     Args:
         input_data (list): A list of content items to moderate.
-        policies (dict): Custom moderation policies.
+        policies (dict or Policy): Custom moderation policies, or a compiled Policy.
         sensitivity (str): Sensitivity level ('low', 'medium', 'high').
+        concurrent (bool): Moderate all items at once instead of one after another.
+        max_workers (int): Maximum number of items moderated at the same time in concurrent mode.
+        metrics (bool): Add a Metrics block with per-stage timings and counters; defaults
+            to METRICS_ENABLED.
 
     Returns:
-        dict: A dictionary containing the moderation status, reason, tags, and timestamp.
+        dict: A dictionary containing the moderation status, reason, tags, timestamp,
+        metadata with per-tier text decision counts and latency, and optionally metrics.
+
+    Raises:
+        ValueError: If the policies or the sensitivity level are invalid.
+    """
+    # Compiled once here and passed down to every moderator
+    policy = compile_policy(policies, sensitivity)
+    with metrics_collector(metrics) as collected, collect_tier_stats() as tier_stats:
+        if concurrent:
+            results = moderate_items_concurrently(input_data, policy, max_workers=max_workers)
+        else:
+            results = moderate_items_sequentially(input_data, policy)
+
+    return build_output(results, tier_stats, collected)
+
+async def moderate_content_async(input_data, policies=None, sensitivity='medium', max_concurrency=None, metrics=None):
+    """
+    Async variant of moderate_content; items are always moderated concurrently.
+
+    Args:
+        input_data (list): A list of content items to moderate.
+        policies (dict or Policy): Custom moderation policies, or a compiled Policy.
+        sensitivity (str): Sensitivity level ('low', 'medium', 'high').
+        max_concurrency (int): Maximum number of items moderated at the same time.
+        metrics (bool): Add a Metrics block; defaults to METRICS_ENABLED.
+
+    Returns:
+        dict: The same output as moderate_content.
+
+    Raises:
+        ValueError: If the policies or the sensitivity level are invalid.
+    """
+    policy = compile_policy(policies, sensitivity)
+    with metrics_collector(metrics) as collected, collect_tier_stats() as tier_stats:
+        results = await moderate_items_async(input_data, policy, max_concurrency=max_concurrency)
+
+    return build_output(results, tier_stats, collected)
+
+def metrics_collector(enabled):
+    """
+    Returns collect_metrics() if metrics are enabled, otherwise a block yielding None.
+    """
+    if enabled is None:
+        enabled = METRICS_ENABLED
+    return collect_metrics() if enabled else contextlib.nullcontext()
+
+def build_output(results, tier_stats, metrics=None):
+    """
+    Combines per-item results into the moderation output.
+
+    Args:
+        results (list): The (status, reason, tags) results in input order, truncated
+            after the first rejected item.
+        tier_stats (TierStats): Text tier counters collected while moderating.
+        metrics (Metrics): Stage timings and counters collected while moderating, if enabled.
+
+    Returns:
+        dict: A dictionary containing the moderation status, reason, tags, timestamp,
+        metadata, and metrics when collected.
     """
     overall_status = "Approved"
     overall_reason = "Content is appropriate"
     tags = []
 
-    for item in input_data:
-        item_type = item.get('type')
-        try:
-            if item_type == 'text':
-                status, reason, item_tags = moderate_text(item, policies, sensitivity)
-            elif item_type == 'image_url':
-                status, reason, item_tags = moderate_image(item, policies, sensitivity)
-            elif item_type == 'audio_url':
-                status, reason, item_tags = moderate_audio(item, policies, sensitivity)
-            elif item_type == 'video_url':
-                status, reason, item_tags = moderate_video(item, policies, sensitivity)
-            else:
-                status = "Rejected"
-                reason = "Unsupported content type"
-                item_tags = []
-
-            tags.extend(item_tags)
-
-            if status == 'Rejected':
-                overall_status = 'Rejected'
-                overall_reason = reason
-                break
+    for status, reason, item_tags in results:
+        tags.extend(item_tags)
 
-        except Exception as e:
-            logger.error(f"Error moderating {item_type}: {e}")
+        if status == 'Rejected':
             overall_status = 'Rejected'
-            overall_reason = f"Error processing {item_type}"
+            overall_reason = reason
             break
 
     current_time = datetime.datetime.now().isoformat()
@@ -57,37 +367,58 @@ def moderate_content(input_data, policies=None, sensitivity='medium'):
         "Status": overall_status,
         "Reason": overall_reason,
         "Tags": list(set(tags)),
-        "Time": current_time
+        "Time": current_time,
+        "Metadata": {
+            "text_tiers": tier_stats.as_dict()
+        }
     }
+    if metrics is not None:
+        output["Metrics"] = metrics.as_dict()
     return output
 
 if __name__ == "__main__":
-    # Sample input data
-    input_data = [
-        # {
-        #     "type": "image_url",
-        #     "image_url": {
-        #         "url": "https://api.url2png.com/v6/P4DF2F8BC83648/189f62d5d9da7d7308982fc5650fa4b3/png/?thumbnail_max_width=851&url=pornhub.com&viewport=1280x2000"
-        #     }
-        # },
-        {
-            "type": "video_url",
-            "video_url": {
-                "url": "https://www.redgifs.com/watch/aridserpentineacouchi"
+    parser = argparse.ArgumentParser(description="Moderate content items.")
+    parser.add_argument('--input', help="JSONL file of moderation requests to moderate in bulk")
+    parser.add_argument('--output', help="JSONL file the bulk results are appended to; rerun with the same file to resume")
+    parser.add_argument('--workers', type=int, default=DEFAULT_WORKERS, help="Number of requests moderated at the same time")
+    parser.add_argument('--unordered', action='store_true', help="Write bulk results as they complete instead of in input order")
+    parser.add_argument('--sensitivity', default='medium', choices=['low', 'medium', 'high'],
+                        help="Sensitivity level for requests that do not set one")
+    args = parser.parse_args()
+
+    if args.input:
+        if not args.output:
+            parser.error("--output is required with --input")
+        summary = run_bulk(args.input, args.output, moderate_content, workers=args.workers,
+                           ordered=not args.unordered, sensitivity=args.sensitivity)
+        print(json.dumps(summary, indent=4))
+    else:
+        # Sample input data
+        input_data = [
+            # {
+            #     "type": "image_url",
+            #     "image_url": {
+            #         "url": "https://api.url2png.com/v6/P4DF2F8BC83648/189f62d5d9da7d7308982fc5650fa4b3/png/?thumbnail_max_width=851&url=pornhub.com&viewport=1280x2000"
+            #     }
+            # },
+            {
+                "type": "video_url",
+                "video_url": {
+                    "url": "https://www.redgifs.com/watch/aridserpentineacouchi"
+                }
             }
+            # Include other content items as needed
+        ]
+
+        # Custom policies
+        custom_policies = {
+            "disallowed_categories": ["harassment", "hate speech", "violence", "explicit_nudity"],
+            "allowed_categories": ["mild_language"],
+            # Additional policy configurations can be added here
         }
-        # Include other content items as needed
-    ]
-
-    # Custom policies
-    custom_policies = {
-        "disallowed_categories": ["harassment", "hate speech", "violence", "explicit_nudity"],
-        "allowed_categories": ["mild_language"],
-        # Additional policy configurations can be added here
-    }
 
-    # Sensitivity level
-    sensitivity_level = 'high'  # Options: 'low', 'medium', 'high'
+        # Sensitivity level
+        sensitivity_level = 'high'  # Options: 'low', 'medium', 'high'
 
-    output = moderate_content(input_data, policies=custom_policies, sensitivity=sensitivity_level)
-    print(json.dumps(output, indent=4))
+        output = moderate_content(input_data, policies=custom_policies, sensitivity=sensitivity_level)
+        print(json.dumps(output, indent=4))
@@ -1,21 +1,20 @@
 import os
-import tempfile
-import requests
-import openai
-from openai import OpenAI
+import asyncio
 from utils.logger import logger
-from utils.config import OPENAI_API_KEY
-from utils.language_detection import detect_language
-
-client = OpenAI(api_key=OPENAI_API_KEY)
+from utils.fetcher import fetch_to_file, FetchError
+from moderation.provider import get_client, call_openai
+from moderation.transcripts import moderate_audio_stream
 
 def moderate_audio(item, policies=None, sensitivity='medium'):
     """
     Moderates the audio by transcribing and analyzing the text with multi-language support and customizable policies.
 
+    Long audio is transcribed and moderated in chunks, stopping at the first rejected
+    chunk; see moderate_audio_stream.
+
     Args:
         item (dict): The audio item to moderate.
-        policies (dict): Custom moderation policies.
+        policies (dict or Policy): Custom moderation policies, or a compiled Policy.
         sensitivity (str): Sensitivity level.
 
     Returns:
@@ -25,29 +24,16 @@ def moderate_audio(item, policies=None, sensitivity='medium'):
     if not audio_url:
         return "Rejected", "No audio URL provided", []
 
-    response = requests.get(audio_url)
-    if response.status_code != 200:
+    # Stream the audio straight to a temporary file with the correct extension
+    try:
+        temp_audio_path = fetch_to_file(audio_url, 'audio')
+    except FetchError as e:
+        logger.warning(f"Unable to download audio {audio_url}: {e}")
         return "Rejected", "Unable to download audio", []
 
-    audio_data = response.content
-
-    # Save audio data to a temporary file with the correct extension
-    file_extension = os.path.splitext(audio_url)[1] or '.mp3'
-    with tempfile.NamedTemporaryFile(suffix=file_extension, delete=False) as temp_audio_file:
-        temp_audio_file.write(audio_data)
-        temp_audio_path = temp_audio_file.name
-
     try:
-        # Transcribe audio using OpenAI's Whisper API with language detection
-        with open(temp_audio_path, "rb") as audio_file:
-            transcription = openai.Audio.transcribe("whisper-1", audio_file, response_format="verbose_json")
-        text = transcription['text']
-        language = transcription['language']
-        logger.info(f"Detected language: {language}")
-
-        # Moderate the transcribed text
-        status, reason, tags = moderate_text_content(text, policies, sensitivity)
-        return status, reason, tags
+        # Transcribe audio using OpenAI's Whisper API and moderate the transcript chunk by chunk
+        return moderate_audio_stream(temp_audio_path, policies, sensitivity)
 
     except Exception as e:
         logger.error(f"Error transcribing audio: {e}")
@@ -56,67 +42,47 @@ def moderate_audio(item, policies=None, sensitivity='medium'):
     finally:
         os.unlink(temp_audio_path)
 
-def moderate_text_content(text, policies, sensitivity):
+async def moderate_audio_async(item, policies=None, sensitivity='medium'):
     """
-    Moderates the given text with customizable policies and sensitivity.
-
-    Args:
-        text (str): The text to moderate.
-        policies (dict): Custom moderation policies.
-        sensitivity (str): Sensitivity level.
-
-    Returns:
-        tuple: A tuple containing the status, reason, and tags.
+    Async variant of moderate_audio; the download runs off the event loop.
     """
-    # Prepare policy instructions
-    policy_instructions = create_policy_instructions(policies, sensitivity)
-
-    # Use GPT-4 for moderation, requesting the response in English
-    prompt = f"""As an AI content moderation assistant, analyze the following transcribed audio text for compliance with community guidelines. {policy_instructions} Identify any issues related to disallowed content such as harassment, hate speech, explicit content, privacy violations, and misinformation. Provide a decision ('Approved' or 'Rejected'), reasons, and relevant tags. The response should be in English, regardless of the text's language.
-
-Transcribed Text:
-{text}
-
-Response:"""
-
-    response = client.chat.completions.create(
-        model="gpt-4",
-        messages=[{"role": "user", "content": prompt}],
-        temperature=0,
-        max_tokens=500
-    )
-
-    content = response.choices[0].message.content.strip()
+    audio_url = item.get('audio_url', {}).get('url')
+    if not audio_url:
+        return "Rejected", "No audio URL provided", []
 
-    # Parse the response
-    status, reason, tags = parse_moderation_response(content)
-    return status, reason, tags
+    try:
+        temp_audio_path = await asyncio.to_thread(fetch_to_file, audio_url, 'audio')
+    except FetchError as e:
+        logger.warning(f"Unable to download audio {audio_url}: {e}")
+        return "Rejected", "Unable to download audio", []
 
-def parse_moderation_response(response_text):
-    """
-    Parses the GPT-4 moderation response.
+    try:
+        return await asyncio.to_thread(moderate_audio_stream, temp_audio_path, policies, sensitivity)
 
-    Args:
-        response_text (str): The GPT-4 response text.
+    except Exception as e:
+        logger.error(f"Error transcribing audio: {e}")
+        return "Rejected", "Error transcribing audio", []
 
-    Returns:
-        tuple: A tuple containing the status, reason, and tags.
-    """
-    # Reuse the function from text_moderation.py
-    from moderation.text_moderation import parse_moderation_response
-    return parse_moderation_response(response_text)
+    finally:
+        os.unlink(temp_audio_path)
 
-def create_policy_instructions(policies, sensitivity):
+def transcribe_audio_segments(audio_file):
     """
-    Creates policy instructions for the GPT-4 prompt based on custom policies and sensitivity level.
+    Transcribes audio using OpenAI's Whisper API, keeping Whisper's segment timestamps.
 
     Args:
-        policies (dict): Custom moderation policies.
-        sensitivity (str): Sensitivity level.
+        audio_file (file or tuple): The open audio file, or a (filename, bytes, content type) tuple.
 
     Returns:
-        str: Policy instructions for the prompt.
+        tuple: The (start, end, text) segments, with times in seconds, and the detected language.
     """
-    # Reuse the function from text_moderation.py
-    from moderation.text_moderation import create_policy_instructions
-    return create_policy_instructions(policies, sensitivity)
+    transcription = call_openai(
+        get_client().audio.transcriptions.create,
+        model="whisper-1",
+        file=audio_file,
+        response_format="verbose_json"
+    )
+    segments = getattr(transcription, 'segments', None)
+    if not segments:
+        return [(0.0, float(getattr(transcription, 'duration', 0) or 0), transcription.text)], transcription.language
+    return [(segment.start, segment.end, segment.text) for segment in segments], transcription.language
@@ -0,0 +1,197 @@
+import subprocess
+from collections import deque, namedtuple
+from utils.metrics import span
+
+# Whisper works on 16 kHz mono internally, so nothing above that is worth uploading
+SAMPLE_RATE = 16000
+BYTES_PER_SAMPLE = 2
+
+# Bitrate of the MP3 chunks uploaded to Whisper; ample for 16 kHz mono speech
+ENCODE_BITRATE = '32k'
+
+# Loudness normalization applied while decoding, so that the fixed VAD threshold holds for
+# quietly mastered speech as well as loud recordings
+LOUDNESS_FILTER = 'loudnorm=I=-23:TP=-2:LRA=11'
+
+# Length of the frames the voice activity detector classifies, in seconds
+VAD_FRAME_SECONDS = 0.03
+
+# RMS level, in dBFS, above which a frame counts as speech
+VAD_THRESHOLD_DBFS = -40.0
+
+# Audio kept before and after each speech region so that word edges are not clipped, in seconds
+VAD_PADDING_SECONDS = 0.3
+
+# Speech per chunk, in seconds: a chunk is closed at the first pause after the target
+# length, and cut regardless once it reaches the maximum
+CHUNK_TARGET_SECONDS = 60
+CHUNK_MAX_SECONDS = 75
+
+# Raw PCM read from the decoder at a time, in bytes (one second of audio)
+READ_BYTES = SAMPLE_RATE * BYTES_PER_SAMPLE
+
+# Speech chunk ready for transcription: 16 kHz mono s16le PCM, and the (chunk offset,
+# source offset, duration) regions, in seconds, mapping chunk time back to the source
+SpeechChunk = namedtuple('SpeechChunk', ['pcm', 'regions'])
+
+def decode_command(audio_path):
+    """
+    Builds the ffmpeg invocation that decodes the first audio track to loudness-normalized
+    16 kHz mono PCM on stdout.
+
+    Args:
+        audio_path (str): Path of the audio or video file.
+
+    Returns:
+        list: The ffmpeg command line.
+    """
+    return [
+        "ffmpeg", "-v", "error", "-i", audio_path, "-map", "0:a:0", "-vn", "-af", LOUDNESS_FILTER,
+        "-ac", "1", "-ar", str(SAMPLE_RATE), "-f", "s16le", "pipe:1"
+    ]
+
+def encode_chunk(pcm):
+    """
+    Encodes a speech chunk as a compact mono MP3 in memory.
+
+    Args:
+        pcm (bytes): 16 kHz mono s16le samples.
+
+    Returns:
+        bytes: The MP3 payload.
+
+    Raises:
+        RuntimeError: If ffmpeg fails.
+    """
+    with span('audio.encode') as encode:
+        result = subprocess.run(
+            ["ffmpeg", "-v", "error", "-f", "s16le", "-ar", str(SAMPLE_RATE), "-ac", "1", "-i", "pipe:0",
+             "-c:a", "libmp3lame", "-b:a", ENCODE_BITRATE, "-f", "mp3", "pipe:1"],
+            input=pcm, capture_output=True
+        )
+        if result.returncode != 0:
+            raise RuntimeError(f"Error encoding audio: {result.stderr.decode('utf-8', errors='replace')}")
+        encode.count('audio.encoded_bytes', len(result.stdout))
+    return result.stdout
+
+class SpeechChunker:
+    """
+    Energy-based voice activity detection over a stream of loudness-normalized 16 kHz mono PCM.
+
+    Frames whose RMS level stays below VAD_THRESHOLD_DBFS, apart from VAD_PADDING_SECONDS
+    around speech, are dropped; the remaining audio is grouped into chunks of about
+    CHUNK_TARGET_SECONDS of speech, each closed at a pause where possible. With
+    detect_speech off, every frame is kept and the audio is cut into CHUNK_MAX_SECONDS
+    chunks.
+    """
+
+    def __init__(self, detect_speech=True):
+        # numpy is only needed once audio is actually moderated
+        import numpy as np
+
+        self._np = np
+        self.detect_speech = detect_speech
+        self.frame_samples = int(SAMPLE_RATE * VAD_FRAME_SECONDS)
+        self.frame_bytes = self.frame_samples * BYTES_PER_SAMPLE
+        self.padding_frames = int(VAD_PADDING_SECONDS / VAD_FRAME_SECONDS)
+        # Mean square sample value at the threshold, compared against without a square root
+        self.threshold = (32768 * 10 ** (VAD_THRESHOLD_DBFS / 20)) ** 2
+
+        self.frames_seen = 0
+        self.speech_frames = 0
+        # Largest absolute sample value seen; 0 means the audio is digitally silent
+        self.peak = 0
+        self._remainder = b''
+        # Silent frames right before the current position, kept as leading padding
+        self._lookback = deque(maxlen=self.padding_frames)
+        self._hangover = 0
+        self._pending_pause = False
+        self._chunk = bytearray()
+        self._regions = []
+
+    def feed(self, data):
+        """
+        Classifies newly decoded audio.
+
+        Args:
+            data (bytes): The next s16le samples from the decoder.
+
+        Returns:
+            list: The SpeechChunks completed by this data.
+        """
+        data = self._remainder + data
+        usable = len(data) - len(data) % self.frame_bytes
+        self._remainder = data[usable:]
+        if not usable:
+            return []
+
+        samples = self._np.frombuffer(data[:usable], dtype='<i2').astype(self._np.float32)
+        self.peak = max(self.peak, int(self._np.abs(samples).max()))
+        energy = (samples.reshape(-1, self.frame_samples) ** 2).mean(axis=1)
+        speech = (energy >= self.threshold).tolist() if self.detect_speech else [True] * len(energy)
+
+        chunks = []
+        for index, is_speech in enumerate(speech):
+            frame = data[index * self.frame_bytes:(index + 1) * self.frame_bytes]
+            position = self.frames_seen
+            self.frames_seen += 1
+
+            if is_speech:
+                self.speech_frames += 1
+                while self._lookback:
+                    self._keep(*self._lookback.popleft())
+                self._keep(position, frame)
+                self._hangover = self.padding_frames
+                self._pending_pause = False
+            elif self._hangover:
+                self._hangover -= 1
+                self._keep(position, frame)
+                self._pending_pause = self._hangover == 0
+            else:
+                self._lookback.append((position, frame))
+
+            chunk_seconds = len(self._chunk) / (SAMPLE_RATE * BYTES_PER_SAMPLE)
+            if (chunk_seconds >= CHUNK_MAX_SECONDS
+                    or (chunk_seconds >= CHUNK_TARGET_SECONDS and self._pending_pause)):
+                chunks.append(self._close())
+        return chunks
+
+    def finish(self):
+        """
+        Returns:
+            list: The last SpeechChunk, if any speech is left once the decoder is done.
+        """
+        return [self._close()] if self._chunk else []
+
+    def _keep(self, position, frame):
+        source_start = position * VAD_FRAME_SECONDS
+        chunk_start = len(self._chunk) / (SAMPLE_RATE * BYTES_PER_SAMPLE)
+        if self._regions and abs(self._regions[-1][1] + self._regions[-1][2] - source_start) < 1e-6:
+            offset, source, duration = self._regions[-1]
+            self._regions[-1] = (offset, source, duration + VAD_FRAME_SECONDS)
+        else:
+            self._regions.append((chunk_start, source_start, VAD_FRAME_SECONDS))
+        self._chunk += frame
+
+    def _close(self):
+        chunk = SpeechChunk(bytes(self._chunk), self._regions)
+        self._chunk = bytearray()
+        self._regions = []
+        self._pending_pause = False
+        return chunk
+
+def source_time(regions, chunk_time):
+    """
+    Maps a time within a speech chunk back to the source audio.
+
+    Args:
+        regions (list): The chunk's (chunk offset, source offset, duration) regions.
+        chunk_time (float): Seconds since the start of the chunk.
+
+    Returns:
+        float: Seconds since the start of the source audio.
+    """
+    for offset, source, duration in reversed(regions):
+        if chunk_time >= offset:
+            return source + min(chunk_time - offset, duration)
+    return regions[0][1]
@@ -0,0 +1,336 @@
+import io
+import os
+import time
+import asyncio
+import hashlib
+import functools
+import threading
+from utils.logger import logger
+from moderation.provider import get_client, get_async_client, call_openai, call_openai_async, estimate_tokens
+from moderation.policy import compile_policy
+
+# Backend used when the policies do not name one: 'openai', 'local' or 'fake'
+DEFAULT_BACKEND = os.environ.get('MODERATION_BACKEND', 'openai')
+
+# Hugging Face models run by the local backend, on CPU
+LOCAL_TEXT_MODEL = os.environ.get('LOCAL_TEXT_MODEL', 'unitary/toxic-bert')
+LOCAL_IMAGE_MODEL = os.environ.get('LOCAL_IMAGE_MODEL', 'Falconsai/nsfw_image_detection')
+
+# Number of inputs per forward pass of a local model
+LOCAL_BATCH_SIZE = 16
+
+# Moderation endpoint category reported for each label of the local models
+LOCAL_LABEL_CATEGORIES = {
+    'toxic': 'harassment',
+    'severe_toxic': 'harassment',
+    'obscene': 'harassment',
+    'insult': 'harassment',
+    'threat': 'harassment/threatening',
+    'identity_hate': 'hate',
+    'nsfw': 'sexual',
+}
+
+# Words the fake backend scores as disallowed, and its simulated latency in seconds per call
+FAKE_FLAGGED_WORDS = ('kill', 'hate', 'nude')
+FAKE_LATENCY = float(os.environ.get('FAKE_BACKEND_LATENCY', 0))
+
+# Instruction sent with every image to the DALL-E edit endpoint
+IMAGE_MODERATION_PROMPT = "check and return an error if image is not appropriate with I want you to blur the image that are not appropriate"
+
+class ModerationBackend:
+    """
+    Decision engine behind moderate_text_content and moderate_image_content.
+
+    Moderation runs in two steps. `score_*` returns moderation endpoint style category
+    scores per input (or None when the backend cannot score it), from which clear-cut
+    cases are decided by the pre-filter thresholds; whatever stays ambiguous goes to
+    `judge_*`, which always returns a (status, reason, tags) verdict.
+    """
+
+    name = None
+
+    # Names under which the two steps are reported in the text tier stats
+    prefilter_tier = None
+    judge_tier = None
+
+    def score_texts(self, texts):
+        """
+        Args:
+            texts (list): The text contents to score.
+
+        Returns:
+            list: A {category: score} dict, or None, per text.
+        """
+        return [None] * len(texts)
+
+    def judge_texts(self, texts, policy):
+        """
+        Args:
+            texts (list): The ambiguous text contents.
+            policy (Policy): The compiled moderation policy.
+
+        Returns:
+            list: A (status, reason, tags) tuple per text, in the same order.
+        """
+        raise NotImplementedError
+
+    def score_images(self, images):
+        """
+        Args:
+            images (list): PreparedImage payloads to score.
+
+        Returns:
+            list: A {category: score} dict, or None, per image.
+        """
+        return [None] * len(images)
+
+    def judge_image(self, image, policy):
+        """
+        Args:
+            image (PreparedImage): The ambiguous image payload.
+            policy (Policy): The compiled moderation policy.
+
+        Returns:
+            tuple: A tuple containing the status, reason, and tags.
+        """
+        raise NotImplementedError
+
+    async def score_texts_async(self, texts):
+        return await asyncio.to_thread(self.score_texts, texts)
+
+    async def judge_texts_async(self, texts, policy):
+        return await asyncio.to_thread(self.judge_texts, texts, policy)
+
+    async def score_images_async(self, images):
+        return await asyncio.to_thread(self.score_images, images)
+
+    async def judge_image_async(self, image, policy):
+        return await asyncio.to_thread(self.judge_image, image, policy)
+
+class OpenAIBackend(ModerationBackend):
+    """
+    Scores text with the moderation endpoint, judges text with GPT and images with DALL-E.
+    """
+
+    name = 'openai'
+    prefilter_tier = 'prefilter'
+    judge_tier = 'llm'
+
+    def score_texts(self, texts):
+        response = call_openai(
+            get_client().moderations.create, input=texts, estimated_tokens=estimate_tokens(''.join(texts))
+        )
+        return [result.category_scores.model_dump(by_alias=True) for result in response.results]
+
+    def judge_texts(self, texts, policy):
+        from moderation.text_moderation import use_gpt4_for_batch_moderation
+        return use_gpt4_for_batch_moderation(texts, policy)
+
+    def judge_image(self, image, policy):
+        import openai
+
+        try:
+            # If DALL-E accepts the image for editing, the image is considered appropriate
+            call_openai(get_client().images.edit, image=image.data, prompt=IMAGE_MODERATION_PROMPT, n=1, size="1024x1024")
+            return "Approved", "Image content is appropriate", []
+        except openai.BadRequestError as e:
+            return image_rejection_verdict(e)
+
+    async def score_texts_async(self, texts):
+        response = await call_openai_async(
+            get_async_client().moderations.create, input=texts, estimated_tokens=estimate_tokens(''.join(texts))
+        )
+        return [result.category_scores.model_dump(by_alias=True) for result in response.results]
+
+    async def judge_texts_async(self, texts, policy):
+        from moderation.text_moderation import use_gpt4_for_batch_moderation_async
+        return await use_gpt4_for_batch_moderation_async(texts, policy)
+
+    async def score_images_async(self, images):
+        return [None] * len(images)
+
+    async def judge_image_async(self, image, policy):
+        import openai
+
+        try:
+            await call_openai_async(
+                get_async_client().images.edit, image=image.data, prompt=IMAGE_MODERATION_PROMPT, n=1, size="1024x1024"
+            )
+            return "Approved", "Image content is appropriate", []
+        except openai.BadRequestError as e:
+            return image_rejection_verdict(e)
+
+class LocalBackend(OpenAIBackend):
+    """
+    Scores text with a toxicity classifier and images with an NSFW classifier on the
+    local CPU; only items the scores leave ambiguous are escalated to OpenAI.
+
+    Both models are loaded once, on first use, and run on whole batches.
+    """
+
+    name = 'local'
+    prefilter_tier = 'local_prefilter'
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._models = {}
+
+    def score_texts(self, texts):
+        classifier = self._model('text-classification', LOCAL_TEXT_MODEL, function_to_apply='sigmoid')
+        with self._lock:
+            outputs = classifier(list(texts), batch_size=LOCAL_BATCH_SIZE, truncation=True)
+        return [map_local_labels(labels) for labels in outputs]
+
+    def score_images(self, images):
+        from PIL import Image
+
+        classifier = self._model('image-classification', LOCAL_IMAGE_MODEL)
+        decoded = [Image.open(io.BytesIO(image.data)).convert('RGB') for image in images]
+        with self._lock:
+            outputs = classifier(decoded, batch_size=LOCAL_BATCH_SIZE)
+        return [map_local_labels(labels) for labels in outputs]
+
+    async def score_texts_async(self, texts):
+        return await asyncio.to_thread(self.score_texts, texts)
+
+    async def score_images_async(self, images):
+        return await asyncio.to_thread(self.score_images, images)
+
+    def _model(self, task, model, **kwargs):
+        with self._lock:
+            if model not in self._models:
+                try:
+                    from transformers import pipeline
+                except ImportError as e:
+                    raise RuntimeError("The local moderation backend requires transformers and torch") from e
+                logger.info(f"Loading local {task} model {model}")
+                self._models[model] = pipeline(task, model=model, device=-1, top_k=None, **kwargs)
+            return self._models[model]
+
+class FakeBackend(ModerationBackend):
+    """
+    Deterministic offline backend for benchmarks and local development.
+
+    Texts containing one of FAKE_FLAGGED_WORDS are rejected, everything else is approved,
+    and each call sleeps for FAKE_LATENCY seconds to stand in for a network round trip.
+    """
+
+    name = 'fake'
+    prefilter_tier = 'fake_prefilter'
+    judge_tier = 'fake_judge'
+
+    def score_texts(self, texts):
+        self._wait()
+        return self._score_texts(texts)
+
+    def judge_texts(self, texts, policy):
+        self._wait()
+        return self._judge_texts(texts)
+
+    def score_images(self, images):
+        self._wait()
+        return self._score_images(images)
+
+    def judge_image(self, image, policy):
+        self._wait()
+        return "Approved", "Image content is appropriate", []
+
+    async def score_texts_async(self, texts):
+        await self._wait_async()
+        return self._score_texts(texts)
+
+    async def judge_texts_async(self, texts, policy):
+        await self._wait_async()
+        return self._judge_texts(texts)
+
+    async def score_images_async(self, images):
+        await self._wait_async()
+        return self._score_images(images)
+
+    async def judge_image_async(self, image, policy):
+        await self._wait_async()
+        return "Approved", "Image content is appropriate", []
+
+    def _score_texts(self, texts):
+        return [
+            {'harassment': 0.99 if any(word in text.lower() for word in FAKE_FLAGGED_WORDS) else 0.0}
+            for text in texts
+        ]
+
+    def _judge_texts(self, texts):
+        return [("Approved", "Content does not violate community guidelines", []) for _ in texts]
+
+    def _score_images(self, images):
+        # Stable pseudo-score so the same image always gets the same verdict
+        return [{'sexual': hashlib.sha256(image.data).digest()[0] / 255 * 0.05} for image in images]
+
+    def _wait(self):
+        if FAKE_LATENCY:
+            time.sleep(FAKE_LATENCY)
+
+    async def _wait_async(self):
+        if FAKE_LATENCY:
+            await asyncio.sleep(FAKE_LATENCY)
+
+def image_rejection_verdict(error):
+    """
+    Turns a DALL-E BadRequestError into a verdict.
+
+    Only a safety system rejection is a decision about the content. Other bad requests
+    (unsupported format, oversized upload, ...) become error verdicts, which are never cached.
+
+    Args:
+        error (openai.BadRequestError): The error raised by the image edit call.
+
+    Returns:
+        tuple: A tuple containing the status, reason, and tags.
+    """
+    if getattr(error, 'code', None) == 'content_policy_violation':
+        return "Rejected", f"DALL-E rejected the image: {error}", ["DALL-E rejection"]
+    return "Rejected", f"Error in image moderation: {error}", []
+
+BACKENDS = {
+    'openai': OpenAIBackend,
+    'local': LocalBackend,
+    'fake': FakeBackend,
+}
+
+def get_backend(policies=None):
+    """
+    Returns the backend selected by the policies' 'backend' key, or DEFAULT_BACKEND.
+
+    Args:
+        policies (dict or Policy): Custom moderation policies, or a compiled Policy.
+
+    Returns:
+        ModerationBackend: The shared backend instance.
+
+    Raises:
+        ValueError: If the policies name an unknown backend.
+    """
+    name = compile_policy(policies).backend or DEFAULT_BACKEND
+    if name not in BACKENDS:
+        raise ValueError(f"Unknown moderation backend: {name}")
+    return _backend_instance(name)
+
+@functools.lru_cache(maxsize=None)
+def _backend_instance(name):
+    return BACKENDS[name]()
+
+def map_local_labels(labels):
+    """
+    Converts local classifier labels to moderation endpoint category scores.
+
+    Args:
+        labels (list): The {'label': ..., 'score': ...} dicts of one input.
+
+    Returns:
+        dict: The highest score per mapped category; unmapped labels such as 'normal'
+        are dropped.
+    """
+    scores = {}
+    for entry in labels:
+        category = LOCAL_LABEL_CATEGORIES.get(entry['label'].lower())
+        if category is not None:
+            scores[category] = max(scores.get(category, 0.0), float(entry['score']))
+    return scores
@@ -0,0 +1,220 @@
+import os
+import re
+import time
+import threading
+import unicodedata
+from utils.logger import logger
+
+# Seconds between checks of the blocklist files for changes
+BLOCKLIST_RELOAD_SECONDS = float(os.environ.get('MODERATION_BLOCKLIST_RELOAD', 5))
+
+# Directory blocklist files are read from; names are resolved inside it, and file-valued
+# blocklists are refused while it is unset
+BLOCKLIST_DIR = os.environ.get('MODERATION_BLOCKLIST_DIR')
+
+# Characters commonly substituted for each letter to dodge filters; a term's letters also
+# match their substitutes, so '$1ur' and '5lur' match 'slur'
+LEETSPEAK = {
+    'a': '@4', 'b': '8', 'e': '3', 'g': '9', 'i': '1!|',
+    'l': '1|', 'o': '0', 's': '5$', 't': '7+',
+}
+
+_COMBINING_MARKS = re.compile(r'[\u0300-\u036f\u1ab0-\u1aff\u1dc0-\u1dff\u20d0-\u20ff\ufe20-\ufe2f]+')
+_INVISIBLE = re.compile(r'[\u00ad\u200b-\u200f\u2060-\u2064\ufeff]')
+_SPACES = re.compile(r'\s+')
+
+def fold_text(text):
+    """
+    Normalizes text for blocklist matching.
+
+    Compatibility forms (full-width letters, ligatures, ...) are decomposed, accents
+    and invisible characters are dropped, case is folded and whitespace runs are
+    collapsed, so 'Slür', 'ＳＬＵＲ' and 'SLUR' all read 'slur'.
+
+    Args:
+        text (str): The text to normalize.
+
+    Returns:
+        str: The folded text.
+    """
+    if not text.isascii():
+        text = _COMBINING_MARKS.sub('', unicodedata.normalize('NFKD', text))
+        text = _INVISIBLE.sub('', text)
+    return _SPACES.sub(' ', text.casefold())
+
+def trie_pattern(terms):
+    """
+    Builds a regex matching any of the terms, factored into a prefix trie.
+
+    A flat alternation makes the regex engine try every term at every position; the
+    trie form shares common prefixes, so each position costs about one term's length.
+    Letters also match their LEETSPEAK substitutes.
+
+    Args:
+        terms (iterable): The folded terms.
+
+    Returns:
+        str: The pattern, without anchors or word boundaries.
+    """
+    trie = {}
+    for term in terms:
+        node = trie
+        for char in term:
+            node = node.setdefault(char, {})
+        node[''] = True
+    return _node_pattern(trie)
+
+def _node_pattern(node):
+    ends = '' in node
+    branches = []
+    chars = []
+    for char in sorted(key for key in node if key):
+        child = node[char]
+        if list(child) == ['']:
+            chars.append(char)
+        else:
+            branches.append(_char_pattern(char) + _node_pattern(child))
+
+    if len(chars) == 1:
+        branches.append(_char_pattern(chars[0]))
+    elif chars:
+        branches.append('[' + ''.join(re.escape(char + LEETSPEAK.get(char, '')) for char in chars) + ']')
+
+    if not branches:
+        return ''
+    pattern = branches[0] if len(branches) == 1 else '(?:' + '|'.join(branches) + ')'
+    if ends:
+        pattern = '(?:' + pattern + ')?'
+    return pattern
+
+def _char_pattern(char):
+    if char in LEETSPEAK:
+        return '[' + re.escape(char + LEETSPEAK[char]) + ']'
+    return re.escape(char)
+
+def resolve_blocklist_path(name):
+    """
+    Resolves a blocklist file name inside BLOCKLIST_DIR.
+
+    Args:
+        name (str): The file name, relative to BLOCKLIST_DIR.
+
+    Returns:
+        str: The resolved path of a regular file inside BLOCKLIST_DIR.
+
+    Raises:
+        ValueError: If blocklist files are disabled, or the name does not resolve to a
+            regular file inside BLOCKLIST_DIR; the message does not tell these apart.
+    """
+    if not BLOCKLIST_DIR:
+        raise ValueError("Blocklist files are disabled; set MODERATION_BLOCKLIST_DIR or list the terms inline")
+    root = os.path.realpath(BLOCKLIST_DIR)
+    path = os.path.realpath(os.path.join(root, name))
+    # Only regular files: devices and FIFOs would block the reader
+    if os.path.commonpath([root, path]) != root or not os.path.isfile(path):
+        raise ValueError(f"Unknown blocklist file: {name}")
+    return path
+
+def read_terms(path):
+    """
+    Reads a blocklist file: one term per line, blank lines and '#' comments ignored.
+
+    Args:
+        path (str): Path of the file.
+
+    Returns:
+        list: The terms.
+    """
+    with open(path, encoding='utf-8') as blocklist_file:
+        return [line.strip() for line in blocklist_file if line.strip() and not line.lstrip().startswith('#')]
+
+class Blocklist:
+    """
+    Terms, phrases and URLs that reject text outright, grouped by category.
+
+    All terms are compiled into one regex, with a group per category, matched on whole
+    words against the folded text. Categories may list their terms inline or name a
+    file in BLOCKLIST_DIR; files are checked for changes at most every
+    BLOCKLIST_RELOAD_SECONDS and recompiled when they change, so lists can be updated
+    without a restart.
+    """
+
+    def __init__(self, sources):
+        """
+        Args:
+            sources (dict): {category: list of terms, or name of a file in BLOCKLIST_DIR}.
+
+        Raises:
+            ValueError: If a source is not a list of strings or a readable blocklist file.
+        """
+        self.sources = {}
+        for category, source in sources.items():
+            if not isinstance(source, (str, list, tuple)) or (
+                    not isinstance(source, str) and not all(isinstance(term, str) for term in source)):
+                raise ValueError(f"Blocklist '{category}' must be a list of terms or a file name")
+            self.sources[category] = resolve_blocklist_path(source) if isinstance(source, str) else source
+
+        self._lock = threading.Lock()
+        self._mtimes = {}
+        self._checked_at = time.monotonic()
+        try:
+            self._matcher = self._compile()
+        except (OSError, UnicodeDecodeError):
+            raise ValueError("Cannot read the blocklist files")
+
+    def match(self, text):
+        """
+        Finds the first blocklisted term in the text.
+
+        Args:
+            text (str): The text to check.
+
+        Returns:
+            str: The category of the matched term, or None if nothing matched.
+        """
+        self._reload_if_changed()
+        pattern, categories = self._matcher
+        if pattern is None or not text:
+            return None
+        found = pattern.search(fold_text(text))
+        return categories[found.lastindex - 1] if found else None
+
+    def _reload_if_changed(self):
+        if not self._mtimes or time.monotonic() - self._checked_at < BLOCKLIST_RELOAD_SECONDS:
+            return
+        # One thread checks the files while the others keep matching with the current lists
+        if not self._lock.acquire(blocking=False):
+            return
+        try:
+            self._checked_at = time.monotonic()
+            if all(mtime == _mtime(path) for path, mtime in self._mtimes.items()):
+                return
+            self._matcher = self._compile()
+            logger.info(f"Reloaded blocklists from {', '.join(sorted(self._mtimes))}")
+        except (OSError, UnicodeDecodeError) as e:
+            logger.error(f"Error reloading blocklists, keeping the previous lists: {e}")
+        finally:
+            self._lock.release()
+
+    def _compile(self):
+        terms = {}
+        mtimes = {}
+        for category, source in self.sources.items():
+            if isinstance(source, str):
+                mtimes[source] = _mtime(source)
+                source = read_terms(source)
+            folded = set(fold_text(term.strip()) for term in source)
+            folded.discard('')
+            if folded:
+                terms[category] = folded
+
+        self._mtimes = mtimes
+        if not terms:
+            return None, []
+        pattern = '|'.join('(' + trie_pattern(category_terms) + ')' for category_terms in terms.values())
+        logger.info(f"Compiled {sum(len(category_terms) for category_terms in terms.values())} "
+                    f"blocklist terms in {len(terms)} categories")
+        return re.compile(r'(?<!\w)(?:' + pattern + r')(?!\w)'), list(terms)
+
+def _mtime(path):
+    return os.stat(path).st_mtime_ns
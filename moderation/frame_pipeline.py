@@ -0,0 +1,258 @@
+import os
+from concurrent.futures import ThreadPoolExecutor, FIRST_COMPLETED, wait
+from PIL import Image
+from utils.logger import logger
+from utils.concurrency import submit_in_context
+from utils.metrics import count
+from .text_moderation import moderate_text_batch
+from .image_moderation import moderate_image_content
+from .ocr import submit_ocr
+from .transcripts import format_timestamp
+from .policy import compile_policy
+
+# Number of moderation API calls allowed in flight at the same time
+MAX_FRAME_WORKERS = 8
+
+# Number of OCR texts collected before they are moderated as one batch
+OCR_TEXT_BATCH_SIZE = 8
+
+# Seconds between checks of the cancellation event
+CANCEL_POLL_INTERVAL = 0.1
+
+# Frames tiled into one contact sheet per image moderation call, as 'COLUMNSxROWS';
+# '1x1' moderates every frame on its own
+MOSAIC_GRID = os.environ.get('MODERATION_MOSAIC_GRID', '1x1')
+
+# Longest side, in pixels, of a contact sheet
+MAX_SHEET_SIDE = 1024
+
+def moderate_frames(frames, policies=None, sensitivity='medium', max_workers=MAX_FRAME_WORKERS,
+                    cancel_event=None, grid=None):
+    """
+    Moderates video frames through a pipelined worker pool.
+
+    Frames are sent to the image moderator on a thread pool while Tesseract OCR runs on
+    the shared OCR process pool; text found by OCR is collected and moderated in batches
+    of OCR_TEXT_BATCH_SIZE on the thread pool as well. Frames are pulled from the
+    iterable lazily so that only a bounded number are held in memory. Once a frame is
+    rejected, no more frames are pulled and work on later frames is cancelled; the
+    remaining work on earlier frames still completes, so the reported frame is always
+    the earliest rejected one, whatever order the API calls finish in.
+
+    With a grid larger than 1x1, consecutive frames are downscaled and tiled into one
+    contact sheet per image call. Only when a sheet is rejected are its frames moderated
+    one by one, at full size, to confirm the rejection and find the offending frame; a
+    sheet rejection no single frame confirms counts as approved. Clean videos need about
+    one image call per sheet instead of one per frame.
+
+    Args:
+        frames (iterable): PIL images in playback order; a frame's info['timestamp'], if
+            set, is its position in seconds and is added to a rejection reason.
+        policies (dict or Policy): Custom moderation policies, or a compiled Policy.
+        sensitivity (str): Sensitivity level.
+        max_workers (int): Maximum number of moderation API calls in flight.
+        cancel_event (threading.Event): Optional event that abandons the remaining frames when set.
+        grid (str): Contact sheet grid as 'COLUMNSxROWS'; defaults to MOSAIC_GRID.
+
+    Returns:
+        tuple: A tuple containing the status ('Approved' or 'Rejected'), reason, and tags.
+
+    Raises:
+        ValueError: If the grid is not of the form 'COLUMNSxROWS'.
+    """
+    policy = compile_policy(policies, sensitivity)
+    columns, rows = parse_grid(grid or MOSAIC_GRID)
+    sheet_frames = columns * rows
+    frames = iter(frames)
+    max_frames_in_flight = max_workers * 2 * sheet_frames
+
+    api_pool = ThreadPoolExecutor(max_workers=max_workers)
+    frame_index = 0
+    image_calls = 0
+    try:
+        # Maps each future to the indices of the frames it covers and the kind of work
+        in_flight = {}
+        # Number of unfinished tasks per frame, used to bound frames held in memory
+        open_frames = {}
+        # Frames with unfinished tasks, kept in case their sheet has to be checked frame by frame
+        held_frames = {}
+        # Frames waiting to fill the next contact sheet, as (frame index, frame) pairs
+        sheet = []
+        # OCR texts waiting to be moderated as a batch, as (frame index, text) pairs
+        ocr_texts = []
+        # Tags found per frame index
+        frame_tags = {}
+        # Earliest rejected frame so far, as (frame index, reason)
+        rejected = None
+        exhausted = False
+
+        def submit_images(entries):
+            nonlocal image_calls
+            image_calls += 1
+            indices = [index for index, _ in entries]
+            if len(entries) == 1:
+                image = entries[0][1]
+                kind = 'image'
+            else:
+                image = build_contact_sheet([frame for _, frame in entries], columns)
+                kind = 'sheet'
+            future = submit_in_context(api_pool, moderate_image_content, image, policy)
+            in_flight[future] = (indices, kind)
+
+        while in_flight or ocr_texts or sheet or not exhausted:
+            while not exhausted and len(open_frames) < max_frames_in_flight:
+                frame = next(frames, None)
+                if frame is None:
+                    exhausted = True
+                    break
+                in_flight[submit_ocr(frame)] = ([frame_index], 'ocr')
+                open_frames[frame_index] = 2
+                held_frames[frame_index] = frame
+                sheet.append((frame_index, frame))
+                frame_index += 1
+                if len(sheet) == sheet_frames:
+                    submit_images(sheet)
+                    sheet = []
+            # A partial sheet is sent once no more frames are coming
+            if sheet and exhausted:
+                submit_images(sheet)
+                sheet = []
+
+            # Flush a full batch, or whatever is left once no more OCR results are coming
+            ocr_running = any(kind == 'ocr' for _, kind in in_flight.values())
+            if ocr_texts and (len(ocr_texts) >= OCR_TEXT_BATCH_SIZE or not ocr_running):
+                batch, ocr_texts = ocr_texts[:OCR_TEXT_BATCH_SIZE], ocr_texts[OCR_TEXT_BATCH_SIZE:]
+                texts = [text for _, text in batch]
+                in_flight[submit_in_context(api_pool, moderate_text_batch, texts, policy)] = ([index for index, _ in batch], 'text')
+
+            if not in_flight:
+                continue
+
+            # Wake up periodically to notice an external cancellation
+            done, _ = wait(in_flight, timeout=CANCEL_POLL_INTERVAL if cancel_event else None, return_when=FIRST_COMPLETED)
+            if cancel_event is not None and cancel_event.is_set():
+                for outstanding in in_flight:
+                    outstanding.cancel()
+                return "Rejected", "Frame moderation cancelled", collect_tags(frame_tags)
+
+            for future in done:
+                indices, kind = in_flight.pop(future)
+
+                if kind == 'ocr':
+                    extracted_text = future.result()
+                    if extracted_text:
+                        ocr_texts.append((indices[0], extracted_text))
+                        open_frames[indices[0]] += 1
+                    verdicts = []
+                elif kind == 'text':
+                    verdicts = future.result()
+                elif kind == 'sheet':
+                    status, _, sheet_tags = future.result()
+                    if status == "Rejected":
+                        # Confirm the rejection and locate the offending frames at full size
+                        logger.info(f"Contact sheet of frames {indices[0] + 1}-{indices[-1] + 1} rejected, checking each frame")
+                        count('video.sheets_rechecked')
+                        for index in indices:
+                            open_frames[index] += 1
+                            submit_images([(index, held_frames[index])])
+                        sheet_tags = []
+                    verdicts = [("Approved", "Content is appropriate", sheet_tags)]
+                else:
+                    verdicts = [future.result()]
+
+                for index, (status, reason, item_tags) in zip(indices, verdicts):
+                    frame_tags.setdefault(index, []).extend(item_tags)
+                    if status == "Rejected" and (rejected is None or index < rejected[0]):
+                        timestamp = held_frames[index].info.get('timestamp')
+                        if timestamp is not None:
+                            reason = f"{reason} (frame at {format_timestamp(timestamp)})"
+                        rejected = (index, reason)
+
+                for index in indices:
+                    open_frames[index] -= 1
+                    if open_frames[index] == 0:
+                        del open_frames[index]
+                        held_frames.pop(index, None)
+
+            if rejected is not None:
+                # Only work on earlier frames can still change which frame is reported, so
+                # no more frames are pulled and work on later ones is abandoned
+                exhausted = True
+                for outstanding, (outstanding_indices, _) in list(in_flight.items()):
+                    if min(outstanding_indices) > rejected[0]:
+                        outstanding.cancel()
+                        del in_flight[outstanding]
+                ocr_texts = [entry for entry in ocr_texts if entry[0] < rejected[0]]
+                sheet = [entry for entry in sheet if entry[0] < rejected[0]]
+
+        if rejected is not None:
+            index, reason = rejected
+            logger.info(f"Frame {index + 1} is the earliest rejected frame")
+            return "Rejected", reason, collect_tags(frame_tags, index)
+
+        if frame_index == 0:
+            return "Rejected", "No frames were extracted from the video", []
+
+        logger.info(f"Moderated {frame_index} frames with {image_calls} image calls")
+        return "Approved", "Content is appropriate", collect_tags(frame_tags)
+
+    finally:
+        count('video.frames_moderated', frame_index)
+        count('video.image_calls', image_calls)
+        api_pool.shutdown(wait=False, cancel_futures=True)
+
+def collect_tags(frame_tags, last_index=None):
+    """
+    Returns:
+        list: The tags of the frames up to last_index (all frames if None), in frame order.
+    """
+    return [
+        tag
+        for index in sorted(frame_tags)
+        if last_index is None or index <= last_index
+        for tag in frame_tags[index]
+    ]
+
+def parse_grid(grid):
+    """
+    Parses a contact sheet grid.
+
+    Args:
+        grid (str): The grid as 'COLUMNSxROWS', e.g. '3x3'.
+
+    Returns:
+        tuple: The number of columns and rows.
+
+    Raises:
+        ValueError: If the grid is not of the form 'COLUMNSxROWS' with positive sizes.
+    """
+    try:
+        columns, rows = (int(size) for size in grid.lower().split('x'))
+    except ValueError:
+        raise ValueError(f"Mosaic grid must be of the form 'COLUMNSxROWS', got {grid!r}")
+    if columns < 1 or rows < 1:
+        raise ValueError(f"Mosaic grid must have at least one column and row, got {grid!r}")
+    return columns, rows
+
+def build_contact_sheet(frames, columns):
+    """
+    Tiles frames into one contact sheet no larger than MAX_SHEET_SIDE on either side.
+
+    Args:
+        frames (list): PIL images of the same size, in playback order.
+        columns (int): Number of tiles per row; the sheet has as many rows as needed.
+
+    Returns:
+        PIL.Image: The contact sheet.
+    """
+    columns = min(columns, len(frames))
+    rows = -(-len(frames) // columns)
+    width, height = frames[0].size
+    scale = min(1.0, MAX_SHEET_SIDE / (width * columns), MAX_SHEET_SIDE / (height * rows))
+    tile_size = (max(1, int(width * scale)), max(1, int(height * scale)))
+
+    sheet = Image.new('RGB', (tile_size[0] * columns, tile_size[1] * rows))
+    for position, frame in enumerate(frames):
+        tile = frame if frame.size == tile_size else frame.resize(tile_size, Image.BILINEAR)
+        sheet.paste(tile, ((position % columns) * tile_size[0], (position // columns) * tile_size[1]))
+    return sheet
@@ -1,17 +1,28 @@
 import io
-import requests
-import base64
-import openai
-from openai import OpenAI
+import time
+import asyncio
+from collections import namedtuple
 from PIL import Image
-import pytesseract
-import subprocess
 from utils.logger import logger
-from utils.config import OPENAI_API_KEY
-from utils.language_detection import detect_language
-from moderation.text_moderation import moderate_text_content
+from utils.fetcher import fetch_bytes, FetchError
+from utils.cache import verdict_cache
+from utils.metrics import span, count
+from moderation.backends import get_backend
+from moderation.policy import compile_policy
+from moderation.text_moderation import moderate_text_content, moderate_text_content_async, prefilter_decision
+from moderation.ocr import ocr_image, submit_ocr
 
-client = OpenAI(api_key=OPENAI_API_KEY)
+# Largest side, in pixels, worth sending to the image moderator; DALL-E works at 1024x1024
+MAX_IMAGE_SIDE = 1024
+
+# Upload limit of the image edit endpoint
+MAX_PAYLOAD_BYTES = 4 * 1024 * 1024
+
+# zlib level for PNG payloads; low levels encode several times faster at a modest size cost
+PNG_COMPRESS_LEVEL = 1
+
+# Image payload ready for upload: encoded bytes, format, (width, height) and encode time in ms
+PreparedImage = namedtuple('PreparedImage', ['data', 'format', 'size', 'encode_ms'])
 
 def moderate_image(item, policies=None, sensitivity='medium'):
     """
@@ -19,7 +30,7 @@ def moderate_image(item, policies=None, sensitivity='medium'):
 
     Args:
         item (dict): The image item to moderate.
-        policies (dict): Custom moderation policies.
+        policies (dict or Policy): Custom moderation policies, or a compiled Policy.
         sensitivity (str): Sensitivity level.
 
     Returns:
@@ -28,95 +39,184 @@ def moderate_image(item, policies=None, sensitivity='medium'):
     image_url = item.get('image_url', {}).get('url')
     if not image_url:
         return "Rejected", "No image URL provided", []
+    policy = compile_policy(policies, sensitivity)
 
-    response = requests.get(image_url)
-    if response.status_code != 200:
+    try:
+        image_data = fetch_bytes(image_url, 'image')
+    except FetchError as e:
+        logger.warning(f"Unable to download image {image_url}: {e}")
         return "Rejected", "Unable to download image", []
 
-    image_data = response.content
-
     # Open image
     image = Image.open(io.BytesIO(image_data))
 
+    # Encode once for the visual check, passing the downloaded bytes through when possible
+    prepared = prepare_image(image, image_data)
+
     # Moderate the image content
-    status, reason, tags = moderate_image_content(image, policies, sensitivity)
-    print("image moderation status, reason, tags", status, reason, tags)
+    status, reason, tags = moderate_image_content(prepared, policy)
+    if status == "Rejected":
+        return status, reason, tags
+
+    # OCR runs on the shared pool; it is skipped when Tesseract is missing or the image has no text
+    extracted_text = ocr_image(image)
+    if extracted_text:
+        # Moderate the extracted text
+        status_text, reason_text, tags_text = moderate_text_content(extracted_text, policy)
+        tags.extend(tags_text)
+        if status_text == "Rejected":
+            return status_text, reason_text, tags
+
+    return "Approved", "Content is appropriate", tags
+
+async def moderate_image_async(item, policies=None, sensitivity='medium'):
+    """
+    Async variant of moderate_image; downloading, encoding and OCR run off the event loop.
+    """
+    image_url = item.get('image_url', {}).get('url')
+    if not image_url:
+        return "Rejected", "No image URL provided", []
+    policy = compile_policy(policies, sensitivity)
+
+    try:
+        image_data = await asyncio.to_thread(fetch_bytes, image_url, 'image')
+    except FetchError as e:
+        logger.warning(f"Unable to download image {image_url}: {e}")
+        return "Rejected", "Unable to download image", []
+
+    image = Image.open(io.BytesIO(image_data))
+    prepared = await asyncio.to_thread(prepare_image, image, image_data)
+
+    status, reason, tags = await moderate_image_content_async(prepared, policy)
     if status == "Rejected":
         return status, reason, tags
 
-    # Check if Tesseract is installed before attempting OCR
-    if is_tesseract_installed():
-        extracted_text = extract_text_from_image(image)
-        if extracted_text:
-            # Moderate the extracted text
-            status_text, reason_text, tags_text = moderate_text_content(extracted_text, policies, sensitivity)
-            tags.extend(tags_text)
-            if status_text == "Rejected":
-                return status_text, reason_text, tags
-    else:
-        logger.warning("Tesseract is not installed. Skipping OCR and text moderation.")
+    # The grayscale conversion and text pre-check in submit_ocr are CPU-bound too
+    ocr_future = await asyncio.to_thread(submit_ocr, image)
+    extracted_text = await asyncio.wrap_future(ocr_future)
+    if extracted_text:
+        status_text, reason_text, tags_text = await moderate_text_content_async(extracted_text, policy)
+        tags.extend(tags_text)
+        if status_text == "Rejected":
+            return status_text, reason_text, tags
 
     return "Approved", "Content is appropriate", tags
 
-def moderate_image_content(image, policies, sensitivity):
+def moderate_image_content(image, policies=None, sensitivity='medium'):
     """
-    Moderates the visual content of the image using DALL-E's latest version.
+    Moderates the visual content of the image with the backend selected by the policies.
+
+    The OpenAI backend asks DALL-E to edit the image; the local backend runs an NSFW
+    classifier first and only sends ambiguous images on to DALL-E.
 
     Args:
-        image (PIL.Image): The image to moderate.
-        policies (dict): Custom moderation policies.
-        sensitivity (str): Sensitivity level (not used in this implementation).
+        image (PIL.Image or PreparedImage): The image to moderate, or its prepared payload.
+        policies (dict or Policy): Custom moderation policies, or a compiled Policy.
+        sensitivity (str): Sensitivity level.
 
     Returns:
         tuple: A tuple containing the status, reason, and tags.
     """
-    # Convert PIL Image to bytes
-    buffered = io.BytesIO()
-    image.save(buffered, format="PNG")
-    image_bytes = buffered.getvalue()
+    if not isinstance(image, PreparedImage):
+        image = prepare_image(image)
 
-    try:
-        # Attempt to edit the image using DALL-E
-        response = client.images.edit(
-            image=image_bytes,
-            prompt="check and return an error if image is not appropriate with I want you to blur the image that are not appropriate",
-            n=1,
-            size="1024x1024"
-        )
-        print("DALL-E response", response)
-        # If we reach this point, DALL-E accepted the image
-        return "Approved", "Image content is appropriate", []
-    
-    except openai.BadRequestError as e:
-        # DALL-E rejected the image
-        error_message = str(e)
-        return "Rejected", f"DALL-E rejected the image: {error_message}", ["DALL-E rejection"]
-
-def extract_text_from_image(image):
+    policy = compile_policy(policies, sensitivity)
+    cache_key = policy.cache_key('image', image.data)
+    cached = verdict_cache.get(cache_key)
+    if cached is not None:
+        return cached
+
+    backend = get_backend(policy)
+    with span('image.moderate'):
+        verdict = prefilter_decision(backend.score_images([image])[0], policy)
+        if verdict is None:
+            verdict = backend.judge_image(image, policy)
+
+    verdict_cache.set(cache_key, verdict)
+    return verdict
+
+async def moderate_image_content_async(image, policies=None, sensitivity='medium'):
+    """
+    Async variant of moderate_image_content.
+    """
+    if not isinstance(image, PreparedImage):
+        image = await asyncio.to_thread(prepare_image, image)
+
+    policy = compile_policy(policies, sensitivity)
+    cache_key = policy.cache_key('image', image.data)
+    cached = verdict_cache.get(cache_key)
+    if cached is not None:
+        return cached
+
+    backend = get_backend(policy)
+    with span('image.moderate'):
+        verdict = prefilter_decision((await backend.score_images_async([image]))[0], policy)
+        if verdict is None:
+            verdict = await backend.judge_image_async(image, policy)
+
+    verdict_cache.set(cache_key, verdict)
+    return verdict
+
+def prepare_image(image, source_bytes=None):
     """
-    Extracts text from an image using OCR.
+    Produces the PNG payload sent to the image moderator.
+
+    The original bytes are passed through untouched when they already are a PNG within
+    MAX_IMAGE_SIDE and MAX_PAYLOAD_BYTES; otherwise the image is downscaled to fit
+    MAX_IMAGE_SIDE and encoded with fast compression, shrinking it further until the PNG
+    fits MAX_PAYLOAD_BYTES. The given image is left untouched.
 
     Args:
-        image (PIL.Image): The image to extract text from.
+        image (PIL.Image): The decoded image.
+        source_bytes (bytes): The downloaded bytes the image was decoded from, if any.
 
     Returns:
-        str: The extracted text, or None if extraction failed.
+        PreparedImage: The payload with its format, pixel size and encode time.
     """
-    try:
-        text = pytesseract.image_to_string(image)
-        text = text.strip()
-        return text if text else None
-    except pytesseract.TesseractNotFoundError:
-        logger.error("Tesseract is not installed or not in your PATH. OCR functionality is disabled.")
-        return None
-    except Exception as e:
-        logger.error(f"OCR error: {e}")
-        return None
-
-# Add this function to check if Tesseract is installed
-def is_tesseract_installed():
-    try:
-        subprocess.run(['tesseract', '--version'], stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
-        return True
-    except FileNotFoundError:
-        return False
+    if (source_bytes is not None and image.format == 'PNG'
+            and max(image.size) <= MAX_IMAGE_SIDE and len(source_bytes) <= MAX_PAYLOAD_BYTES):
+        logger.info(f"Passing through {len(source_bytes)} byte PNG of {image.size[0]}x{image.size[1]}")
+        count('image.passthrough')
+        return PreparedImage(source_bytes, 'PNG', image.size, 0.0)
+
+    started = time.perf_counter()
+    with span('image.encode') as encode:
+        if max(image.size) > MAX_IMAGE_SIDE:
+            target_size = scaled_size(image.size, MAX_IMAGE_SIDE / max(image.size))
+            if source_bytes is not None:
+                # Let the JPEG decoder downscale during decoding; draft changes the image it
+                # is called on, so it works on a fresh decoder rather than the caller's image
+                image = Image.open(io.BytesIO(source_bytes))
+                image.draft('RGB', target_size)
+            image = image.resize(target_size, Image.BILINEAR, reducing_gap=2.0)
+        if image.mode not in ('RGB', 'RGBA', 'L', 'LA'):
+            image = image.convert('RGBA' if 'transparency' in image.info or image.mode == 'PA' else 'RGB')
+
+        data = encode_png(image)
+        while len(data) > MAX_PAYLOAD_BYTES and max(image.size) > 1:
+            # PNG size grows with the pixel count; aim a little under the limit
+            scale = 0.9 * (MAX_PAYLOAD_BYTES / len(data)) ** 0.5
+            image = image.resize(scaled_size(image.size, scale), Image.BILINEAR)
+            data = encode_png(image)
+        encode.count('image.encoded_bytes', len(data))
+    encode_ms = (time.perf_counter() - started) * 1000
+
+    prepared = PreparedImage(data, 'PNG', image.size, encode_ms)
+    logger.info(f"Encoded {len(prepared.data)} byte PNG of {image.size[0]}x{image.size[1]} in {encode_ms:.1f} ms")
+    return prepared
+
+def scaled_size(size, scale):
+    """
+    Returns:
+        tuple: The (width, height) scaled by the factor, at least one pixel each.
+    """
+    return max(1, round(size[0] * scale)), max(1, round(size[1] * scale))
+
+def encode_png(image):
+    """
+    Returns:
+        bytes: The image encoded as a PNG with PNG_COMPRESS_LEVEL.
+    """
+    buffered = io.BytesIO()
+    image.save(buffered, format="PNG", compress_level=PNG_COMPRESS_LEVEL)
+    return buffered.getvalue()
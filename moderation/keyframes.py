@@ -0,0 +1,68 @@
+import numpy as np
+from PIL import Image
+
+# Width and height of the difference hash, in bits per row and rows
+HASH_SIZE = 8
+
+# Minimum number of differing hash bits for a frame to count as a new keyframe
+KEYFRAME_HASH_THRESHOLD = 10
+
+def dhash(image, hash_size=HASH_SIZE):
+    """
+    Computes the difference hash of an image.
+
+    The image is converted to grayscale and downscaled to (hash_size + 1) x hash_size
+    pixels; each bit records whether a pixel is brighter than its right neighbour.
+
+    Args:
+        image (PIL.Image): The image to hash.
+        hash_size (int): Number of bits per hash row.
+
+    Returns:
+        numpy.ndarray: A flat boolean array of hash_size * hash_size bits.
+    """
+    small = image.convert('L').resize((hash_size + 1, hash_size), Image.BILINEAR)
+    pixels = np.asarray(small, dtype=np.int16)
+    return (pixels[:, 1:] > pixels[:, :-1]).ravel()
+
+def hash_distance(hash_a, hash_b):
+    """
+    Computes the Hamming distance between two perceptual hashes.
+
+    Args:
+        hash_a (numpy.ndarray): The first hash.
+        hash_b (numpy.ndarray): The second hash.
+
+    Returns:
+        int: The number of differing bits.
+    """
+    return int(np.count_nonzero(hash_a != hash_b))
+
+def select_keyframes(frames, threshold=KEYFRAME_HASH_THRESHOLD, stats=None):
+    """
+    Forwards only frames that differ visibly from the last forwarded frame.
+
+    Args:
+        frames (iterable): PIL images in playback order.
+        threshold (int): Minimum hash distance from the last forwarded frame.
+        stats (dict): Optional dictionary updated with 'total', 'forwarded' and 'skipped' counts.
+
+    Returns:
+        iterator: The selected keyframes, produced lazily.
+    """
+    if stats is None:
+        stats = {}
+    stats.update(total=0, forwarded=0, skipped=0)
+    return _iter_keyframes(frames, threshold, stats)
+
+def _iter_keyframes(frames, threshold, stats):
+    last_hash = None
+    for frame in frames:
+        stats['total'] += 1
+        frame_hash = dhash(frame)
+        if last_hash is not None and hash_distance(frame_hash, last_hash) <= threshold:
+            stats['skipped'] += 1
+            continue
+        last_hash = frame_hash
+        stats['forwarded'] += 1
+        yield frame
@@ -0,0 +1,181 @@
+import os
+import atexit
+import shutil
+import threading
+import functools
+import multiprocessing
+from concurrent.futures import Future, ProcessPoolExecutor
+import numpy as np
+import pytesseract
+from PIL import Image
+from utils.logger import logger
+from utils.metrics import span, count
+
+# Number of Tesseract worker processes shared by every OCR caller
+MAX_OCR_PROCESSES = os.cpu_count() or 1
+
+# Longest side, in pixels, of images handed to Tesseract
+OCR_MAX_SIDE = 1600
+
+# Width of the thumbnail used by the text pre-check
+TEXT_CHECK_WIDTH = 256
+
+# Brightness step between neighbouring pixels that counts as an edge, and the share
+# of edge pixels below which an image is assumed to contain no text
+TEXT_EDGE_STEP = 48
+TEXT_EDGE_DENSITY = 0.01
+
+_pool = None
+_pool_lock = threading.Lock()
+
+@functools.lru_cache(maxsize=None)
+def is_tesseract_installed():
+    """
+    Checks once per process whether the Tesseract binary is available.
+
+    Returns:
+        bool: True if Tesseract can be run.
+    """
+    command = pytesseract.pytesseract.tesseract_cmd
+    installed = shutil.which(command) is not None or os.path.isfile(command)
+    if not installed:
+        logger.warning("Tesseract is not installed. Skipping OCR and text moderation.")
+    return installed
+
+def get_ocr_pool():
+    """
+    Returns the process pool running Tesseract, starting it on first use.
+
+    Returns:
+        concurrent.futures.ProcessPoolExecutor: The shared OCR pool.
+    """
+    global _pool
+    with _pool_lock:
+        if _pool is None:
+            # Forking a process that runs threads (HTTP clients, the async loop) can copy held
+            # locks into the children; forkserver starts them from a clean process instead
+            start_method = 'forkserver' if 'forkserver' in multiprocessing.get_all_start_methods() else 'spawn'
+            _pool = ProcessPoolExecutor(
+                max_workers=MAX_OCR_PROCESSES, mp_context=multiprocessing.get_context(start_method)
+            )
+            atexit.register(_pool.shutdown, wait=False, cancel_futures=True)
+        return _pool
+
+def submit_ocr(image):
+    """
+    Schedules OCR of an image on the shared pool.
+
+    The image is converted to grayscale and downscaled here so that less data crosses
+    the process boundary; images that fail the text pre-check, or any image when
+    Tesseract is missing, resolve immediately to None without reaching the pool.
+
+    Args:
+        image (PIL.Image): The image to extract text from.
+
+    Returns:
+        concurrent.futures.Future: Resolves to the extracted text, or None.
+    """
+    gray = downscale(image.convert('L'), OCR_MAX_SIDE)
+    if not is_tesseract_installed() or not likely_contains_text(gray):
+        count('ocr.skipped')
+        skipped = Future()
+        skipped.set_result(None)
+        return skipped
+    count('ocr.submitted')
+    return get_ocr_pool().submit(extract_text_from_image, gray)
+
+def ocr_image(image):
+    """
+    Extracts text from an image on the shared OCR pool and waits for the result.
+
+    Args:
+        image (PIL.Image): The image to extract text from.
+
+    Returns:
+        str: The extracted text, or None if there is none or extraction failed.
+    """
+    with span('ocr'):
+        return submit_ocr(image).result()
+
+def extract_text_from_image(image):
+    """
+    Extracts text from an image using OCR, in the calling process.
+
+    Args:
+        image (PIL.Image): The image to extract text from.
+
+    Returns:
+        str: The extracted text, or None if extraction failed.
+    """
+    try:
+        text = pytesseract.image_to_string(binarize(downscale(image.convert('L'), OCR_MAX_SIDE)))
+        text = text.strip()
+        return text if text else None
+    except pytesseract.TesseractNotFoundError:
+        logger.error("Tesseract is not installed or not in your PATH. OCR functionality is disabled.")
+        return None
+    except Exception as e:
+        logger.error(f"OCR error: {e}")
+        return None
+
+def downscale(image, max_side):
+    """
+    Shrinks an image so that its longest side is at most max_side pixels.
+
+    Args:
+        image (PIL.Image): The image to shrink.
+        max_side (int): The largest allowed side.
+
+    Returns:
+        PIL.Image: The image itself if it already fits, otherwise a resized copy.
+    """
+    if max(image.size) <= max_side:
+        return image
+    scale = max_side / max(image.size)
+    return image.resize((max(1, round(image.size[0] * scale)), max(1, round(image.size[1] * scale))), Image.BILINEAR)
+
+def binarize(gray):
+    """
+    Converts a grayscale image to black and white with Otsu's threshold.
+
+    Args:
+        gray (PIL.Image): A grayscale ('L') image.
+
+    Returns:
+        PIL.Image: The binarized image.
+    """
+    pixels = np.asarray(gray)
+    histogram = np.bincount(pixels.ravel(), minlength=256).astype(np.float64)
+    levels = np.arange(256)
+
+    # Pick the threshold that maximizes the between-class variance
+    weight_below = np.cumsum(histogram)
+    weight_above = weight_below[-1] - weight_below
+    sum_below = np.cumsum(histogram * levels)
+    mean_below = sum_below / np.maximum(weight_below, 1)
+    mean_above = (sum_below[-1] - sum_below) / np.maximum(weight_above, 1)
+    threshold = int(np.argmax(weight_below * weight_above * (mean_below - mean_above) ** 2))
+
+    return Image.fromarray(np.where(pixels > threshold, 255, 0).astype(np.uint8))
+
+def likely_contains_text(gray):
+    """
+    Cheaply estimates whether an image may contain text.
+
+    Text produces many sharp horizontal brightness changes; photos and flat frames
+    without text produce few. The check errs on the side of running OCR.
+
+    Args:
+        gray (PIL.Image): A grayscale ('L') image.
+
+    Returns:
+        bool: False if the image almost certainly contains no text.
+    """
+    if gray.size[0] > TEXT_CHECK_WIDTH:
+        height = max(1, round(gray.size[1] * TEXT_CHECK_WIDTH / gray.size[0]))
+        gray = gray.resize((TEXT_CHECK_WIDTH, height), Image.BILINEAR)
+    pixels = np.asarray(gray, dtype=np.int16)
+    if pixels.shape[1] < 2:
+        return False
+    edges = np.abs(np.diff(pixels, axis=1)) > TEXT_EDGE_STEP
+    return edges.mean() >= TEXT_EDGE_DENSITY
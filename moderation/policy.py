@@ -0,0 +1,366 @@
+import json
+import hashlib
+import functools
+from moderation.blocklist import Blocklist
+
+# Instruction added to the GPT prompt for each sensitivity level
+SENSITIVITY_INSTRUCTIONS = {
+    'low': "Be lenient in your analysis, only flag severe violations.",
+    'medium': "Apply standard moderation guidelines.",
+    'high': "Be strict in your analysis, flag even minor violations."
+}
+
+# (approve below, reject at or above) moderation scores per sensitivity level;
+# scores in between are escalated to GPT-4
+PREFILTER_THRESHOLDS = {
+    'low': (0.2, 0.9),
+    'medium': (0.1, 0.8),
+    'high': (0.02, 0.6),
+}
+
+# Moderation endpoint categories covered by each policy category name
+POLICY_CATEGORY_MAP = {
+    'harassment': ['harassment', 'harassment/threatening'],
+    'hate': ['hate', 'hate/threatening'],
+    'hate_speech': ['hate', 'hate/threatening'],
+    'violence': ['violence', 'violence/graphic'],
+    'graphic_violence': ['violence/graphic'],
+    'self_harm': ['self-harm', 'self-harm/intent', 'self-harm/instructions'],
+    'sexual': ['sexual'],
+    'explicit_content': ['sexual'],
+    'explicit_nudity': ['sexual'],
+    'illicit': ['illicit', 'illicit/violent'],
+}
+
+# Policy keys that route text by its detected language
+LANGUAGE_POLICY_KEYS = ('languages', 'supported_languages', 'unsupported_language')
+
+# What happens to text in a language the policy does not support
+UNSUPPORTED_LANGUAGE_ACTIONS = ('reject', 'approve')
+
+# Number of distinct (policies, sensitivity) combinations kept compiled
+COMPILED_POLICY_CACHE_SIZE = 128
+
+# Moderation guidelines shared by every policy; they open the system prompt, ahead of the
+# policy-specific instructions. At about 200 tokens the prefix is well under the 1024
+# tokens provider prompt caching needs, so no caching discount applies to it
+TEXT_GUIDELINES = """As an AI content moderation assistant, analyze the text you are given for compliance with community guidelines.
+
+Consider the context and use of idiomatic expressions. Do not flag content that uses figurative language or common expressions unless they genuinely promote disallowed content. Focus on the overall intent and meaning of the text.
+
+Identify any issues related to disallowed content such as harassment, hate speech, explicit content, privacy violations, and misinformation. Provide a decision ('Approved' or 'Rejected'), reasons, and relevant tags.
+
+The response should be in English, regardless of the text's language.
+
+Please return your response in the following JSON format:
+
+{
+    "decision": "Approved" or "Rejected",
+    "reason": "Brief explanation of the decision",
+    "tags": ["tag1", "tag2", "tag3"]
+}"""
+
+BATCH_GUIDELINES = """As an AI content moderation assistant, analyze each of the texts you are given independently for compliance with community guidelines.
+
+Consider the context and use of idiomatic expressions. Do not flag content that uses figurative language or common expressions unless they genuinely promote disallowed content. Focus on the overall intent and meaning of each text.
+
+Identify any issues related to disallowed content such as harassment, hate speech, explicit content, privacy violations, and misinformation. Provide a decision ('Approved' or 'Rejected'), reasons, and relevant tags for every text.
+
+The response should be in English, regardless of the texts' language.
+
+Please return your response in the following JSON format, with one entry per text:
+
+{
+    "results": [
+        {
+            "index": 0,
+            "decision": "Approved" or "Rejected",
+            "reason": "Brief explanation of the decision",
+            "tags": ["tag1", "tag2", "tag3"]
+        }
+    ]
+}"""
+
+class Policy:
+    """
+    Custom moderation policies and a sensitivity level, validated and compiled once.
+
+    Holds everything derived from the policies that moderation needs on every call:
+    the prompt instructions and system prompts, the pre-filter thresholds, the ignored
+    moderation categories and a stable digest for cache keys. Instances are shared
+    through compile_policy and must not be modified.
+
+    Policies can name blocklists that reject text without any API call:
+        'blocklists': {category: list of terms, or name of a file with one term per line
+            in the MODERATION_BLOCKLIST_DIR directory},
+            e.g. {'slurs': 'slurs.txt', 'spam': ['buy followers', 'spam.example.com']}.
+            Text containing a term is rejected with the category as its tag.
+
+    Policies can also route text by language:
+        'languages': {language code: policy overrides} applied to text in that language,
+            e.g. {'de': {'disallowed_categories': [...], 'sensitivity': 'high'}}.
+        'supported_languages': the language codes moderated at all; the keys of
+            'languages' are always supported.
+        'unsupported_language': 'reject' (default) or 'approve' text in any other language.
+    """
+
+    def __init__(self, policies=None, sensitivity='medium'):
+        """
+        Args:
+            policies (dict): Custom moderation policies.
+            sensitivity (str): Sensitivity level ('low', 'medium', 'high').
+
+        Raises:
+            ValueError: If the policies or the sensitivity level are invalid.
+        """
+        policies = {} if policies is None else policies
+        if not isinstance(policies, dict):
+            raise ValueError("Policies must be a dict")
+        if sensitivity not in SENSITIVITY_INSTRUCTIONS:
+            raise ValueError(f"Unknown sensitivity level: {sensitivity}")
+
+        self.policies = policies
+        self.sensitivity = sensitivity
+        self.backend = policies.get('backend')
+        self.disallowed_categories = category_list(policies, 'disallowed_categories')
+        self.allowed_categories = category_list(policies, 'allowed_categories')
+        blocklists = policies.get('blocklists') or {}
+        if not isinstance(blocklists, dict):
+            raise ValueError("'blocklists' must map categories to terms or file paths")
+        self.blocklist = Blocklist(blocklists) if blocklists else None
+
+        self.instructions = create_policy_instructions(policies, sensitivity)
+        self.text_prompt = f"{TEXT_GUIDELINES}\n\nModeration policy: {self.instructions}"
+        self.batch_prompt = f"{BATCH_GUIDELINES}\n\nModeration policy: {self.instructions}"
+
+        self.approve_threshold, self.reject_threshold = PREFILTER_THRESHOLDS[sensitivity]
+        disallowed = map_policy_categories(self.disallowed_categories)
+        self.ignored_categories = frozenset(map_policy_categories(self.allowed_categories) - disallowed)
+
+        canonical = json.dumps([policies, sensitivity], sort_keys=True, default=str)
+        self.digest = hashlib.sha256(canonical.encode('utf-8')).hexdigest()
+
+        self._compile_language_policies(policies, sensitivity)
+
+    def _compile_language_policies(self, policies, sensitivity):
+        languages = policies.get('languages') or {}
+        if not isinstance(languages, dict) or not all(isinstance(overrides, dict) for overrides in languages.values()):
+            raise ValueError("'languages' must map language codes to policy dicts")
+        supported = category_list(policies, 'supported_languages')
+        self.unsupported_language = policies.get('unsupported_language', 'reject')
+        if self.unsupported_language not in UNSUPPORTED_LANGUAGE_ACTIONS:
+            raise ValueError(f"'unsupported_language' must be one of {', '.join(UNSUPPORTED_LANGUAGE_ACTIONS)}")
+
+        self.routes_by_language = bool(languages or supported)
+        self.supported_languages = None
+        self.language_policies = {}
+        if not self.routes_by_language:
+            return
+
+        # Language policies never route again, so they are compiled without the routing keys
+        base = {key: value for key, value in policies.items() if key not in LANGUAGE_POLICY_KEYS}
+        self.default_language_policy = compile_policy(base, sensitivity)
+        for language, overrides in languages.items():
+            merged = dict(base)
+            merged.update((key, value) for key, value in overrides.items()
+                          if key != 'sensitivity' and key not in LANGUAGE_POLICY_KEYS)
+            self.language_policies[normalize_language(language)] = compile_policy(
+                merged, overrides.get('sensitivity', sensitivity)
+            )
+        if supported:
+            supported_languages = set(normalize_language(language) for language in supported)
+            self.supported_languages = frozenset(supported_languages | set(self.language_policies))
+
+    def for_language(self, language):
+        """
+        Returns the policy that applies to text in the given language.
+
+        Args:
+            language (str): The language code, e.g. 'en' or 'zh-cn'.
+
+        Returns:
+            Policy: The language's policy, or None if the language is not supported.
+        """
+        if not self.routes_by_language:
+            return self
+        language = normalize_language(language)
+        if self.supported_languages is not None and language not in self.supported_languages:
+            return None
+        return self.language_policies.get(language, self.default_language_policy)
+
+    def for_languages(self, languages):
+        """
+        Picks the strictest policy among those of the languages found in a text, so that
+        mixing in a more leniently moderated language cannot relax the moderation.
+
+        An unsupported language wins when such text is rejected; otherwise policies
+        rank by sensitivity, then by their number of disallowed categories.
+
+        Args:
+            languages (list): The language codes found, in text order.
+
+        Returns:
+            tuple: The language and its policy, or None as the policy if the language is
+            not supported.
+        """
+        candidates = [(language, self.for_language(language)) for language in languages]
+        if self.unsupported_language == 'reject':
+            unsupported = [language for language, language_policy in candidates if language_policy is None]
+            if unsupported:
+                return unsupported[0], None
+        supported = [candidate for candidate in candidates if candidate[1] is not None]
+        if not supported:
+            return candidates[0]
+        return max(supported, key=lambda candidate: candidate[1].strictness())
+
+    def strictness(self):
+        """
+        Returns:
+            tuple: A key that orders policies from the most lenient to the strictest.
+        """
+        return list(SENSITIVITY_INSTRUCTIONS).index(self.sensitivity), len(self.disallowed_categories)
+
+    def unsupported_verdict(self, language):
+        """
+        Returns:
+            tuple: The (status, reason, tags) verdict for text in an unsupported language.
+        """
+        if self.unsupported_language == 'approve':
+            return "Approved", f"Language '{language}' is not moderated", []
+        return "Rejected", f"Unsupported language: {language}", ["unsupported_language"]
+
+    def blocklist_verdict(self, text):
+        """
+        Checks text against the policy's blocklists.
+
+        Args:
+            text (str): The text to check.
+
+        Returns:
+            tuple: The (status, reason, tags) rejection, or None if no blocklisted term matched.
+        """
+        if self.blocklist is None:
+            return None
+        category = self.blocklist.match(text)
+        if category is None:
+            return None
+        return "Rejected", f"Contains a blocklisted {category} term", [category]
+
+    def cache_key(self, kind, content):
+        """
+        Builds a content-addressed cache key for content moderated under this policy.
+
+        Args:
+            kind (str): The kind of content ('text', 'image', 'video', ...).
+            content (str or bytes): The normalized content or its identifying bytes.
+
+        Returns:
+            str: A key of the form '<kind>:<sha256>'.
+        """
+        digest = hashlib.sha256()
+        digest.update(content.encode('utf-8') if isinstance(content, str) else content)
+        digest.update(b'\0')
+        digest.update(self.digest.encode('ascii'))
+        return f"{kind}:{digest.hexdigest()}"
+
+    def __eq__(self, other):
+        return isinstance(other, Policy) and other.digest == self.digest
+
+    def __hash__(self):
+        return hash(self.digest)
+
+    def __repr__(self):
+        return f"Policy({self.policies!r}, {self.sensitivity!r})"
+
+def compile_policy(policies=None, sensitivity='medium'):
+    """
+    Returns the compiled Policy for the given policies and sensitivity level.
+
+    Compiled policies are cached, so repeated calls with equal arguments return the
+    same instance; a Policy passed as `policies` is returned unchanged.
+
+    Args:
+        policies (dict or Policy): Custom moderation policies, or an already compiled Policy.
+        sensitivity (str): Sensitivity level ('low', 'medium', 'high').
+
+    Returns:
+        Policy: The compiled policy.
+
+    Raises:
+        ValueError: If the policies or the sensitivity level are invalid.
+    """
+    if isinstance(policies, Policy):
+        return policies
+    if policies is not None and not isinstance(policies, dict):
+        raise ValueError("Policies must be a dict")
+    return _compile(json.dumps(policies or {}, sort_keys=True, default=str), sensitivity)
+
+@functools.lru_cache(maxsize=COMPILED_POLICY_CACHE_SIZE)
+def _compile(canonical_policies, sensitivity):
+    return Policy(json.loads(canonical_policies), sensitivity)
+
+def category_list(policies, key):
+    """
+    Reads a list of names from the policies.
+
+    Args:
+        policies (dict): Custom moderation policies.
+        key (str): 'disallowed_categories', 'allowed_categories' or 'supported_languages'.
+
+    Returns:
+        tuple: The names.
+
+    Raises:
+        ValueError: If the value is not a list of strings.
+    """
+    categories = policies.get(key) or []
+    if not isinstance(categories, (list, tuple)) or not all(isinstance(category, str) for category in categories):
+        raise ValueError(f"'{key}' must be a list of names")
+    return tuple(categories)
+
+def normalize_language(language):
+    """
+    Reduces a language tag to its lowercase primary subtag, e.g. 'zh-CN' to 'zh'.
+    """
+    return str(language).lower().replace('_', '-').split('-')[0]
+
+def map_policy_categories(categories):
+    """
+    Maps policy category names to moderation endpoint categories.
+
+    Args:
+        categories (list): Category names from the policies dict.
+
+    Returns:
+        set: The moderation endpoint categories they cover.
+    """
+    mapped = set()
+    for category in categories:
+        key = category.lower().replace(' ', '_').replace('-', '_')
+        mapped.update(POLICY_CATEGORY_MAP.get(key, []))
+    return mapped
+
+def create_policy_instructions(policies, sensitivity):
+    """
+    Creates policy instructions for the GPT-4 prompt based on custom policies and sensitivity level.
+
+    Args:
+        policies (dict): Custom moderation policies.
+        sensitivity (str): Sensitivity level.
+
+    Returns:
+        str: Policy instructions for the prompt.
+    """
+    instructions = SENSITIVITY_INSTRUCTIONS.get(sensitivity, SENSITIVITY_INSTRUCTIONS['medium'])
+
+    # Custom policies
+    if policies:
+        disallowed = policies.get('disallowed_categories', [])
+        allowed = policies.get('allowed_categories', [])
+
+        if disallowed:
+            instructions += f" Disallowed content categories include: {', '.join(disallowed)}."
+        if allowed:
+            instructions += f" Allowed content categories include: {', '.join(allowed)}."
+
+    return instructions
@@ -0,0 +1,250 @@
+import time
+import random
+import asyncio
+import threading
+import functools
+import weakref
+from utils.logger import logger
+from utils.metrics import span, count
+
+# Account limits shared by every OpenAI call made from this process
+REQUESTS_PER_MINUTE = 500
+TOKENS_PER_MINUTE = 200000
+
+# Retries for rate-limited (429) and server-side (5xx) failures, with jittered exponential backoff
+MAX_ATTEMPTS = 5
+BACKOFF_BASE = 0.5
+BACKOFF_CAP = 20.0
+
+_async_clients = weakref.WeakKeyDictionary()
+_async_clients_lock = threading.Lock()
+
+class TokenBucket:
+    """
+    Token bucket refilled continuously at `rate` tokens per second up to `capacity`.
+
+    Callers reserve tokens up front and then wait out any deficit, so the bucket can be
+    shared by threads and event loops alike and grants are served in arrival order.
+    """
+
+    def __init__(self, capacity, rate):
+        self.capacity = capacity
+        self.rate = rate
+        self._tokens = capacity
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def reserve(self, amount):
+        """
+        Takes tokens from the bucket, going into debt if there are not enough.
+
+        Args:
+            amount (float): Number of tokens needed; clamped to the bucket capacity.
+
+        Returns:
+            float: Seconds to wait before the reservation is covered.
+        """
+        amount = min(amount, self.capacity)
+        with self._lock:
+            now = time.monotonic()
+            self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+            self._updated = now
+            self._tokens -= amount
+            return max(0.0, -self._tokens / self.rate)
+
+class RateLimiter:
+    """
+    Combined requests-per-minute and tokens-per-minute limiter.
+    """
+
+    def __init__(self, requests_per_minute=REQUESTS_PER_MINUTE, tokens_per_minute=TOKENS_PER_MINUTE):
+        self.requests = TokenBucket(requests_per_minute, requests_per_minute / 60)
+        self.tokens = TokenBucket(tokens_per_minute, tokens_per_minute / 60)
+
+    def reserve(self, estimated_tokens):
+        """
+        Reserves capacity for one request.
+
+        Args:
+            estimated_tokens (int): Estimated prompt plus completion tokens.
+
+        Returns:
+            float: Seconds to wait before sending the request.
+        """
+        return max(self.requests.reserve(1), self.tokens.reserve(estimated_tokens))
+
+    def acquire(self, estimated_tokens):
+        delay = self.reserve(estimated_tokens)
+        if delay:
+            time.sleep(delay)
+
+    async def acquire_async(self, estimated_tokens):
+        delay = self.reserve(estimated_tokens)
+        if delay:
+            await asyncio.sleep(delay)
+
+rate_limiter = RateLimiter()
+
+@functools.lru_cache(maxsize=None)
+def get_client():
+    """
+    Returns the OpenAI client shared by every synchronous moderation call.
+
+    The OpenAI SDK is imported and the client built on first use, so that importing
+    the moderation modules stays cheap.
+
+    Returns:
+        openai.OpenAI: The shared client; retries are handled by call_openai.
+    """
+    from openai import OpenAI
+    return OpenAI(api_key=api_key(), max_retries=0)
+
+def get_async_client():
+    """
+    Returns the AsyncOpenAI client shared by every coroutine on the running event loop.
+
+    Its connection pool is tied to the loop, so each loop gets its own client.
+
+    Returns:
+        openai.AsyncOpenAI: The shared client; retries are handled by call_openai_async.
+    """
+    loop = asyncio.get_running_loop()
+    with _async_clients_lock:
+        client = _async_clients.get(loop)
+        if client is None:
+            from openai import AsyncOpenAI
+            client = AsyncOpenAI(api_key=api_key(), max_retries=0)
+            _async_clients[loop] = client
+        return client
+
+def api_key():
+    """
+    Returns:
+        str: The API key from utils/config.py, or None to let the SDK read the
+        OPENAI_API_KEY environment variable when that file is missing.
+    """
+    try:
+        from utils.config import OPENAI_API_KEY
+    except ImportError:
+        return None
+    return OPENAI_API_KEY
+
+def estimate_tokens(text, max_tokens=0):
+    """
+    Roughly estimates the tokens a request consumes, at about four characters per token.
+
+    Args:
+        text (str): The prompt or input text.
+        max_tokens (int): The completion budget of the request.
+
+    Returns:
+        int: The estimated token count.
+    """
+    return len(text) // 4 + 1 + max_tokens
+
+def call_openai(method, *args, estimated_tokens=1, **kwargs):
+    """
+    Calls a synchronous OpenAI method under the shared rate limits, retrying on 429 and 5xx.
+
+    Args:
+        method (callable): The client method, e.g. get_client().moderations.create.
+        *args: Positional arguments for the method.
+        estimated_tokens (int): Estimated tokens consumed by the request.
+        **kwargs: Keyword arguments for the method.
+
+    Returns:
+        The method's response.
+    """
+    endpoint = endpoint_name(method)
+    for attempt in range(MAX_ATTEMPTS):
+        rate_limiter.acquire(estimated_tokens)
+        try:
+            with span(f"openai.{endpoint}"):
+                response = method(*args, **kwargs)
+            record_usage(endpoint, response)
+            return response
+        except Exception as e:
+            delay = retry_delay(e, attempt)
+            if delay is None:
+                raise
+            logger.warning(f"OpenAI call failed ({e.__class__.__name__}), retrying in {delay:.1f}s")
+            count(f"openai.{endpoint}.retries")
+            time.sleep(delay)
+
+async def call_openai_async(method, *args, estimated_tokens=1, **kwargs):
+    """
+    Awaits an asynchronous OpenAI method under the shared rate limits, retrying on 429 and 5xx.
+
+    Args:
+        method (callable): The async client method, e.g. get_async_client().moderations.create.
+        *args: Positional arguments for the method.
+        estimated_tokens (int): Estimated tokens consumed by the request.
+        **kwargs: Keyword arguments for the method.
+
+    Returns:
+        The method's response.
+    """
+    endpoint = endpoint_name(method)
+    for attempt in range(MAX_ATTEMPTS):
+        await rate_limiter.acquire_async(estimated_tokens)
+        try:
+            with span(f"openai.{endpoint}"):
+                response = await method(*args, **kwargs)
+            record_usage(endpoint, response)
+            return response
+        except Exception as e:
+            delay = retry_delay(e, attempt)
+            if delay is None:
+                raise
+            logger.warning(f"OpenAI call failed ({e.__class__.__name__}), retrying in {delay:.1f}s")
+            count(f"openai.{endpoint}.retries")
+            await asyncio.sleep(delay)
+
+def endpoint_name(method):
+    """
+    Names the API resource a client method belongs to, e.g. 'completions' or 'moderations'.
+    """
+    owner = getattr(method, '__self__', None)
+    name = (type(owner).__name__ if owner is not None else method.__name__).lower()
+    return name[len('async'):] if name.startswith('async') else name
+
+def record_usage(endpoint, response):
+    """
+    Adds the token usage reported in a response to the active metrics.
+    """
+    usage = getattr(response, 'usage', None)
+    for field in ('prompt_tokens', 'completion_tokens'):
+        tokens = getattr(usage, field, None)
+        if isinstance(tokens, int):
+            count(f"openai.{endpoint}.{field}", tokens)
+
+def retry_delay(error, attempt):
+    """
+    Decides whether a failed call is retried and how long to wait first.
+
+    Args:
+        error (Exception): The error raised by the call.
+        attempt (int): Zero-based number of the failed attempt.
+
+    Returns:
+        float: Seconds to wait, or None if the error must be raised.
+    """
+    # The SDK is already loaded by the time one of its calls has failed
+    import openai
+
+    if attempt + 1 >= MAX_ATTEMPTS:
+        return None
+    if isinstance(error, openai.APIStatusError):
+        if error.status_code != 429 and error.status_code < 500:
+            return None
+        retry_after = error.response.headers.get('retry-after')
+        if retry_after:
+            try:
+                return min(float(retry_after), BACKOFF_CAP)
+            except ValueError:
+                pass
+    elif not isinstance(error, (openai.APIConnectionError, openai.APITimeoutError)):
+        return None
+
+    # Full jitter keeps concurrent callers from retrying in lockstep
+    return random.uniform(0, min(BACKOFF_CAP, BACKOFF_BASE * 2 ** attempt))
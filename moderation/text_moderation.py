@@ -1,13 +1,25 @@
-# Unchanged except for adding moderate_text_content function for reuse
-
-import openai
-from openai import OpenAI
 from utils.logger import logger
-from utils.config import OPENAI_API_KEY
-from utils.language_detection import detect_language
+from moderation.provider import get_client, get_async_client, call_openai, call_openai_async, estimate_tokens
+from moderation.backends import get_backend
+from moderation.policy import compile_policy
+from utils.language_detection import detect_text_languages
+from utils.cache import verdict_cache, normalize_text
+from utils.metrics import span
 import json
+import time
+import asyncio
+import threading
+import contextvars
+from contextlib import contextmanager
+
+# Reason returned when the GPT response cannot be parsed; such verdicts are never cached
+MODERATION_ERROR_REASON = "Error in moderation process"
+
+# Limits for one batched request: number of strings and estimated prompt tokens
+MAX_BATCH_ITEMS = 32
+MAX_BATCH_TOKENS = 6000
 
-client = OpenAI(api_key=OPENAI_API_KEY)
+_tier_stats = contextvars.ContextVar('tier_stats', default=None)
 
 def moderate_text(item, policies=None, sensitivity='medium'):
     """
@@ -15,125 +27,544 @@ def moderate_text(item, policies=None, sensitivity='medium'):
 
     Args:
         item (dict): The text item to moderate.
-        policies (dict): Custom moderation policies.
+        policies (dict or Policy): Custom moderation policies, or a compiled Policy.
         sensitivity (str): Sensitivity level ('low', 'medium', 'high').
 
     Returns:
         tuple: A tuple containing the status ('Approved' or 'Rejected'), reason, and tags.
     """
-    text_content = item.get('text')
-    language = item.get('language')
+    return moderate_text_items([item], policies, sensitivity)[0]
+
+async def moderate_text_async(item, policies=None, sensitivity='medium'):
+    """
+    Async variant of moderate_text.
+    """
+    return (await moderate_text_items_async([item], policies, sensitivity))[0]
 
-    # If language is not provided, detect it
-    if not language:
-        language = detect_language(text_content)
-    logger.info(f"Detected language: {language}")
+def moderate_text_items(items, policies=None, sensitivity='medium'):
+    """
+    Moderates several text items with batched API calls.
 
-    # Moderate the text content
-    status, reason, tags = moderate_text_content(text_content, policies, sensitivity)
-    return status, reason, tags
+    Args:
+        items (list): The text items to moderate.
+        policies (dict or Policy): Custom moderation policies, or a compiled Policy.
+        sensitivity (str): Sensitivity level ('low', 'medium', 'high').
+
+    Returns:
+        list: A (status, reason, tags) tuple per item, in the same order.
+    """
+    texts, languages = text_item_contents(items)
+    return moderate_text_batch(texts, policies, sensitivity, languages)
+
+async def moderate_text_items_async(items, policies=None, sensitivity='medium'):
+    """
+    Async variant of moderate_text_items.
+    """
+    texts, languages = text_item_contents(items)
+    return await moderate_text_batch_async(texts, policies, sensitivity, languages)
+
+def text_item_contents(items):
+    """
+    Extracts the text of each item and the language it declares, if any.
+
+    Args:
+        items (list): The text items.
+
+    Returns:
+        tuple: The text content of each item, and its 'language' or None.
+    """
+    return [item.get('text') for item in items], [item.get('language') for item in items]
 
 def moderate_text_content(text, policies=None, sensitivity='medium'):
     """
-    Moderates the given text content using text-moderation-latest and GPT-4 if needed.
+    Moderates the given text content with the backend selected by the policies.
+
+    Clear-cut cases are decided from the backend's category scores; only texts in the
+    ambiguous band are escalated to its judge (GPT-4 for the OpenAI and local backends).
 
     Args:
         text (str): The text content to moderate.
-        policies (dict): Custom moderation policies.
+        policies (dict or Policy): Custom moderation policies, or a compiled Policy.
         sensitivity (str): Sensitivity level.
 
     Returns:
         tuple: A tuple containing the status, reason, and tags.
     """
-    # First, use text-moderation-latest
-    moderation_response = client.moderations.create(input=text)
-    result = moderation_response.results[0]
-    print(result)
-    return use_gpt4_for_moderation(text, policies, sensitivity)
-    # if result.flagged:
-    #     # If flagged by text-moderation-latest, use GPT-4 for detailed analysis
-    #     return use_gpt4_for_moderation(text, policies, sensitivity)
-    # else:
-    #     # If not flagged, return approved status
-    #     return "Approved", "Content does not violate community guidelines", []
+    return moderate_text_batch([text], policies, sensitivity)[0]
+
+async def moderate_text_content_async(text, policies=None, sensitivity='medium'):
+    """
+    Async variant of moderate_text_content.
+    """
+    return (await moderate_text_batch_async([text], policies, sensitivity))[0]
+
+def moderate_text_batch(texts, policies=None, sensitivity='medium', languages=None):
+    """
+    Moderates many strings with one moderation call and one GPT call per micro-batch.
+
+    Strings matching the policy's blocklists are rejected first, without any API call.
+    The others are deduplicated and looked up in the verdict cache; the rest are
+    grouped into micro-batches bounded by MAX_BATCH_ITEMS and MAX_BATCH_TOKENS.
+    Within a batch, strings the backend scores as clearly safe or clearly disallowed
+    are decided immediately, and only the ambiguous ones go to the backend's judge.
+
+    When the policy routes by language, strings are checked against its blocklists
+    first, then each string is moderated under the policy of its language, and strings
+    in unsupported languages are decided without API calls.
+
+    Args:
+        texts (list): The text contents to moderate.
+        policies (dict or Policy): Custom moderation policies, or a compiled Policy.
+        sensitivity (str): Sensitivity level.
+        languages (list): Optional language code, or None to detect it, per string.
+
+    Returns:
+        list: A (status, reason, tags) tuple per input string, in the same order.
+    """
+    policy = compile_policy(policies, sensitivity)
+    if policy.routes_by_language:
+        results, groups = route_by_language(texts, policy, languages)
+        for language_policy, indices in groups.items():
+            verdicts = moderate_text_batch([texts[index] for index in indices], language_policy)
+            for index, verdict in zip(indices, verdicts):
+                results[index] = verdict
+        return results
 
-def use_gpt4_for_moderation(text, policies, sensitivity):
-    policy_instructions = create_policy_instructions(policies, sensitivity)
+    plan = TextBatchPlan(texts, policy)
+    backend = get_backend(policy)
+    for batch in split_into_batches(plan.pending):
+        # First, score the batch (text-moderation-latest for the OpenAI backend)
+        started = time.perf_counter()
+        with span('text.score'):
+            scores = backend.score_texts([text for _, text in batch])
+        escalated = plan.apply_prefilter(batch, scores, time.perf_counter() - started, backend)
+        if not escalated:
+            continue
 
-    prompt = f"""As an AI content moderation assistant, analyze the following text for compliance with community guidelines. {policy_instructions}
+        # Only the ambiguous band goes to the judge
+        started = time.perf_counter()
+        with span('text.judge'):
+            verdicts = backend.judge_texts([text for _, text in escalated], policy)
+        plan.apply_llm(escalated, verdicts, time.perf_counter() - started, backend)
 
-Consider the context and use of idiomatic expressions. Do not flag content that uses figurative language or common expressions unless they genuinely promote disallowed content. Focus on the overall intent and meaning of the text.
+    return plan.results
 
-Identify any issues related to disallowed content such as harassment, hate speech, explicit content, privacy violations, and misinformation. Provide a decision ('Approved' or 'Rejected'), reasons, and relevant tags.
+async def moderate_text_batch_async(texts, policies=None, sensitivity='medium', languages=None):
+    """
+    Async variant of moderate_text_batch; micro-batches are moderated concurrently.
+    """
+    policy = compile_policy(policies, sensitivity)
+    if policy.routes_by_language:
+        results, groups = route_by_language(texts, policy, languages)
+        group_verdicts = await asyncio.gather(
+            *(moderate_text_batch_async([texts[index] for index in indices], language_policy)
+              for language_policy, indices in groups.items())
+        )
+        for indices, verdicts in zip(groups.values(), group_verdicts):
+            for index, verdict in zip(indices, verdicts):
+                results[index] = verdict
+        return results
 
-The response should be in English, regardless of the text's language.
+    plan = TextBatchPlan(texts, policy)
+    backend = get_backend(policy)
 
-Please return your response in the following JSON format:
+    async def moderate_batch(batch):
+        started = time.perf_counter()
+        with span('text.score'):
+            scores = await backend.score_texts_async([text for _, text in batch])
+        escalated = plan.apply_prefilter(batch, scores, time.perf_counter() - started, backend)
+        if not escalated:
+            return
 
-{{
-    "decision": "Approved" or "Rejected",
-    "reason": "Brief explanation of the decision",
-    "tags": ["tag1", "tag2", "tag3"]
-}}
+        started = time.perf_counter()
+        with span('text.judge'):
+            verdicts = await backend.judge_texts_async([text for _, text in escalated], policy)
+        plan.apply_llm(escalated, verdicts, time.perf_counter() - started, backend)
 
-Text:
-{text}
+    await asyncio.gather(*(moderate_batch(batch) for batch in split_into_batches(plan.pending)))
+    return plan.results
 
-Response:"""
+def route_by_language(texts, policy, languages=None):
+    """
+    Groups strings by the policy of their language, detecting languages that are not given.
+    A string written in several languages goes to the strictest of their policies.
+    Strings matching the policy's blocklists are rejected before any routing.
+
+    Args:
+        texts (list): The text contents to moderate.
+        policy (Policy): A compiled policy that routes by language.
+        languages (list): Optional language code, or None to detect it, per string.
+
+    Returns:
+        tuple: The results list with verdicts for blocklisted strings and strings in
+        unsupported languages filled in, and {Policy: [string indices]} for the rest.
+    """
+    languages = languages or [None] * len(texts)
+    results = [None] * len(texts)
+    groups = {}
+    blocked = 0
+    for index, (text, language) in enumerate(zip(texts, languages)):
+        # Blocklists apply whatever the language, even one that is not moderated
+        verdict = policy.blocklist_verdict(text)
+        if verdict is not None:
+            blocked += 1
+            results[index] = verdict
+            continue
+        language, language_policy = policy.for_languages([language] if language else detect_text_languages(text))
+        if language_policy is None:
+            results[index] = policy.unsupported_verdict(language)
+        else:
+            groups.setdefault(language_policy, []).append(index)
+    if blocked:
+        record_tier('blocklist', items=blocked)
+    logger.info(f"Routed {len(texts)} texts to {len(groups)} language policies, "
+                f"{blocked} blocklisted, {sum(result is not None for result in results) - blocked} "
+                f"in unsupported languages")
+    return results, groups
+
+class TextBatchPlan:
+    """
+    Bookkeeping shared by the sync and async batch moderators: deduplicates the input,
+    serves cached verdicts, and fans decisions back out to every duplicate position.
+    """
+
+    def __init__(self, texts, policy):
+        self.policy = policy
+        self.results = [None] * len(texts)
+
+        # Group identical strings so each is moderated once
+        self.positions = {}
+        blocked = 0
+        for index, text in enumerate(texts):
+            cache_key = policy.cache_key('text', normalize_text(text))
+            if cache_key not in self.positions:
+                # Checked before the cache, so that terms added to a list apply to cached text too
+                verdict = policy.blocklist_verdict(text)
+                if verdict is not None:
+                    blocked += 1
+                    self.results[index] = verdict
+                    continue
+            self.positions.setdefault(cache_key, []).append(index)
+        if blocked:
+            record_tier('blocklist', items=blocked)
+
+        # (cache key, text) pairs that still need moderation
+        self.pending = []
+        for cache_key, indices in self.positions.items():
+            cached = verdict_cache.get(cache_key)
+            if cached is None:
+                self.pending.append((cache_key, texts[indices[0]]))
+            else:
+                record_tier('cache', items=1)
+                self.store(cache_key, cached)
+
+    def store(self, cache_key, verdict):
+        if verdict[1] != MODERATION_ERROR_REASON:
+            verdict_cache.set(cache_key, verdict)
+        for index in self.positions[cache_key]:
+            self.results[index] = (verdict[0], verdict[1], list(verdict[2]))
+
+    def apply_prefilter(self, batch, scores, seconds, backend):
+        """
+        Stores the clear-cut pre-filter decisions of a batch.
+
+        Returns:
+            list: The (cache key, text) entries that need the backend's judge.
+        """
+        escalated = []
+        for entry, text_scores in zip(batch, scores):
+            verdict = prefilter_decision(text_scores, self.policy)
+            if verdict is None:
+                escalated.append(entry)
+            else:
+                self.store(entry[0], verdict)
+        record_tier(backend.prefilter_tier, items=len(batch) - len(escalated), calls=1, seconds=seconds)
+        logger.info(f"Moderation pre-filter ({backend.name}) decided {len(batch) - len(escalated)} of {len(batch)} texts")
+        return escalated
+
+    def apply_llm(self, escalated, verdicts, seconds, backend):
+        record_tier(backend.judge_tier, items=len(escalated), calls=1, seconds=seconds)
+        for (cache_key, _), verdict in zip(escalated, verdicts):
+            self.store(cache_key, verdict)
+
+def prefilter_decision(scores, policy):
+    """
+    Decides clear-cut cases from moderation endpoint style category scores.
+
+    Categories mapped from the policy's allowed categories are ignored unless they are
+    also disallowed. A text is rejected when any remaining category scores at or above
+    the sensitivity's reject threshold, and approved when all of them score below its
+    approve threshold.
+
+    Args:
+        scores (dict): Category scores from a backend, or None if it could not score the content.
+        policy (Policy): The compiled moderation policy.
+
+    Returns:
+        tuple: The (status, reason, tags) decision, or None if the content needs the backend's judge.
+    """
+    if not scores:
+        return None
+
+    scores = {
+        category: score
+        for category, score in scores.items()
+        if score is not None and category not in policy.ignored_categories
+    }
+    if not scores:
+        return None
+
+    violations = sorted(category for category, score in scores.items() if score >= policy.reject_threshold)
+    if violations:
+        return "Rejected", f"Flagged by the moderation model for {', '.join(violations)}", violations
+    if max(scores.values()) < policy.approve_threshold:
+        return "Approved", "Content does not violate community guidelines", []
+    return None
+
+@contextmanager
+def collect_tier_stats():
+    """
+    Collects per-tier decision counts and latency for the text moderated inside the block.
+
+    Yields:
+        TierStats: The collector; read it with as_dict() once the block is done.
+    """
+    stats = TierStats()
+    token = _tier_stats.set(stats)
+    try:
+        yield stats
+    finally:
+        _tier_stats.reset(token)
+
+def record_tier(tier, items=0, calls=0, seconds=0.0):
+    """
+    Records work done by a decision tier in the active collector, if any.
+
+    Args:
+        tier (str): The tier name ('cache', 'prefilter', 'llm', or a backend's own tier).
+        items (int): Number of texts decided by the tier.
+        calls (int): Number of API calls made.
+        seconds (float): Time spent in those calls.
+    """
+    stats = _tier_stats.get()
+    if stats is not None:
+        stats.record(tier, items, calls, seconds)
+
+class TierStats:
+    """
+    Thread-safe per-tier counters of decided texts, API calls and latency.
+    """
 
-    response = client.chat.completions.create(
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._tiers = {}
+
+    def record(self, tier, items, calls, seconds):
+        with self._lock:
+            counters = self._tiers.setdefault(tier, {'items': 0, 'calls': 0, 'latency_ms': 0.0})
+            counters['items'] += items
+            counters['calls'] += calls
+            counters['latency_ms'] += seconds * 1000
+
+    def as_dict(self):
+        with self._lock:
+            return {
+                tier: dict(counters, latency_ms=round(counters['latency_ms'], 1))
+                for tier, counters in self._tiers.items()
+            }
+
+def split_into_batches(entries):
+    """
+    Splits (key, text) entries into micro-batches within the item and token limits.
+
+    Args:
+        entries (list): The (cache key, text) pairs to split.
+
+    Returns:
+        list: Lists of entries; a single text over the token limit gets a batch of its own.
+    """
+    batches = []
+    batch = []
+    batch_tokens = 0
+    for entry in entries:
+        # Roughly four characters per token
+        tokens = len(entry[1]) // 4 + 1
+        if batch and (len(batch) >= MAX_BATCH_ITEMS or batch_tokens + tokens > MAX_BATCH_TOKENS):
+            batches.append(batch)
+            batch = []
+            batch_tokens = 0
+        batch.append(entry)
+        batch_tokens += tokens
+    if batch:
+        batches.append(batch)
+    return batches
+
+def use_gpt4_for_batch_moderation(texts, policy):
+    """
+    Moderates several strings with a single GPT call returning one verdict per string.
+
+    Strings whose verdict is missing from the response are moderated individually.
+
+    Args:
+        texts (list): The text contents to moderate.
+        policy (Policy): The compiled moderation policy.
+
+    Returns:
+        list: A (status, reason, tags) tuple per string, in the same order.
+    """
+    if len(texts) == 1:
+        return [use_gpt4_for_moderation(texts[0], policy)]
+
+    messages = create_batch_moderation_messages(texts, policy)
+    max_tokens = batch_max_tokens(texts)
+    response = call_openai(
+        get_client().chat.completions.create,
         model="gpt-4o-mini",
-        messages=[{"role": "user", "content": prompt}],
+        messages=messages,
         temperature=0,
-        max_tokens=500
+        max_tokens=max_tokens,
+        estimated_tokens=estimate_messages_tokens(messages, max_tokens)
     )
 
-    content = response.choices[0].message.content.strip()
-    logger.info(f"GPT-4 response: {content}")
+    verdicts = parse_batch_moderation_response(response.choices[0].message.content.strip())
+    return [
+        verdicts[index] if index in verdicts else use_gpt4_for_moderation(text, policy)
+        for index, text in enumerate(texts)
+    ]
+
+async def use_gpt4_for_batch_moderation_async(texts, policy):
+    """
+    Async variant of use_gpt4_for_batch_moderation.
+    """
+    if len(texts) == 1:
+        return [await use_gpt4_for_moderation_async(texts[0], policy)]
+
+    messages = create_batch_moderation_messages(texts, policy)
+    max_tokens = batch_max_tokens(texts)
+    response = await call_openai_async(
+        get_async_client().chat.completions.create,
+        model="gpt-4o-mini",
+        messages=messages,
+        temperature=0,
+        max_tokens=max_tokens,
+        estimated_tokens=estimate_messages_tokens(messages, max_tokens)
+    )
+
+    verdicts = parse_batch_moderation_response(response.choices[0].message.content.strip())
+    missing = [index for index in range(len(texts)) if index not in verdicts]
+    fallbacks = await asyncio.gather(
+        *(use_gpt4_for_moderation_async(texts[index], policy) for index in missing)
+    )
+    verdicts.update(zip(missing, fallbacks))
+    return [verdicts[index] for index in range(len(texts))]
+
+def batch_max_tokens(texts):
+    return min(150 * len(texts) + 100, 4096)
+
+def estimate_messages_tokens(messages, max_tokens):
+    return estimate_tokens(''.join(message['content'] for message in messages), max_tokens)
+
+def create_batch_moderation_messages(texts, policy):
+    """
+    Builds the GPT messages asking for one verdict per text.
+
+    The system message is the policy's precompiled batch prompt, identical for every
+    call under the same policy; only the user message carries the texts.
+
+    Args:
+        texts (list): The text contents to moderate.
+        policy (Policy): The compiled moderation policy.
+
+    Returns:
+        list: The chat messages.
+    """
+    numbered_texts = json.dumps([{"index": index, "text": text} for index, text in enumerate(texts)], ensure_ascii=False)
+    return [
+        {"role": "system", "content": policy.batch_prompt},
+        {"role": "user", "content": f"Texts:\n{numbered_texts}\n\nResponse:"},
+    ]
+
+def parse_batch_moderation_response(content):
+    """
+    Parses a batched GPT moderation response.
+
+    Args:
+        content (str): The GPT response text.
+
+    Returns:
+        dict: (status, reason, tags) tuples keyed by text index; empty if unparseable.
+    """
+    logger.info(f"GPT-4 batch response: {content}")
 
+    verdicts = {}
     try:
-        moderation_result = json.loads(content)
-        status = moderation_result['decision']
-        reason = moderation_result['reason']
-        tags = moderation_result['tags']
-    except json.JSONDecodeError:
-        logger.error("Failed to parse JSON response from GPT-4")
-        status = "Rejected"
-        reason = "Error in moderation process"
-        tags = []
+        for entry in json.loads(content)['results']:
+            verdicts[int(entry['index'])] = (entry['decision'], entry['reason'], entry['tags'])
+    except (json.JSONDecodeError, KeyError, TypeError, ValueError):
+        logger.error("Failed to parse JSON batch response from GPT-4, moderating texts individually")
+    return verdicts
 
-    return status, reason, tags
+def use_gpt4_for_moderation(text, policy):
+    messages = create_moderation_messages(text, policy)
+    response = call_openai(
+        get_client().chat.completions.create,
+        model="gpt-4o-mini",
+        messages=messages,
+        temperature=0,
+        max_tokens=500,
+        estimated_tokens=estimate_messages_tokens(messages, 500)
+    )
+    return parse_moderation_response(response.choices[0].message.content.strip())
 
-def create_policy_instructions(policies, sensitivity):
+async def use_gpt4_for_moderation_async(text, policy):
+    messages = create_moderation_messages(text, policy)
+    response = await call_openai_async(
+        get_async_client().chat.completions.create,
+        model="gpt-4o-mini",
+        messages=messages,
+        temperature=0,
+        max_tokens=500,
+        estimated_tokens=estimate_messages_tokens(messages, 500)
+    )
+    return parse_moderation_response(response.choices[0].message.content.strip())
+
+def create_moderation_messages(text, policy):
     """
-    Creates policy instructions for the GPT-4 prompt based on custom policies and sensitivity level.
+    Builds the GPT messages for a single text.
 
     Args:
-        policies (dict): Custom moderation policies.
-        sensitivity (str): Sensitivity level.
+        text (str): The text content to moderate.
+        policy (Policy): The compiled moderation policy.
 
     Returns:
-        str: Policy instructions for the prompt.
+        list: The chat messages; the system message is the policy's precompiled prompt.
     """
-    instructions = ""
+    return [
+        {"role": "system", "content": policy.text_prompt},
+        {"role": "user", "content": f"Text:\n{text}\n\nResponse:"},
+    ]
 
-    # Sensitivity level adjustments
-    sensitivity_levels = {
-        'low': "Be lenient in your analysis, only flag severe violations.",
-        'medium': "Apply standard moderation guidelines.",
-        'high': "Be strict in your analysis, flag even minor violations."
-    }
+def parse_moderation_response(content):
+    """
+    Parses a GPT moderation response.
 
-    instructions += sensitivity_levels.get(sensitivity, "Apply standard moderation guidelines.")
+    Args:
+        content (str): The GPT response text.
 
-    # Custom policies
-    if policies:
-        disallowed = policies.get('disallowed_categories', [])
-        allowed = policies.get('allowed_categories', [])
+    Returns:
+        tuple: A tuple containing the status, reason, and tags.
+    """
+    logger.info(f"GPT-4 response: {content}")
 
-        if disallowed:
-            instructions += f" Disallowed content categories include: {', '.join(disallowed)}."
-        if allowed:
-            instructions += f" Allowed content categories include: {', '.join(allowed)}."
+    try:
+        moderation_result = json.loads(content)
+        status = moderation_result['decision']
+        reason = moderation_result['reason']
+        tags = moderation_result['tags']
+    except (json.JSONDecodeError, KeyError, TypeError):
+        logger.error("Failed to parse JSON response from GPT-4")
+        status = "Rejected"
+        reason = MODERATION_ERROR_REASON
+        tags = []
 
-    return instructions
+    return status, reason, tags
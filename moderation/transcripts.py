@@ -0,0 +1,269 @@
+import os
+import shutil
+import tempfile
+import subprocess
+from contextlib import closing
+from concurrent.futures import ThreadPoolExecutor, FIRST_COMPLETED, wait
+from utils.logger import logger
+from utils.concurrency import submit_in_context
+from utils.metrics import span, count
+from moderation.audio_preprocessing import (
+    SpeechChunker, decode_command, encode_chunk, source_time, READ_BYTES, VAD_FRAME_SECONDS
+)
+from moderation.text_moderation import moderate_text_content
+from moderation.policy import compile_policy
+
+# Seconds of the previous chunk's transcript moderated together with each chunk, for context
+CONTEXT_SECONDS = 10
+
+# Number of transcription and moderation calls in flight at the same time
+MAX_TRANSCRIPT_WORKERS = 4
+
+def moderate_audio_stream(audio_path, policies=None, sensitivity='medium', cancel_event=None):
+    """
+    Moderates an audio file chunk by chunk while it is still being transcribed.
+
+    ffmpeg decodes the audio to loudness-normalized 16 kHz mono as a stream; an
+    energy-based voice activity detector drops silence and groups the speech into chunks of about
+    CHUNK_TARGET_SECONDS, which are encoded as compact MP3s in memory and transcribed
+    concurrently as soon as they are complete. Each transcript chunk is moderated
+    together with the last CONTEXT_SECONDS of the previous chunk as soon as both are
+    available. The first rejected chunk ends the run and its time range is added to
+    the reason. If the detector finds no speech at all, the audio is decoded again and
+    transcribed in fixed-length chunks rather than approved unheard; only digitally
+    silent audio is approved without transcription. Without ffmpeg the whole file is
+    transcribed as one chunk.
+
+    Args:
+        audio_path (str): Path of the audio file.
+        policies (dict or Policy): Custom moderation policies, or a compiled Policy.
+        sensitivity (str): Sensitivity level.
+        cancel_event (threading.Event): Optional event that abandons the remaining chunks when set.
+
+    Returns:
+        tuple: A tuple containing the status ('Approved' or 'Rejected'), reason, and tags.
+
+    Raises:
+        RuntimeError: If ffmpeg fails to decode the audio.
+    """
+    policy = compile_policy(policies, sensitivity)
+    if shutil.which('ffmpeg') is None:
+        logger.warning("ffmpeg is not installed, transcribing the audio as a single chunk")
+        segments = transcribe_file(audio_path)
+        return moderate_chunk(segments, [], 0.0, policy)
+
+    pool = ThreadPoolExecutor(max_workers=MAX_TRANSCRIPT_WORKERS)
+    try:
+        # Whisper segments per chunk index, as (start, end, text) with source times
+        transcripts = {}
+        chunk_starts = {}
+        # Maps each future to its chunk index and the kind of work
+        in_flight = {}
+        moderated = set()
+        tags = []
+
+        def schedule_ready_chunks():
+            for index in sorted(transcripts):
+                previous = transcripts.get(index - 1) if index > 0 else []
+                if index in moderated or previous is None:
+                    continue
+                moderated.add(index)
+                future = submit_in_context(pool, moderate_chunk, transcripts[index], previous, chunk_starts[index], policy)
+                in_flight[future] = (index, 'moderate')
+
+        def submit_chunks(chunks):
+            for chunk in chunks:
+                index = len(chunk_starts)
+                chunk_starts[index] = chunk.regions[0][1]
+                in_flight[submit_in_context(pool, transcribe_chunk, chunk)] = (index, 'transcribe')
+
+        def collect(done):
+            for future in done:
+                index, kind = in_flight.pop(future)
+                if kind == 'transcribe':
+                    transcripts[index] = future.result()
+                    continue
+                status, reason, chunk_tags = future.result()
+                tags.extend(chunk_tags)
+                if status == "Rejected":
+                    logger.info(f"Audio chunk {index + 1} rejected, cancelling {len(in_flight)} outstanding tasks")
+                    return status, reason, tags
+            schedule_ready_chunks()
+            return None
+
+        def decode(chunker):
+            # Transcription starts as soon as the chunker completes a chunk
+            with closing(decode_pcm(audio_path)) as pcm:
+                for data in pcm:
+                    submit_chunks(chunker.feed(data))
+
+                    verdict = collect([future for future in list(in_flight) if future.done()])
+                    if verdict is not None:
+                        return verdict
+                    if cancel_event is not None and cancel_event.is_set():
+                        return "Rejected", "Audio moderation cancelled", tags
+            submit_chunks(chunker.finish())
+            return None
+
+        chunker = SpeechChunker()
+        verdict = decode(chunker)
+        if verdict is not None:
+            return verdict
+
+        speech_seconds = chunker.speech_frames * VAD_FRAME_SECONDS
+        logger.info(f"Voice activity: {speech_seconds:.1f}s of speech in {chunker.frames_seen * VAD_FRAME_SECONDS:.1f}s of audio")
+        count('audio.seconds', chunker.frames_seen * VAD_FRAME_SECONDS)
+        count('audio.speech_seconds', speech_seconds)
+        if not chunk_starts:
+            if chunker.peak == 0:
+                logger.info("Audio is digitally silent, skipping transcription")
+                return "Approved", "Content is appropriate", tags
+            # The detector can miss speech it cannot tell from noise; nothing audible is
+            # approved unheard, and fixed-length chunks keep each upload within Whisper's limit
+            logger.info("No speech detected, transcribing the whole audio track in fixed-length chunks")
+            verdict = decode(SpeechChunker(detect_speech=False))
+            if verdict is not None:
+                return verdict
+
+        while in_flight:
+            done, _ = wait(in_flight, return_when=FIRST_COMPLETED)
+            verdict = collect(done)
+            if verdict is not None:
+                return verdict
+            if cancel_event is not None and cancel_event.is_set():
+                return "Rejected", "Audio moderation cancelled", tags
+
+        logger.info(f"Moderated {len(moderated)} audio chunks")
+        return "Approved", "Content is appropriate", tags
+
+    finally:
+        pool.shutdown(wait=False, cancel_futures=True)
+
+def decode_pcm(audio_path):
+    """
+    Decodes the first audio track of a file with ffmpeg, see decode_command.
+
+    Args:
+        audio_path (str): Path of the audio or video file.
+
+    Yields:
+        bytes: Loudness-normalized 16 kHz mono s16le samples, READ_BYTES at a time.
+
+    Raises:
+        RuntimeError: If ffmpeg fails to decode the audio.
+    """
+    stderr_file = tempfile.TemporaryFile()
+    decoder = subprocess.Popen(decode_command(audio_path), stdout=subprocess.PIPE, stderr=stderr_file)
+    try:
+        with span('audio.decode'):
+            while True:
+                data = decoder.stdout.read(READ_BYTES)
+                if not data:
+                    break
+                yield data
+
+        if decoder.wait() != 0:
+            error_output = os.pread(stderr_file.fileno(), 65536, 0).decode('utf-8', errors='replace')
+            raise RuntimeError(f"Error decoding audio: {error_output}")
+    finally:
+        if decoder.poll() is None:
+            decoder.kill()
+        decoder.stdout.close()
+        decoder.wait()
+        stderr_file.close()
+
+def transcribe_chunk(chunk):
+    """
+    Encodes one speech chunk in memory and transcribes it with Whisper.
+
+    Args:
+        chunk (SpeechChunk): The chunk's PCM and its regions in the source audio.
+
+    Returns:
+        list: The (start, end, text) Whisper segments, with times relative to the source audio.
+    """
+    segments, language = transcribe_mp3(encode_chunk(chunk.pcm))
+    start = chunk.regions[0][1]
+    logger.info(f"Detected language in audio at {format_timestamp(start)}: {language}")
+    return [
+        (source_time(chunk.regions, segment_start), source_time(chunk.regions, segment_end), text)
+        for segment_start, segment_end, text in segments
+    ]
+
+def transcribe_mp3(data):
+    """
+    Transcribes an in-memory MP3 with Whisper.
+
+    Args:
+        data (bytes): The MP3 payload.
+
+    Returns:
+        tuple: The (start, end, text) Whisper segments and the detected language.
+    """
+    # Imported here because audio_moderation builds on this module
+    from moderation.audio_moderation import transcribe_audio_segments
+
+    with span('audio.transcribe') as transcribe:
+        transcribe.count('audio.segments')
+        transcribe.count('audio.bytes', len(data))
+        return transcribe_audio_segments(("chunk.mp3", data, "audio/mpeg"))
+
+def transcribe_file(audio_path):
+    """
+    Transcribes a whole audio file with Whisper, as uploaded.
+
+    Args:
+        audio_path (str): Path of the audio file.
+
+    Returns:
+        list: The (start, end, text) Whisper segments.
+    """
+    from moderation.audio_moderation import transcribe_audio_segments
+
+    with span('audio.transcribe') as transcribe, open(audio_path, "rb") as audio_file:
+        transcribe.count('audio.segments')
+        transcribe.count('audio.bytes', os.fstat(audio_file.fileno()).st_size)
+        segments, language = transcribe_audio_segments(audio_file)
+    logger.info(f"Detected language in audio: {language}")
+    return segments
+
+def moderate_chunk(segments, previous_segments, chunk_start, policy):
+    """
+    Moderates one transcript chunk together with the tail of the previous chunk.
+
+    Args:
+        segments (list): The chunk's (start, end, text) Whisper segments.
+        previous_segments (list): The previous chunk's Whisper segments, or [] for the first chunk.
+        chunk_start (float): Start of the chunk within the full audio, in seconds.
+        policy (Policy): The compiled moderation policy.
+
+    Returns:
+        tuple: A tuple containing the status, reason, and tags; a rejection reason ends
+        with the moderated time range.
+    """
+    context = [segment for segment in previous_segments if segment[1] > chunk_start - CONTEXT_SECONDS]
+    window = context + segments
+    text = ' '.join(segment_text.strip() for _, _, segment_text in window).strip()
+    if not text:
+        return "Approved", "Content is appropriate", []
+
+    with span('audio.moderate'):
+        status, reason, tags = moderate_text_content(text, policy)
+    if status == "Rejected":
+        start = min(chunk_start, window[0][0])
+        end = max(segment[1] for segment in window)
+        reason = f"{reason} (audio {format_timestamp(start)}-{format_timestamp(end)})"
+    return status, reason, tags
+
+def format_timestamp(seconds):
+    """
+    Formats a position in the audio as H:MM:SS.
+
+    Args:
+        seconds (float): The position in seconds.
+
+    Returns:
+        str: The formatted timestamp.
+    """
+    seconds = int(seconds)
+    return f"{seconds // 3600}:{seconds // 60 % 60:02d}:{seconds % 60:02d}"
@@ -1,21 +1,45 @@
 import os
+import json
+import asyncio
 import tempfile
-import requests
 import subprocess
+import threading
+from concurrent.futures import ThreadPoolExecutor, FIRST_COMPLETED, wait
 from utils.logger import logger
-from .audio_moderation import moderate_text_content
-from .image_moderation import extract_text_from_image
-from .image_moderation import moderate_image_content
+from utils.fetcher import fetch_to_file, FetchError
+from utils.cache import verdict_cache, file_digest
+from utils.concurrency import submit_in_context
+from utils.metrics import span, count
+from .transcripts import moderate_audio_stream
+from .frame_pipeline import moderate_frames
+from .keyframes import select_keyframes
+from .policy import compile_policy
 from PIL import Image
-import openai
+
+# Frame source for moderation: 'fps' samples FRAME_RATE frames per second, 'scene' lets
+# ffmpeg's scene detection pick frames whose content changes by more than SCENE_THRESHOLD
+FRAME_SOURCE = 'fps'
+FRAME_RATE = 1
+SCENE_THRESHOLD = 0.3
+
+# Longest side, in pixels, of the frames handed to the frame pipeline
+MAX_FRAME_SIDE = 1024
+
+class VideoProcessingError(Exception):
+    """
+    Raised when a video cannot be decoded; such failures are never cached.
+    """
 
 def moderate_video(item, policies=None, sensitivity='medium'):
     """
     Moderates the video by extracting audio, frames, and text, and analyzing them.
 
+    Frames and the audio transcript are moderated on two concurrent branches; the
+    first rejection from either branch is returned and the other branch is abandoned.
+
     Args:
         item (dict): The video item to moderate.
-        policies (dict): Custom moderation policies.
+        policies (dict or Policy): Custom moderation policies, or a compiled Policy.
         sensitivity (str): Sensitivity level.
 
     Returns:
@@ -25,92 +49,69 @@ def moderate_video(item, policies=None, sensitivity='medium'):
     if not video_url:
         return "Rejected", "No video URL provided", []
     logger.info(f"Processing video URL: {video_url}")
-    response = requests.get(video_url)
-    if response.status_code != 200:
-        return "Rejected", "Unable to download video", []
 
-    video_data = response.content
+    policy = compile_policy(policies, sensitivity)
 
-    # Save video data to a temporary file with the correct extension
-    file_extension = os.path.splitext(video_url)[1] or '.mp4'
-    with tempfile.NamedTemporaryFile(suffix=file_extension, delete=False) as temp_video_file:
-        temp_video_file.write(video_data)
-        temp_video_path = temp_video_file.name
+    # Stream the video straight to a temporary file with the correct extension
+    try:
+        temp_video_path = fetch_to_file(video_url, 'video')
+    except FetchError as e:
+        logger.warning(f"Unable to download video {video_url}: {e}")
+        return "Rejected", "Unable to download video", []
 
+    demux = None
+    stderr_file = None
     try:
+        # Keyed on the downloaded content, so a URL whose video changes is moderated again
+        cache_key = policy.cache_key('video', file_digest(temp_video_path))
+        cached = verdict_cache.get(cache_key)
+        if cached is not None:
+            return cached
+
         tags = []
-        temp_audio_path = None
-        temp_frames_dir = None
 
-        # Extract audio and transcribe
-        temp_audio_path = temp_video_path + ".mp3"
-        command = f"ffmpeg -i \"{temp_video_path}\" -q:a 0 -map a \"{temp_audio_path}\" -y"
         try:
-            result = subprocess.run(command, shell=True, check=True, capture_output=True, text=True)
-            logger.info(f"FFmpeg output: {result.stdout}")
-            logger.info(f"FFmpeg error output: {result.stderr}")
-        except subprocess.CalledProcessError as e:
-            logger.error(f"FFmpeg command failed: {e.stderr}")
-            return "Rejected", f"Error extracting audio: {e.stderr}", []
-
-        if not os.path.exists(temp_audio_path):
-            logger.error(f"Audio file not created: {temp_audio_path}")
-            return "Rejected", f"Audio file not created: {temp_audio_path}", []
-
-        with open(temp_audio_path, "rb") as audio_file:
-            transcription = openai.Audio.transcribe("whisper-1", audio_file, response_format="verbose_json")
-        text_audio = transcription['text']
-        language = transcription['language']
-        logger.info(f"Detected language in video audio: {language}")
-
-        # Moderate the transcribed audio text
-        status_audio, reason_audio, tags_audio = moderate_text_content(text_audio, policies, sensitivity)
-        tags.extend(tags_audio)
-        if status_audio == "Rejected":
-            return status_audio, reason_audio, tags
-
-        # Extract frames
-        temp_frames_dir = tempfile.mkdtemp()
-        command = f"ffmpeg -i \"{temp_video_path}\" -vf fps=1 \"{temp_frames_dir}/frame%04d.jpg\""
+            with span('video.probe'):
+                width, height, has_audio = probe_video(temp_video_path)
+        except (subprocess.CalledProcessError, ValueError, KeyError, IndexError) as e:
+            logger.error(f"FFprobe failed: {e}")
+            return "Rejected", "Error probing video", []
+
+        # Sampled frames are piped as raw RGB; the audio track is decoded by its own ffmpeg
+        # pass, so transcription does not wait for the frames to be consumed
+        stderr_file = tempfile.TemporaryFile()
+        demux = subprocess.Popen(
+            demux_command(temp_video_path, width, height),
+            stdout=subprocess.PIPE, stderr=stderr_file
+        )
+
+        # Moderate frames and the audio track concurrently; the first rejection wins
+        cancel_event = threading.Event()
+        branches = ThreadPoolExecutor(max_workers=2)
         try:
-            result = subprocess.run(command, shell=True, check=True, capture_output=True, text=True)
-            logger.info(f"FFmpeg output: {result.stdout}")
-            logger.info(f"FFmpeg error output: {result.stderr}")
-        except subprocess.CalledProcessError as e:
-            logger.error(f"FFmpeg command failed: {e.stderr}")
-            return "Rejected", f"Error extracting frames: {e.stderr}", []
-
-        if not os.listdir(temp_frames_dir):
-            logger.error("No frames were extracted from the video")
-            return "Rejected", "No frames were extracted from the video", []
-
-        tags_images = []
-        # Moderate each frame
-        for frame_file in sorted(os.listdir(temp_frames_dir)):
-            frame_path = os.path.join(temp_frames_dir, frame_file)
-            with open(frame_path, 'rb') as image_file:
-                image_data = image_file.read()
-
-            # Open image
-            image = Image.open(frame_path)
-
-            # Moderate the image content
-            status_img, reason_img, tags_img = moderate_image_content(image, policies, sensitivity)
-            tags.extend(tags_img)
-            if status_img == "Rejected":
-                return status_img, reason_img, tags
-
-            # Extract text from the image/frame
-            extracted_text = extract_text_from_image(image)
-
-            if extracted_text:
-                # Moderate the extracted text
-                status_text, reason_text, tags_text = moderate_text_content(extracted_text, policies, sensitivity)
-                tags.extend(tags_text)
-                if status_text == "Rejected":
-                    return status_text, reason_text, tags
+            pending = {
+                submit_in_context(branches, moderate_video_frames, demux, stderr_file, width, height, policy, cancel_event),
+                submit_in_context(branches, moderate_video_audio, temp_video_path if has_audio else None, policy, cancel_event),
+            }
+            while pending:
+                done, pending = wait(pending, return_when=FIRST_COMPLETED)
+                for future in done:
+                    status, reason, branch_tags = future.result()
+                    tags.extend(branch_tags)
+                    if status == "Rejected":
+                        verdict_cache.set(cache_key, (status, reason, tags))
+                        return status, reason, tags
+
+        except VideoProcessingError as e:
+            logger.error(str(e))
+            return "Rejected", str(e), []
+
+        finally:
+            cancel_event.set()
+            branches.shutdown(wait=False, cancel_futures=True)
 
         # All frames and audio approved
+        verdict_cache.set(cache_key, ("Approved", "Content is appropriate", tags))
         return "Approved", "Content is appropriate", tags
 
     except Exception as e:
@@ -118,11 +119,203 @@ def moderate_video(item, policies=None, sensitivity='medium'):
         return "Rejected", f"Error processing video: {str(e)}", []
 
     finally:
+        if demux is not None:
+            if demux.poll() is None:
+                demux.kill()
+            demux.stdout.close()
+            demux.wait()
+        if stderr_file is not None:
+            stderr_file.close()
         if temp_video_path and os.path.exists(temp_video_path):
             os.unlink(temp_video_path)
-        if temp_audio_path and os.path.exists(temp_audio_path):
-            os.unlink(temp_audio_path)
-        if temp_frames_dir and os.path.exists(temp_frames_dir):
-            for f in os.listdir(temp_frames_dir):
-                os.unlink(os.path.join(temp_frames_dir, f))
-            os.rmdir(temp_frames_dir)
+
+async def moderate_video_async(item, policies=None, sensitivity='medium'):
+    """
+    Async variant of moderate_video.
+
+    Video moderation is driven by ffmpeg, the OCR process pool and the frame thread
+    pool, so it runs on a worker thread; its API calls still share the provider's
+    rate limits with every coroutine.
+    """
+    return await asyncio.to_thread(moderate_video, item, policies, sensitivity)
+
+def moderate_video_frames(demux, stderr_file, width, height, policy, cancel_event):
+    """
+    Moderates the frames piped by the demuxer as they are decoded.
+
+    Args:
+        demux (subprocess.Popen): The running ffmpeg demuxer.
+        stderr_file (file): The file receiving ffmpeg's error output.
+        width (int): Frame width.
+        height (int): Frame height.
+        policy (Policy): The compiled moderation policy.
+        cancel_event (threading.Event): Set when the other branch has already decided.
+
+    Returns:
+        tuple: A tuple containing the status, reason, and tags.
+
+    Raises:
+        VideoProcessingError: If ffmpeg fails or no frames could be extracted.
+    """
+    keyframe_stats = {}
+    keyframes = select_keyframes(read_raw_frames(demux.stdout, width, height), stats=keyframe_stats)
+    with span('video.frames'):
+        status, reason, tags = moderate_frames(keyframes, policy, cancel_event=cancel_event)
+    logger.info(f"Keyframe selection forwarded {keyframe_stats['forwarded']} of {keyframe_stats['total']} frames, "
+                f"skipped {keyframe_stats['skipped']}")
+    count('video.frames_decoded', keyframe_stats['total'])
+    count('video.keyframes', keyframe_stats['forwarded'])
+
+    if keyframe_stats['total'] == 0:
+        check_demux(demux, stderr_file)
+        raise VideoProcessingError("No frames were extracted from the video")
+    return status, reason, tags
+
+def moderate_video_audio(video_path, policy, cancel_event):
+    """
+    Transcribes and moderates the audio track chunk by chunk as it is decoded.
+
+    The audio is decoded straight from the video file by a separate audio-only ffmpeg
+    pass, which is fast and independent of how quickly the frames are moderated.
+
+    Args:
+        video_path (str): Path of the video, or None if the video has no audio.
+        policy (Policy): The compiled moderation policy.
+        cancel_event (threading.Event): Set when the other branch has already decided.
+
+    Returns:
+        tuple: A tuple containing the status, reason, and tags.
+
+    Raises:
+        VideoProcessingError: If ffmpeg fails to decode the audio.
+    """
+    if not video_path:
+        logger.info("Video has no audio track, skipping transcription")
+        return "Approved", "Content is appropriate", []
+
+    # Moderate the transcribed audio text as it arrives
+    try:
+        with span('video.audio'):
+            return moderate_audio_stream(video_path, policy, cancel_event=cancel_event)
+    except RuntimeError as e:
+        raise VideoProcessingError(str(e))
+
+def check_demux(demux, stderr_file):
+    """
+    Waits for the demuxer to exit and checks that it succeeded.
+
+    Args:
+        demux (subprocess.Popen): The running ffmpeg demuxer.
+        stderr_file (file): The file receiving ffmpeg's error output.
+
+    Raises:
+        VideoProcessingError: If ffmpeg exited with an error.
+    """
+    if demux.wait() != 0:
+        error_output = os.pread(stderr_file.fileno(), 65536, 0).decode('utf-8', errors='replace')
+        raise VideoProcessingError(f"Error decoding video: {error_output}")
+
+def probe_video(video_path):
+    """
+    Reads the display size of the first video stream and whether there is an audio track.
+
+    Args:
+        video_path (str): Path to the video file.
+
+    Returns:
+        tuple: The width and height after rotation, and whether an audio stream exists.
+    """
+    result = subprocess.run(
+        ["ffprobe", "-v", "error", "-show_entries", "stream=codec_type,width,height:stream_side_data=rotation:stream_tags=rotate",
+         "-of", "json", video_path],
+        check=True, capture_output=True, text=True
+    )
+    streams = json.loads(result.stdout)['streams']
+    video = next(stream for stream in streams if stream.get('codec_type') == 'video')
+    has_audio = any(stream.get('codec_type') == 'audio' for stream in streams)
+
+    rotation = int(float(video.get('tags', {}).get('rotate', 0)))
+    for side_data in video.get('side_data_list', []):
+        rotation = int(float(side_data.get('rotation', rotation)))
+
+    width, height = int(video['width']), int(video['height'])
+    if abs(rotation) % 180 == 90:
+        width, height = height, width
+    return width, height, has_audio
+
+def demux_command(video_path, width, height):
+    """
+    Builds the ffmpeg invocation that extracts the sampled frames.
+
+    Sampled frames are scaled to at most MAX_FRAME_SIDE pixels on their long side and
+    written to stdout as raw RGB.
+
+    Args:
+        video_path (str): Path to the video file.
+        width (int): Display width of the video.
+        height (int): Display height of the video.
+
+    Returns:
+        list: The ffmpeg command line.
+    """
+    frame_width, frame_height = frame_size(width, height)
+    command = ["ffmpeg", "-v", "error", "-i", video_path, "-map", "0:v:0", "-an"]
+    command += frame_sampling_args(frame_width, frame_height)
+    command += ["-f", "rawvideo", "-pix_fmt", "rgb24", "pipe:1"]
+    return command
+
+def frame_size(width, height):
+    """
+    Computes the size frames are scaled to before moderation.
+
+    Args:
+        width (int): Display width of the video.
+        height (int): Display height of the video.
+
+    Returns:
+        tuple: The frame width and height, both even and at most MAX_FRAME_SIDE.
+    """
+    scale = min(1.0, MAX_FRAME_SIDE / max(width, height))
+    return max(2, int(width * scale) // 2 * 2), max(2, int(height * scale) // 2 * 2)
+
+def read_raw_frames(stream, width, height):
+    """
+    Reads raw RGB frames from an ffmpeg pipe as they are decoded.
+
+    Args:
+        stream (file): The ffmpeg stdout pipe.
+        width (int): Frame width.
+        height (int): Frame height.
+
+    Yields:
+        PIL.Image: The decoded frames; with FRAME_SOURCE 'fps', info['timestamp'] holds
+        each frame's position in seconds.
+    """
+    frame_bytes = width * height * 3
+    position = 0
+    while True:
+        data = stream.read(frame_bytes)
+        if len(data) < frame_bytes:
+            return
+        frame = Image.frombytes('RGB', (width, height), data)
+        if FRAME_SOURCE == 'fps':
+            frame.info['timestamp'] = position / FRAME_RATE
+        position += 1
+        yield frame
+
+def frame_sampling_args(frame_width, frame_height):
+    """
+    Builds the ffmpeg arguments that select which frames are extracted.
+
+    Args:
+        frame_width (int): Width to scale the selected frames to.
+        frame_height (int): Height to scale the selected frames to.
+
+    Returns:
+        list: The ffmpeg video filter arguments for the configured FRAME_SOURCE.
+    """
+    scale = f"scale={frame_width}:{frame_height}"
+    if FRAME_SOURCE == 'scene':
+        # Always keep the first frame, then only frames that start a new scene
+        return ["-vf", f"select='eq(n,0)+gt(scene,{SCENE_THRESHOLD})',{scale}", "-vsync", "vfr"]
+    return ["-vf", f"fps={FRAME_RATE},{scale}"]
@@ -0,0 +1,255 @@
+import os
+import json
+import asyncio
+from main import moderate_content_async, get_moderator, MODERATORS
+from moderation.provider import get_client, get_async_client
+from moderation.backends import get_backend
+from moderation.policy import compile_policy
+from utils.logger import logger
+from utils.metrics import export_prometheus, process_metrics
+
+# Moderation runs executed at the same time, and runs allowed to wait for a slot
+MAX_CONCURRENT_REQUESTS = int(os.environ.get('MODERATION_MAX_CONCURRENT', 16))
+MAX_QUEUED_REQUESTS = int(os.environ.get('MODERATION_MAX_QUEUED', 64))
+
+# Largest accepted request body, in bytes
+MAX_BODY_BYTES = 1024 * 1024
+
+# Seconds clients are asked to wait after a 429
+RETRY_AFTER_SECONDS = 1
+
+class HTTPError(Exception):
+    """
+    Raised while handling a request to answer with an error status.
+    """
+
+    def __init__(self, status, message, headers=()):
+        super().__init__(message)
+        self.status = status
+        self.message = message
+        self.headers = list(headers)
+
+class ModerationService:
+    """
+    Runs moderate_content for HTTP requests with a concurrency limit, a bounded queue,
+    and coalescing of identical requests that are in flight at the same time.
+    """
+
+    def __init__(self, max_concurrent=MAX_CONCURRENT_REQUESTS, max_queued=MAX_QUEUED_REQUESTS):
+        self.max_concurrent = max_concurrent
+        self.max_queued = max_queued
+        self._slots = None
+        # Runs keyed by request, shared by every identical request until they finish
+        self._in_flight = {}
+
+    @property
+    def pending(self):
+        return len(self._in_flight)
+
+    async def moderate(self, request):
+        """
+        Moderates one validated request, joining an identical run if one is in flight.
+
+        Metrics are collected when the client asks for them or MODERATION_METRICS is set,
+        so that /metrics sees every run; the Metrics block is only returned to clients
+        that asked for it.
+
+        Args:
+            request (dict): The request with 'input', 'policy' and 'metrics'.
+
+        Returns:
+            dict: The moderate_content output.
+
+        Raises:
+            HTTPError: 429 if the queue is full.
+        """
+        key = request['policy'].cache_key(
+            'request', json.dumps([request['input'], request['metrics']], sort_keys=True, default=str)
+        )
+        run = self._in_flight.get(key)
+        # Server events happen outside any moderation run, so they go straight to the totals
+        if run is not None:
+            process_metrics.count('server.coalesced')
+        else:
+            if self.pending >= self.max_concurrent + self.max_queued:
+                process_metrics.count('server.rejected')
+                raise HTTPError(429, "Too many requests in flight", [(b'retry-after', str(RETRY_AFTER_SECONDS).encode())])
+            run = asyncio.ensure_future(self._run(request))
+            self._in_flight[key] = run
+            run.add_done_callback(lambda _: self._in_flight.pop(key, None))
+
+        # A client that disconnects must not cancel a run other clients are waiting on
+        output = await asyncio.shield(run)
+        if not request['metrics'] and 'Metrics' in output:
+            output = {name: value for name, value in output.items() if name != 'Metrics'}
+        return output
+
+    async def _run(self, request):
+        if self._slots is None:
+            self._slots = asyncio.Semaphore(self.max_concurrent)
+        async with self._slots:
+            # None leaves collection to MODERATION_METRICS
+            return await moderate_content_async(
+                request['input'], request['policy'], metrics=request['metrics'] or None
+            )
+
+service = ModerationService()
+
+def parse_request(body):
+    """
+    Validates a /moderate request body.
+
+    Args:
+        body (bytes): The raw JSON body.
+
+    Returns:
+        dict: The request's 'input', compiled 'policy' and 'metrics' flag, True when the
+        client asked for the Metrics block.
+
+    Raises:
+        HTTPError: 400 if the body is not a valid request.
+    """
+    try:
+        request = json.loads(body)
+    except (json.JSONDecodeError, UnicodeDecodeError):
+        raise HTTPError(400, "Request body must be JSON")
+
+    if not isinstance(request, dict) or not isinstance(request.get('input'), list):
+        raise HTTPError(400, "Request must be an object with an 'input' list of content items")
+    if not all(isinstance(item, dict) for item in request['input']):
+        raise HTTPError(400, "Every content item must be an object")
+    if has_blocklist_files(request.get('policies')):
+        raise HTTPError(400, "Blocklists in requests must list their terms inline")
+    if selects_backend(request.get('policies')):
+        raise HTTPError(400, "The moderation backend is set by the server, not by requests")
+    try:
+        policy = compile_policy(request.get('policies'), request.get('sensitivity', 'medium'))
+    except ValueError as e:
+        raise HTTPError(400, str(e))
+    return {
+        'input': request['input'],
+        'policy': policy,
+        'metrics': request.get('metrics') is True,
+    }
+
+def has_blocklist_files(policies):
+    """
+    Checks whether policies, or their per-language overrides, name blocklist files.
+
+    Clients must not make the server read files, so requests only take inline lists.
+    """
+    return any(
+        isinstance(candidate.get('blocklists'), dict)
+        and any(isinstance(source, str) for source in candidate['blocklists'].values())
+        for candidate in policy_levels(policies)
+    )
+
+def selects_backend(policies):
+    """
+    Checks whether policies, or their per-language overrides, choose a moderation backend.
+
+    The backend is server configuration (MODERATION_BACKEND): the fake one approves
+    nearly everything, so clients must not be able to pick it.
+    """
+    return any('backend' in candidate for candidate in policy_levels(policies))
+
+def policy_levels(policies):
+    """
+    Returns:
+        list: The policies dict and its per-language override dicts.
+    """
+    if not isinstance(policies, dict):
+        return []
+    overrides = policies.get('languages')
+    candidates = [policies] + (list(overrides.values()) if isinstance(overrides, dict) else [])
+    return [candidate for candidate in candidates if isinstance(candidate, dict)]
+
+async def app(scope, receive, send):
+    """
+    ASGI entry point; run with e.g. `uvicorn server:app`.
+
+    Routes:
+        POST /moderate: moderate a request of the form
+            {"input": [...], "policies": {...}, "sensitivity": "medium", "metrics": false}.
+        GET /health: liveness and queue depth.
+        GET /metrics: process-wide metrics in Prometheus text format.
+    """
+    if scope['type'] == 'lifespan':
+        await lifespan(receive, send)
+        return
+    if scope['type'] != 'http':
+        return
+
+    try:
+        route = (scope['method'], scope['path'])
+        if route == ('POST', '/moderate'):
+            request = parse_request(await read_body(receive))
+            await send_json(send, 200, await service.moderate(request))
+        elif route == ('GET', '/health'):
+            await send_json(send, 200, {'status': 'ok', 'pending': service.pending})
+        elif route == ('GET', '/metrics'):
+            await send_response(send, 200, export_prometheus().encode('utf-8'), b'text/plain; version=0.0.4')
+        else:
+            raise HTTPError(404, "Not found")
+
+    except HTTPError as e:
+        await send_json(send, e.status, {'error': e.message}, e.headers)
+    except Exception as e:
+        logger.error(f"Error handling {scope['method']} {scope['path']}: {e}")
+        await send_json(send, 500, {'error': "Internal server error"})
+
+async def lifespan(receive, send):
+    while True:
+        message = await receive()
+        if message['type'] == 'lifespan.startup':
+            warm_up()
+            await send({'type': 'lifespan.startup.complete'})
+        elif message['type'] == 'lifespan.shutdown':
+            await get_async_client().close()
+            await send({'type': 'lifespan.shutdown.complete'})
+            return
+
+def warm_up():
+    """
+    Creates the shared clients and worker pools before the first request arrives.
+    """
+    get_client()
+    get_async_client()
+    get_backend()
+    # The media moderators are imported lazily by main; a long-running service loads them up front
+    for item_type in MODERATORS:
+        get_moderator(item_type)
+        get_moderator(item_type, asynchronous=True)
+
+    from moderation.ocr import get_ocr_pool, is_tesseract_installed
+    if is_tesseract_installed():
+        get_ocr_pool()
+    logger.info(f"Moderation service ready: {MAX_CONCURRENT_REQUESTS} concurrent, {MAX_QUEUED_REQUESTS} queued")
+
+async def read_body(receive):
+    body = bytearray()
+    while True:
+        message = await receive()
+        if message['type'] == 'http.disconnect':
+            raise HTTPError(400, "Client disconnected")
+        body += message.get('body', b'')
+        if len(body) > MAX_BODY_BYTES:
+            raise HTTPError(413, f"Request body exceeds {MAX_BODY_BYTES} bytes")
+        if not message.get('more_body'):
+            return bytes(body)
+
+async def send_json(send, status, payload, headers=()):
+    await send_response(send, status, json.dumps(payload).encode('utf-8'), b'application/json', headers)
+
+async def send_response(send, status, body, content_type, headers=()):
+    await send({
+        'type': 'http.response.start',
+        'status': status,
+        'headers': [(b'content-type', content_type), (b'content-length', str(len(body)).encode())] + list(headers),
+    })
+    await send({'type': 'http.response.body', 'body': body})
+
+if __name__ == "__main__":
+    import uvicorn
+
+    uvicorn.run(app, host=os.environ.get('HOST', '127.0.0.1'), port=int(os.environ.get('PORT', 8000)))
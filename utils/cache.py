@@ -0,0 +1,167 @@
+import os
+import json
+import time
+import sqlite3
+import hashlib
+import threading
+import unicodedata
+from collections import OrderedDict
+from utils.metrics import count
+
+# Maximum number of verdicts kept in the in-memory tier
+MAX_MEMORY_ENTRIES = int(os.environ.get('MODERATION_CACHE_SIZE', 10000))
+
+# Path of the optional on-disk SQLite tier; leave unset to keep the cache in memory only
+CACHE_PATH = os.environ.get('MODERATION_CACHE_PATH')
+
+# Number of seconds a cached verdict stays valid
+CACHE_TTL = int(os.environ.get('MODERATION_CACHE_TTL', 7 * 24 * 3600))
+
+# Verdicts whose reason starts with this report a failure rather than a content decision
+# (API errors, undecodable media, ...) and are never cached
+ERROR_REASON_PREFIX = "Error"
+
+def normalize_text(text):
+    """
+    Normalizes text so that trivially different copies share a cache key.
+
+    Args:
+        text (str): The text to normalize.
+
+    Returns:
+        str: The text in NFKC form with whitespace runs collapsed.
+    """
+    return ' '.join(unicodedata.normalize('NFKC', text).split())
+
+def file_digest(path):
+    """
+    Hashes a file's content, so that cached verdicts follow the content rather than its URL.
+
+    Args:
+        path (str): Path of the file.
+
+    Returns:
+        bytes: The SHA-256 digest of the file.
+    """
+    digest = hashlib.sha256()
+    with open(path, 'rb') as content:
+        for block in iter(lambda: content.read(1024 * 1024), b''):
+            digest.update(block)
+    return digest.digest()
+
+class VerdictCache:
+    """
+    Two-tier cache of moderation verdicts: an in-memory LRU in front of an optional
+    SQLite file, both with TTL expiry. Verdicts are (status, reason, tags) tuples.
+    """
+
+    def __init__(self, max_entries=MAX_MEMORY_ENTRIES, path=CACHE_PATH, ttl=CACHE_TTL):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self._counters = {}
+        self._db = None
+        if path:
+            self._db = sqlite3.connect(path, check_same_thread=False)
+            self._db.execute(
+                "CREATE TABLE IF NOT EXISTS verdicts ("
+                "key TEXT PRIMARY KEY, verdict TEXT NOT NULL, expires_at REAL NOT NULL)"
+            )
+            self._db.execute("DELETE FROM verdicts WHERE expires_at <= ?", (time.time(),))
+            self._db.commit()
+
+    def get(self, key):
+        """
+        Looks up a verdict.
+
+        Args:
+            key (str): The cache key from Policy.cache_key.
+
+        Returns:
+            tuple: The cached (status, reason, tags), or None on a miss.
+        """
+        now = time.time()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and entry[1] <= now:
+                del self._entries[key]
+                entry = None
+            if entry is not None:
+                self._entries.move_to_end(key)
+                self._count(key, 'memory_hits')
+                return self._copy(entry[0])
+
+            if self._db is not None:
+                row = self._db.execute(
+                    "SELECT verdict, expires_at FROM verdicts WHERE key = ? AND expires_at > ?", (key, now)
+                ).fetchone()
+                if row is not None:
+                    verdict = tuple(json.loads(row[0]))
+                    self._remember(key, verdict, row[1])
+                    self._count(key, 'disk_hits')
+                    return self._copy(verdict)
+
+            self._count(key, 'misses')
+            return None
+
+    def set(self, key, verdict):
+        """
+        Stores a verdict in every tier; error verdicts are ignored.
+
+        Args:
+            key (str): The cache key from Policy.cache_key.
+            verdict (tuple): The (status, reason, tags) to store.
+        """
+        if verdict[1].startswith(ERROR_REASON_PREFIX):
+            return
+        verdict = self._copy(verdict)
+        expires_at = time.time() + self.ttl
+        with self._lock:
+            self._remember(key, verdict, expires_at)
+            if self._db is not None:
+                self._db.execute(
+                    "INSERT OR REPLACE INTO verdicts (key, verdict, expires_at) VALUES (?, ?, ?)",
+                    (key, json.dumps(verdict), expires_at)
+                )
+                self._db.commit()
+
+    def stats(self):
+        """
+        Returns hit and miss counters per kind of content.
+
+        Returns:
+            dict: Counters keyed by kind, each with 'memory_hits', 'disk_hits' and 'misses'.
+        """
+        with self._lock:
+            return {kind: dict(counters) for kind, counters in self._counters.items()}
+
+    def clear(self):
+        """
+        Drops every cached verdict and resets the counters.
+        """
+        with self._lock:
+            self._entries.clear()
+            self._counters.clear()
+            if self._db is not None:
+                self._db.execute("DELETE FROM verdicts")
+                self._db.commit()
+
+    def _remember(self, key, verdict, expires_at):
+        self._entries[key] = (verdict, expires_at)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+
+    def _count(self, key, counter):
+        kind = key.split(':', 1)[0]
+        counters = self._counters.setdefault(kind, {'memory_hits': 0, 'disk_hits': 0, 'misses': 0})
+        counters[counter] += 1
+        count(f"cache.{kind}.{counter}")
+
+    @staticmethod
+    def _copy(verdict):
+        status, reason, tags = verdict
+        return status, reason, list(tags)
+
+verdict_cache = VerdictCache()
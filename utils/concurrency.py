@@ -0,0 +1,20 @@
+import contextvars
+
+def submit_in_context(executor, fn, *args, **kwargs):
+    """
+    Submits a call to an executor so that it runs in a copy of the caller's context.
+
+    Thread pools do not propagate context variables on their own; without this,
+    per-request collectors set by the caller would be invisible to the workers.
+
+    Args:
+        executor (concurrent.futures.Executor): The executor to submit to.
+        fn (callable): The function to run.
+        *args: Positional arguments for the function.
+        **kwargs: Keyword arguments for the function.
+
+    Returns:
+        concurrent.futures.Future: The future of the submitted call.
+    """
+    context = contextvars.copy_context()
+    return executor.submit(context.run, fn, *args, **kwargs)
@@ -0,0 +1,238 @@
+import os
+import io
+import time
+import socket
+import threading
+import tempfile
+import ipaddress
+import requests
+from urllib.parse import urlparse, urljoin
+from contextlib import contextmanager
+from requests.adapters import HTTPAdapter
+from utils.logger import logger
+from utils.metrics import span
+
+# Maximum payload size per kind of media, in bytes
+MAX_BYTES = {
+    'image': 20 * 1024 * 1024,
+    'audio': 100 * 1024 * 1024,
+    'video': 500 * 1024 * 1024,
+}
+
+# Connect and per-read timeouts, plus a deadline for the whole download, in seconds
+CONNECT_TIMEOUT = 5
+READ_TIMEOUT = 30
+DOWNLOAD_DEADLINE = 300
+
+# Size of the chunks streamed from the network
+CHUNK_SIZE = 64 * 1024
+
+# Number of pooled connections kept per host
+POOL_SIZE = 32
+
+# Redirects followed per download; every hop is checked like the original URL
+MAX_REDIRECTS = 5
+
+# Media on private, loopback, link-local or otherwise non-public addresses is refused, so
+# that clients cannot make the service reach internal hosts; set to 1 for local setups
+ALLOW_PRIVATE_HOSTS = os.environ.get('MODERATION_ALLOW_PRIVATE_HOSTS') == '1'
+
+# Content-Type prefixes accepted per kind; servers often label media as octet-stream
+ALLOWED_CONTENT_TYPES = {
+    'image': ('image/', 'application/octet-stream'),
+    'audio': ('audio/', 'video/', 'application/ogg', 'application/octet-stream'),
+    'video': ('video/', 'application/octet-stream'),
+}
+
+# Default file extension per kind when the URL has none
+DEFAULT_EXTENSIONS = {'image': '.img', 'audio': '.mp3', 'video': '.mp4'}
+
+class FetchError(Exception):
+    """
+    Raised when a media URL cannot be downloaded or its payload is not acceptable.
+    """
+
+session = requests.Session()
+_adapter = HTTPAdapter(pool_connections=POOL_SIZE, pool_maxsize=POOL_SIZE)
+session.mount('http://', _adapter)
+session.mount('https://', _adapter)
+
+def fetch_bytes(url, kind):
+    """
+    Downloads a media URL into memory.
+
+    Args:
+        url (str): The URL to download.
+        kind (str): The kind of media ('image', 'audio' or 'video').
+
+    Returns:
+        bytes: The payload.
+
+    Raises:
+        FetchError: If the download fails or the payload is too large or of the wrong type.
+    """
+    buffer = io.BytesIO()
+    _stream(url, kind, buffer)
+    return buffer.getvalue()
+
+def fetch_to_file(url, kind):
+    """
+    Streams a media URL straight into a temporary file.
+
+    Args:
+        url (str): The URL to download.
+        kind (str): The kind of media ('image', 'audio' or 'video').
+
+    Returns:
+        str: Path of the temporary file, named with the URL's extension. The caller
+        is responsible for deleting it.
+
+    Raises:
+        FetchError: If the download fails or the payload is too large or of the wrong type.
+    """
+    file_extension = os.path.splitext(urlparse(url).path)[1] or DEFAULT_EXTENSIONS[kind]
+    with tempfile.NamedTemporaryFile(suffix=file_extension, delete=False) as temp_file:
+        temp_path = temp_file.name
+        try:
+            _stream(url, kind, temp_file)
+        except BaseException:
+            temp_file.close()
+            os.unlink(temp_path)
+            raise
+    return temp_path
+
+def check_url(url):
+    """
+    Checks that a media URL points to a public host over HTTP(S).
+
+    Args:
+        url (str): The URL to check.
+
+    Raises:
+        FetchError: If the scheme is not HTTP(S), the host does not resolve, or any of
+            its addresses is not public while ALLOW_PRIVATE_HOSTS is off.
+    """
+    parsed = urlparse(url)
+    if parsed.scheme not in ('http', 'https') or not parsed.hostname:
+        raise FetchError(f"unsupported URL {url}")
+    if ALLOW_PRIVATE_HOSTS:
+        return
+    try:
+        port = parsed.port or (443 if parsed.scheme == 'https' else 80)
+        addresses = socket.getaddrinfo(parsed.hostname, port, proto=socket.IPPROTO_TCP)
+    except (OSError, ValueError) as e:
+        raise FetchError(f"cannot resolve {parsed.hostname}: {e}") from e
+    for address in addresses:
+        # Scoped IPv6 addresses carry their interface after '%'
+        ip = ipaddress.ip_address(address[4][0].split('%')[0])
+        if not ip.is_global:
+            raise FetchError(f"{parsed.hostname} resolves to the non-public address {ip}")
+
+def _open(url):
+    # Redirects are followed by hand so that each hop's host is checked before connecting
+    for _ in range(MAX_REDIRECTS + 1):
+        check_url(url)
+        response = session.get(url, stream=True, timeout=(CONNECT_TIMEOUT, READ_TIMEOUT), allow_redirects=False)
+        if not response.is_redirect:
+            return response
+        response.close()
+        url = urljoin(url, response.headers['Location'])
+    raise FetchError(f"more than {MAX_REDIRECTS} redirects")
+
+@contextmanager
+def _watchdog(response, deadline):
+    # Read timeouts restart with every byte received and iter_content blocks until a whole
+    # chunk has arrived, so checking the deadline between chunks lets a slow server hold
+    # the download far longer; the watchdog closes the connection at the deadline instead
+    expired = threading.Event()
+
+    def expire():
+        expired.set()
+        # Closing the response alone does not wake a read blocked in another thread;
+        # shutting the socket down does
+        try:
+            with socket.socket(fileno=os.dup(response.raw.fileno())) as sock:
+                sock.shutdown(socket.SHUT_RDWR)
+        except (OSError, ValueError):
+            # The download finished or the connection closed in the meantime
+            pass
+        response.close()
+
+    timer = threading.Timer(max(0.0, deadline - time.monotonic()), expire)
+    timer.daemon = True
+    timer.start()
+    try:
+        yield expired
+    finally:
+        timer.cancel()
+
+def _stream(url, kind, destination):
+    max_bytes = MAX_BYTES[kind]
+    deadline = time.monotonic() + DOWNLOAD_DEADLINE
+    try:
+        with span(f"download.{kind}") as download, _open(url) as response, _watchdog(response, deadline) as expired:
+            if response.status_code != 200:
+                raise FetchError(f"HTTP status {response.status_code}")
+
+            content_type = response.headers.get('Content-Type', '').split(';')[0].strip().lower()
+            if content_type and not content_type.startswith(ALLOWED_CONTENT_TYPES[kind]):
+                raise FetchError(f"unexpected content type {content_type}")
+
+            content_length = response.headers.get('Content-Length')
+            if content_length and content_length.isdigit() and int(content_length) > max_bytes:
+                raise FetchError(f"payload of {content_length} bytes exceeds the {max_bytes} byte limit")
+
+            received = 0
+            for chunk in response.iter_content(chunk_size=CHUNK_SIZE):
+                if received == 0 and not sniff_media_type(chunk, kind):
+                    raise FetchError(f"payload does not look like {kind} data")
+                received += len(chunk)
+                if received > max_bytes:
+                    raise FetchError(f"payload exceeds the {max_bytes} byte limit")
+                destination.write(chunk)
+
+            if expired.is_set():
+                raise FetchError(f"download took longer than {DOWNLOAD_DEADLINE} seconds")
+            if received == 0:
+                raise FetchError("empty payload")
+            download.count(f"download.{kind}.bytes", received)
+            logger.info(f"Downloaded {received} bytes of {kind} from {url}")
+
+    except requests.RequestException as e:
+        # A read cut short by the watchdog surfaces as a connection error
+        if time.monotonic() >= deadline:
+            raise FetchError(f"download took longer than {DOWNLOAD_DEADLINE} seconds") from e
+        raise FetchError(str(e)) from e
+
+def sniff_media_type(head, kind):
+    """
+    Checks the leading bytes of a payload against known signatures for a kind of media.
+
+    Args:
+        head (bytes): The first bytes of the payload.
+        kind (str): The kind of media ('image', 'audio' or 'video').
+
+    Returns:
+        bool: True if the bytes match a known signature for the kind.
+    """
+    if kind == 'image':
+        return (
+            head.startswith((b'\xff\xd8\xff', b'\x89PNG\r\n\x1a\n', b'GIF87a', b'GIF89a', b'BM', b'II*\x00', b'MM\x00*'))
+            or (head[:4] == b'RIFF' and head[8:12] == b'WEBP')
+            or head[4:12] in (b'ftypheic', b'ftypheix', b'ftypavif', b'ftypmif1')
+        )
+
+    # Containers shared by audio and video: MP4/MOV/M4A, Matroska/WebM and Ogg
+    if head[4:8] == b'ftyp' or head.startswith((b'\x1a\x45\xdf\xa3', b'OggS')):
+        return True
+    if kind == 'audio':
+        return (
+            head.startswith((b'ID3', b'fLaC', b'#!AMR'))
+            or (head[:4] == b'RIFF' and head[8:12] == b'WAVE')
+            or (len(head) > 1 and head[0] == 0xFF and head[1] & 0xE0 == 0xE0)
+        )
+    return (
+        head.startswith((b'FLV', b'\x00\x00\x01\xba'))
+        or (head[:4] == b'RIFF' and head[8:12] == b'AVI ')
+        or (len(head) > 188 and head[0] == 0x47 and head[188] == 0x47)
+    )
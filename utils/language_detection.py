@@ -1,20 +1,249 @@
-from langdetect import detect, DetectorFactory
+import re
+import functools
+from bisect import bisect_right
 
-# Set seed for consistent results
-DetectorFactory.seed = 0
+# Language code returned when the text gives no usable signal
+DEFAULT_LANGUAGE = 'en'
+
+# Characters examined per sample; enough to tell the language of a passage apart
+SAMPLE_CHARS = 400
+
+# Samples taken evenly across a long text, so that a switch to another language past its
+# start is still seen
+MAX_SAMPLES = 4
+
+# Non-Latin letters inspected by the script fast path
+SCRIPT_SAMPLE_CHARS = 64
+
+# Share of the letters a single script must cover for the fast path to decide
+SCRIPT_MAJORITY = 0.6
+
+# Share of the non-Latin letters that must be kana for Han text to read as Japanese;
+# Chinese text quoting a stray kana character stays Chinese
+KANA_SHARE = 0.1
+
+# Number of distinct samples whose detected language is remembered
+DETECTION_CACHE_SIZE = 4096
+
+# (first code point, last code point, language) of non-Latin scripts
+SCRIPT_RANGES = [
+    (0x0370, 0x03FF, 'el'),
+    (0x0400, 0x052F, 'ru'),
+    (0x0530, 0x058F, 'hy'),
+    (0x0590, 0x05FF, 'he'),
+    (0x0600, 0x06FF, 'ar'),
+    (0x0900, 0x097F, 'hi'),
+    (0x0980, 0x09FF, 'bn'),
+    (0x0A00, 0x0A7F, 'pa'),
+    (0x0A80, 0x0AFF, 'gu'),
+    (0x0B80, 0x0BFF, 'ta'),
+    (0x0C00, 0x0C7F, 'te'),
+    (0x0C80, 0x0CFF, 'kn'),
+    (0x0D00, 0x0D7F, 'ml'),
+    (0x0D80, 0x0DFF, 'si'),
+    (0x0E00, 0x0E7F, 'th'),
+    (0x0E80, 0x0EFF, 'lo'),
+    (0x1000, 0x109F, 'my'),
+    (0x10A0, 0x10FF, 'ka'),
+    (0x1100, 0x11FF, 'ko'),
+    (0x1200, 0x137F, 'am'),
+    (0x1780, 0x17FF, 'km'),
+    (0x3040, 0x30FF, 'ja'),
+    (0x3130, 0x318F, 'ko'),
+    (0x4E00, 0x9FFF, 'zh'),
+    (0xAC00, 0xD7AF, 'ko'),
+]
+
+# Scripts shared by several languages (Cyrillic, Arabic, Devanagari): their most common
+# language is only a guess, so longer texts are left to the n-gram model
+SHARED_SCRIPT_LANGUAGES = frozenset(['ru', 'ar', 'hi'])
+
+# Frequent short words of the Latin-script languages told apart without the n-gram model
+STOPWORDS = {
+    'en': frozenset("the and is are was were you that this with for have not it of to in be my your what will they i me we he she".split()),
+    'fr': frozenset("le la les et est une des du que qui pas pour dans avec ce cette je tu il elle nous vous sont mais sur au aux très".split()),
+    'de': frozenset("der die das und ist nicht ein eine ich du sie wir mit auf für den dem zu von sich auch es sind war aber wie noch".split()),
+    'es': frozenset("el los las y es que una por para con no del se lo como pero muy está son yo tú mi su al más".split()),
+    'it': frozenset("il lo gli le e è che non una per con del della di sono mi ti ma come anche questo molto io tu".split()),
+    'pt': frozenset("o os as e é que não uma um para com do da dos das em no na por mas muito eu você ele".split()),
+    'nl': frozenset("de het een en is niet dat die van ik je jij wij met voor op zijn maar ook er naar wat".split()),
+}
+
+# Words examined by the stopword model, and the hits the best language needs to decide
+MAX_WORDS = 60
+MIN_STOPWORD_HITS = 2
+
+# Texts with fewer words are not worth the n-gram model, which is unreliable on them
+MIN_MODEL_WORDS = 4
+
+_SCRIPT_STARTS = [start for start, _, _ in SCRIPT_RANGES]
+_STOPWORD_LANGUAGES = {}
+for _language, _stopwords in STOPWORDS.items():
+    for _word in _stopwords:
+        _STOPWORD_LANGUAGES[_word] = _STOPWORD_LANGUAGES.get(_word, ()) + (_language,)
+_LATIN_LETTERS = re.compile(r'[A-Za-zÀ-ɏ]')
+_NON_LATIN_LETTERS = re.compile(r'[^\W\d_A-Za-zÀ-ɏ]')
+_WORDS = re.compile(r'[^\W\d_]+')
 
 def detect_language(text):
     """
     Detects the language of the given text.
 
+    Text written mostly in a script used by a single language (Greek, Hebrew, Thai,
+    Japanese kana, Hangul, Han, ...) is decided from its Unicode ranges alone. Latin
+    text is decided from frequent short words when they clearly point to one language.
+    Only the remaining cases go to the langdetect n-gram model, whose profiles are
+    loaded once. Results are cached per text sample.
+
+    Only the start of the text is examined; detect_text_languages also samples the
+    rest of it.
+
     Args:
         text (str): The text to detect language from.
 
     Returns:
         str: The detected language code (e.g., 'en', 'fr').
     """
+    if not text:
+        return DEFAULT_LANGUAGE
+    return _detect_sample(text[:SAMPLE_CHARS])
+
+def detect_text_languages(text):
+    """
+    Detects the languages a text is written in, from up to MAX_SAMPLES samples spread
+    evenly across it.
+
+    Args:
+        text (str): The text to detect languages from.
+
+    Returns:
+        list: The distinct language codes found, in the order they appear in the text.
+    """
+    if len(text) <= SAMPLE_CHARS:
+        return [detect_language(text)]
+    sample_count = min(MAX_SAMPLES, -(-len(text) // SAMPLE_CHARS))
+    step = (len(text) - SAMPLE_CHARS) / (sample_count - 1)
+    languages = []
+    for sample_index in range(sample_count):
+        start = round(sample_index * step)
+        language = _detect_sample(text[start:start + SAMPLE_CHARS])
+        if language not in languages:
+            languages.append(language)
+    return languages
+
+def detect_languages(texts):
+    """
+    Detects the language of several texts.
+
+    Args:
+        texts (list): The texts to detect languages from.
+
+    Returns:
+        list: The detected language code of each text, in the same order.
+    """
+    return [detect_language(text) for text in texts]
+
+@functools.lru_cache(maxsize=DETECTION_CACHE_SIZE)
+def _detect_sample(sample):
+    script_language = None if sample.isascii() else detect_script(sample)
+    if script_language is not None and script_language not in SHARED_SCRIPT_LANGUAGES:
+        return script_language
+
+    words = _WORDS.findall(sample.lower())[:MAX_WORDS]
+    if script_language is None:
+        language = detect_stopwords(words)
+        if language is not None:
+            return language
+    if len(words) < MIN_MODEL_WORDS:
+        return script_language or DEFAULT_LANGUAGE
+    return detect_ngrams(sample, script_language or DEFAULT_LANGUAGE)
+
+def detect_script(sample):
+    """
+    Decides the language from the script most of the letters are written in.
+
+    Args:
+        sample (str): The start of the text.
+
+    Returns:
+        str: The language code (the most common one for scripts in SHARED_SCRIPT_LANGUAGES),
+        or None if no script dominates.
+    """
+    non_latin = _NON_LATIN_LETTERS.findall(sample, 0, SAMPLE_CHARS)[:SCRIPT_SAMPLE_CHARS]
+    if not non_latin:
+        return None
+
+    counts = {}
+    for char in non_latin:
+        index = bisect_right(_SCRIPT_STARTS, ord(char)) - 1
+        if index >= 0 and ord(char) <= SCRIPT_RANGES[index][1]:
+            script = SCRIPT_RANGES[index]
+            counts[script] = counts.get(script, 0) + 1
+
+    if not counts:
+        return None
+    # Japanese mixes kana with Han characters
+    kana_count = sum(count for (_, _, language), count in counts.items() if language == 'ja')
+    if kana_count >= KANA_SHARE * len(non_latin):
+        return 'ja'
+
+    script, script_count = max(counts.items(), key=lambda entry: entry[1])
+    latin_count = len(_LATIN_LETTERS.findall(sample))
+    if script_count < SCRIPT_MAJORITY * (len(non_latin) + latin_count):
+        return None
+    return script[2]
+
+def detect_stopwords(words):
+    """
+    Decides the language of Latin text from its frequent short words.
+
+    Args:
+        words (list): The lowercase words of the text.
+
+    Returns:
+        str: The language code, or None if the words do not clearly point to one language.
+    """
+    hits = dict.fromkeys(STOPWORDS, 0)
+    for word in words:
+        for language in _STOPWORD_LANGUAGES.get(word, ()):
+            hits[language] += 1
+
+    ranked = sorted(hits.items(), key=lambda entry: entry[1], reverse=True)
+    (best, best_hits), (_, second_hits) = ranked[0], ranked[1]
+    if best_hits >= MIN_STOPWORD_HITS and best_hits >= 2 * second_hits:
+        return best
+    return None
+
+def detect_ngrams(sample, fallback=DEFAULT_LANGUAGE):
+    """
+    Detects the language with the langdetect n-gram model.
+
+    Args:
+        sample (str): The start of the text.
+        fallback (str): Language returned if langdetect is unavailable or fails.
+
+    Returns:
+        str: The detected language code.
+    """
+    factory = _ngram_factory()
+    if factory is None:
+        return fallback
     try:
-        language = detect(text)
-        return language
+        detector = factory.create()
+        detector.append(sample)
+        return detector.detect()
     except Exception:
-        return 'en'  # Default to English if detection fails
+        return fallback
+
+@functools.lru_cache(maxsize=None)
+def _ngram_factory():
+    # Loading the language profiles takes a while, so it happens once, on first use
+    try:
+        from langdetect import detector_factory
+    except ImportError:
+        return None
+
+    # Set seed for consistent results
+    detector_factory.DetectorFactory.seed = 0
+    detector_factory.init_factory()
+    return detector_factory._factory
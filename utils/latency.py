@@ -0,0 +1,34 @@
+def percentile(sorted_values, pct):
+    """
+    Returns the nearest-rank percentile of already sorted values.
+
+    Args:
+        sorted_values (list): The values in ascending order.
+        pct (float): The percentile, between 0 and 100.
+
+    Returns:
+        float: The percentile, or 0.0 if there are no values.
+    """
+    if not sorted_values:
+        return 0.0
+    rank = max(1, -(-len(sorted_values) * pct // 100))
+    return sorted_values[int(rank) - 1]
+
+def latency_summary(latencies):
+    """
+    Summarizes request latencies.
+
+    Args:
+        latencies (list): Latencies in seconds.
+
+    Returns:
+        dict: Mean, p50, p95, p99 and max latency in milliseconds.
+    """
+    values = sorted(latencies)
+    return {
+        'mean_ms': round(sum(values) / len(values) * 1000, 1) if values else 0.0,
+        'p50_ms': round(percentile(values, 50) * 1000, 1),
+        'p95_ms': round(percentile(values, 95) * 1000, 1),
+        'p99_ms': round(percentile(values, 99) * 1000, 1),
+        'max_ms': round(values[-1] * 1000, 1) if values else 0.0,
+    }
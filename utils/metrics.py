@@ -0,0 +1,200 @@
+import os
+import time
+import threading
+import contextvars
+from contextlib import contextmanager
+
+# Collect metrics for every moderate_content call unless the caller says otherwise
+METRICS_ENABLED = os.environ.get('MODERATION_METRICS', '').lower() in ('1', 'true', 'yes')
+
+# Prefix of every exported Prometheus metric
+PROMETHEUS_PREFIX = 'content_moderation'
+
+_active_metrics = contextvars.ContextVar('metrics', default=None)
+
+class Metrics:
+    """
+    Thread-safe per-stage timings and named counters.
+
+    Stages are timed with span(); counters hold bytes, frame counts, token usage,
+    cache hits and the like.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._stages = {}
+        self._counters = {}
+
+    def record_stage(self, stage, seconds):
+        with self._lock:
+            timing = self._stages.get(stage)
+            if timing is None:
+                timing = self._stages[stage] = [0, 0.0, 0.0]
+            timing[0] += 1
+            timing[1] += seconds
+            timing[2] = max(timing[2], seconds)
+
+    def count(self, name, amount=1):
+        with self._lock:
+            self._counters[name] = self._counters.get(name, 0) + amount
+
+    def merge(self, other):
+        """
+        Adds another collector's stages and counters to this one.
+
+        Args:
+            other (Metrics): The collector to add.
+        """
+        with other._lock:
+            stages = {stage: list(timing) for stage, timing in other._stages.items()}
+            counters = dict(other._counters)
+        with self._lock:
+            for stage, (calls, seconds, longest) in stages.items():
+                timing = self._stages.setdefault(stage, [0, 0.0, 0.0])
+                timing[0] += calls
+                timing[1] += seconds
+                timing[2] = max(timing[2], longest)
+            for name, amount in counters.items():
+                self._counters[name] = self._counters.get(name, 0) + amount
+
+    def as_dict(self):
+        """
+        Returns:
+            dict: 'stages' with call count, total and longest duration in ms per stage,
+            and 'counters'.
+        """
+        with self._lock:
+            return {
+                'stages': {
+                    stage: {'count': calls, 'total_ms': round(seconds * 1000, 1), 'max_ms': round(longest * 1000, 1)}
+                    for stage, (calls, seconds, longest) in sorted(self._stages.items())
+                },
+                'counters': dict(sorted(self._counters.items())),
+            }
+
+    def to_prometheus(self, prefix=PROMETHEUS_PREFIX):
+        """
+        Renders the collected values in the Prometheus text exposition format.
+
+        Args:
+            prefix (str): Prefix of the metric names.
+
+        Returns:
+            str: The exposition text.
+        """
+        with self._lock:
+            stages = sorted(self._stages.items())
+            counters = sorted(self._counters.items())
+
+        lines = [
+            f"# HELP {prefix}_stage_seconds Time spent in each moderation stage.",
+            f"# TYPE {prefix}_stage_seconds summary",
+        ]
+        for stage, (calls, seconds, _) in stages:
+            lines.append(f'{prefix}_stage_seconds_sum{{stage="{stage}"}} {seconds:.6f}')
+            lines.append(f'{prefix}_stage_seconds_count{{stage="{stage}"}} {calls}')
+        lines += [
+            f"# HELP {prefix}_events_total Bytes, frames, tokens, cache lookups and other counted events.",
+            f"# TYPE {prefix}_events_total counter",
+        ]
+        for name, amount in counters:
+            lines.append(f'{prefix}_events_total{{name="{name}"}} {amount}')
+        return '\n'.join(lines) + '\n'
+
+class Span:
+    """
+    Times one stage and attributes counters to the active collector.
+    """
+
+    __slots__ = ('_metrics', '_stage', '_started')
+
+    def __init__(self, metrics, stage):
+        self._metrics = metrics
+        self._stage = stage
+
+    def __enter__(self):
+        self._started = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc, traceback):
+        self._metrics.record_stage(self._stage, time.perf_counter() - self._started)
+        return False
+
+    def count(self, name, amount=1):
+        self._metrics.count(name, amount)
+
+class NoopSpan:
+    """
+    Stand-in returned by span() when no collector is active.
+    """
+
+    __slots__ = ()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, traceback):
+        return False
+
+    def count(self, name, amount=1):
+        pass
+
+_NOOP_SPAN = NoopSpan()
+
+# Totals of every collector that has finished, for export_prometheus
+process_metrics = Metrics()
+
+def span(stage):
+    """
+    Times a block as a stage of the active collector.
+
+    Costs a single context variable lookup when metrics are disabled.
+
+    Args:
+        stage (str): The stage name, e.g. 'download.image' or 'openai.completions'.
+
+    Returns:
+        Span or NoopSpan: A context manager whose count() adds to the collector's counters.
+    """
+    metrics = _active_metrics.get()
+    if metrics is None:
+        return _NOOP_SPAN
+    return Span(metrics, stage)
+
+def count(name, amount=1):
+    """
+    Adds to a counter of the active collector, if any.
+
+    Args:
+        name (str): The counter name, e.g. 'cache.text.hits'.
+        amount (int): The amount to add.
+    """
+    metrics = _active_metrics.get()
+    if metrics is not None:
+        metrics.count(name, amount)
+
+@contextmanager
+def collect_metrics():
+    """
+    Collects stage timings and counters for the work done inside the block.
+
+    Once the block is done, the collected values are also added to the process-wide
+    totals exported by export_prometheus.
+
+    Yields:
+        Metrics: The collector; read it with as_dict() once the block is done.
+    """
+    metrics = Metrics()
+    token = _active_metrics.set(metrics)
+    try:
+        yield metrics
+    finally:
+        _active_metrics.reset(token)
+        process_metrics.merge(metrics)
+
+def export_prometheus():
+    """
+    Returns:
+        str: Process-wide totals of every collected request, in Prometheus text format.
+    """
+    return process_metrics.to_prometheus()